@@ -10,13 +10,131 @@ st.set_page_config(
 from src.motion_cap import motion_detector
 from src.eval.utils import parse_log_entry
 from src.config import MotionCapConfig
-from dotenv import load_dotenv
 import sys
-import plotly.express as px
+import time
+import queue
+import threading
+import cv2
+from collections import Counter
 from streamlit import runtime
 from streamlit.web import cli
-import pandas as pd
-import os
+
+# How many times per second the dashboard checks the detector for new logs and frames
+REFRESH_RATE = 4
+
+# Maximum number of preview frames per second taken from the detector
+PREVIEW_FPS = 5
+
+# Width (in pixels) preview frames are downsampled to
+PREVIEW_WIDTH = 640
+
+# Maximum number of log messages waiting to be shown. If the dashboard falls this far behind, the detector waits.
+EVENT_QUEUE_SIZE = 1000
+
+# Number of most recent detections shown in the table
+TABLE_ROWS = 200
+
+# Minimum number of seconds between redraws of the chart
+CHART_REFRESH_SECONDS = 2
+
+LOG_COLUMNS = ["bee_id", "timestamp"]
+
+
+def draw_chart(points: Counter):
+    """Plot the detections, downsampled to one point per Bee ID per second (sized by the number of detections)."""
+    # plotting is only needed once there are detections, so don't pay for the imports up front
+    import pandas as pd
+    import plotly.express as px
+
+    data = pd.DataFrame(
+        [(bee_id, timestamp, count) for (bee_id, timestamp), count in points.items()],
+        columns=["bee_id", "timestamp", "detections"],
+    )
+    fig = px.scatter(data, x="timestamp", y="bee_id", size="detections", hover_data=["detections"])
+    fig.update_layout(
+        xaxis_title="Timestamp",
+        yaxis_title="Bee ID",
+        title="Bee IDs Identified over Time",
+        title_font_size=25,
+        hoverlabel=dict(
+            font_size=20,
+        ),
+        yaxis=dict(tickfont=dict(size=20)),
+        xaxis=dict(tickfont=dict(size=20)),
+    )
+    return fig
+
+
+class DetectorWorker:
+    """Runs `motion_detector` in a background thread.
+
+    The detector never touches streamlit. It publishes log messages into a bounded queue, and
+    the latest preview frame (throttled to `PREVIEW_FPS` and downsampled to `PREVIEW_WIDTH`) into
+    a single slot, which the dashboard polls at `REFRESH_RATE`.
+    """
+
+    def __init__(self, config: MotionCapConfig):
+        self.events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.preview_lock = threading.Lock()
+        self.preview = None
+        self.last_preview_time = 0.0
+        self.thread = threading.Thread(
+            target=motion_detector,
+            args=(config,),
+            kwargs=dict(
+                imshow_callback=self.imshow_callback,
+                logging_callback=self.logging_callback,
+                stop_event=self.stop_event,
+            ),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def imshow_callback(self, image):
+        now = time.monotonic()
+        if now - self.last_preview_time < 1 / PREVIEW_FPS:
+            return
+        self.last_preview_time = now
+
+        h, w = image.shape[:2]
+        if w > PREVIEW_WIDTH:
+            image = cv2.resize(image, (PREVIEW_WIDTH, int(h * PREVIEW_WIDTH / w)))
+        else:
+            image = image.copy()
+
+        with self.preview_lock:
+            self.preview = image
+
+    def logging_callback(self, log):
+        while not self.stop_event.is_set():
+            try:
+                self.events.put(log, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def take_preview(self):
+        """Return the newest preview frame, or None if there is no new one since the last call."""
+        with self.preview_lock:
+            image, self.preview = self.preview, None
+        return image
+
+    def drain(self, max_items=EVENT_QUEUE_SIZE) -> list:
+        logs = []
+        while len(logs) < max_items:
+            try:
+                logs.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return logs
+
+    def is_running(self) -> bool:
+        return self.thread.is_alive() or not self.events.empty()
+
+    def stop(self):
+        self.stop_event.set()
+
 
 # Streamlit app code
 def main():
@@ -31,11 +149,7 @@ def main():
 
         # load default config
         DEFAULT_CONFIG = ".env"
-        load_dotenv(DEFAULT_CONFIG)
-        config = MotionCapConfig()
-
-        for key, _ in config.__dict__.items():
-            del os.environ[key]
+        config = MotionCapConfig.from_dotenv(DEFAULT_CONFIG)
 
         st.sidebar.markdown("# Config")
         st.sidebar.markdown(
@@ -45,14 +159,31 @@ def main():
         config_container = st.sidebar.container()
 
         # populate config container
-        for key, value in config.__dict__.items():
+        for key, value in config.to_dict().items():
             config_container.markdown(f"<b>{key}</b>: {value}", unsafe_allow_html=True)
 
         return config
 
     config = load_config()
 
-    start = st.button("Start")
+    if "logs" not in st.session_state:
+        st.session_state["logs"] = []
+        # detections per (bee_id, timestamp), which is what the chart draws
+        st.session_state["points"] = Counter()
+    if "worker" not in st.session_state:
+        st.session_state["worker"] = None
+
+    button_col1, button_col2 = st.columns([1, 8])
+    start = button_col1.button("Start")
+    stop = button_col2.button("Stop")
+
+    worker: DetectorWorker | None = st.session_state["worker"]
+    if stop and worker is not None:
+        worker.stop()
+    if start and (worker is None or not worker.is_running()):
+        st.session_state["logs"] = []
+        st.session_state["points"] = Counter()
+        worker = st.session_state["worker"] = DetectorWorker(config)
 
     header = st.empty()
 
@@ -63,46 +194,63 @@ def main():
     placeholder_log = col2.empty()
     plotly_placeholder = st.empty()
 
-    def imshow_callback(image):
-        placeholder_img.image(image, use_column_width="always")
+    def draw_logs():
+        logs = st.session_state["logs"]
+        placeholder_log.dataframe(logs[: -TABLE_ROWS - 1 : -1], use_container_width=True)
+        if len(logs) > 0:
+            plotly_placeholder.plotly_chart(
+                draw_chart(st.session_state["points"]), use_container_width=True
+            )
 
-    if "logs" not in st.session_state:
-        st.session_state["logs"] = []
+    draw_logs()
+
+    if worker is None:
+        return
+
+    header.markdown("## Motion Detection Feed")
 
-    def logging_callback(log):
-        # update log
-        parsed = parse_log_entry(log, verbose=False)
-        if parsed is not None:
-            # drop "timestamp was edited" key
-            parsed = {k: v for k, v in parsed.items() if k != "timestamp was edited"}
-
-            st.session_state["logs"] = [parsed] + st.session_state["logs"]
-
-        placeholder_log.dataframe(st.session_state["logs"])
-
-        # update plot
-        if len(st.session_state["logs"]) > 0:
-            data = pd.DataFrame(st.session_state["logs"])
-            fig = px.scatter(x=data["timestamp"], y=data["bee_id"])
-            fig.update_layout(
-                xaxis_title="Timestamp",
-                yaxis_title="Bee ID",
-                title="Bee IDs Identified over Time",
-                title_font_size=25,
-                hoverlabel=dict(
-                    font_size=20,
-                ),
-                yaxis=dict(tickfont=dict(size=20)),
-                xaxis=dict(tickfont=dict(size=20)),
+    # poll the detector at a fixed refresh rate, until it finishes and everything it logged is shown.
+    # New detections are appended, and only the table (bounded to TABLE_ROWS) and the
+    # chart (throttled to CHART_REFRESH_SECONDS) are redrawn.
+    last_chart_time = 0.0
+    pending_chart_update = False
+    while True:
+        running = worker.is_running()
+
+        new_logs = 0
+        for log in worker.drain():
+            parsed = parse_log_entry(log, verbose=False)
+            if parsed is not None:
+                entry = {k: parsed[k] for k in LOG_COLUMNS}
+                st.session_state["logs"].append(entry)
+                st.session_state["points"][(entry["bee_id"], entry["timestamp"])] += 1
+                new_logs += 1
+
+        if new_logs:
+            logs = st.session_state["logs"]
+            placeholder_log.dataframe(logs[: -TABLE_ROWS - 1 : -1], use_container_width=True)
+            pending_chart_update = True
+
+        now = time.monotonic()
+        if pending_chart_update and (now - last_chart_time >= CHART_REFRESH_SECONDS or not running):
+            plotly_placeholder.plotly_chart(
+                draw_chart(st.session_state["points"]), use_container_width=True
             )
-            # increase hover text size
-            plotly_placeholder.plotly_chart(fig, use_container_width=True)
+            last_chart_time = now
+            pending_chart_update = False
+
+        image = worker.take_preview()
+        if image is not None:
+            # frames decoded with ffmpeg are grayscale
+            channels = "BGR" if image.ndim == 3 else "RGB"
+            placeholder_img.image(image, channels=channels, use_column_width="always")
+
+        if not running:
+            break
 
-    if start:
-        motion_detector(config, imshow_callback=imshow_callback, logging_callback=logging_callback)
-        header.markdown("## Motion Detection Feed")
+        time.sleep(1 / REFRESH_RATE)
 
-        plotly_placeholder = st.empty()
+    header.markdown("## Motion Detection Feed (finished)")
 
 
 # Driver Code
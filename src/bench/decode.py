@@ -0,0 +1,116 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+import cv2
+from src.utils.video_source import FFmpegFrameSource, OpenCVFrameSource
+from .run import compare, git_commit
+from .synthetic import make_synthetic_video
+
+
+def time_decode(source) -> float:
+    """Frames per second of reading every frame of `source`, converted to gray like the pipeline does."""
+    n_frames = 0
+    start = time.perf_counter()
+    while True:
+        success, frame = source.read()
+        if not success:
+            break
+        if frame.ndim == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        n_frames += 1
+    elapsed = time.perf_counter() - start
+    source.release()
+    return n_frames / elapsed
+
+
+def bench_decode(
+    video: str, ffmpeg: str | None, scales: List[float], threads: int
+) -> Dict[str, dict]:
+    """Decode `video` with each frame source at each scale."""
+    metrics = {}
+    for scale in scales:
+        sources = {"opencv": lambda: OpenCVFrameSource(video, scale)}
+        if ffmpeg:
+            sources["ffmpeg"] = lambda: FFmpegFrameSource(video, scale, threads, ffmpeg)
+            sources["ffmpeg_1_thread"] = lambda: FFmpegFrameSource(video, scale, 1, ffmpeg)
+        for name, open_source in sources.items():
+            fps = time_decode(open_source())
+            metrics[f"{name}@{scale:g}/fps"] = {
+                "value": fps,
+                "unit": "frames/s",
+                "better": "higher",
+            }
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark reading videos with OpenCV against piping them from ffmpeg"
+    )
+    parser.add_argument("videos", nargs="*", help="Videos to decode. Default is a synthetic video")
+    parser.add_argument("--output", "-o", help="Path to write the JSON results to")
+    parser.add_argument("--baseline", "-b", help="Path to JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Relative change counted as a regression"
+    )
+    parser.add_argument("--frames", type=int, default=600, help="Frames of the synthetic video")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5])
+    parser.add_argument("--threads", type=int, default=0, help="ffmpeg decoding threads")
+    parser.add_argument(
+        "--ffmpeg", default="ffmpeg", help="Path to ffmpeg. Only OpenCV is timed if not found"
+    )
+    args = parser.parse_args()
+
+    ffmpeg = args.ffmpeg if shutil.which(args.ffmpeg) else None
+    if ffmpeg is None:
+        print(f"{args.ffmpeg} not found, only OpenCV will be benchmarked.")
+
+    workdir = None
+    videos = args.videos
+    if not videos:
+        workdir = tempfile.mkdtemp(prefix="bee_bench_")
+        videos = [os.path.join(workdir, f"synthetic_{args.frames}.mp4")]
+        make_synthetic_video(videos[0], n_frames=args.frames)
+
+    metrics = {}
+    for video in videos:
+        print(f"Benchmarking {video}...")
+        name = os.path.splitext(os.path.basename(video))[0]
+        for metric, value in bench_decode(video, ffmpeg, args.scales, args.threads).items():
+            metrics[f"{name}/{metric}"] = value
+
+    if workdir:
+        shutil.rmtree(workdir)
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "opencv": cv2.__version__,
+            "videos": videos if args.videos else None,
+            "threads": args.threads,
+        },
+        "metrics": metrics,
+    }
+
+    for name, metric in report["metrics"].items():
+        print(f"{name:<55} {metric['value']:>12.1f} {metric['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.baseline} ({baseline['meta'].get('commit')})")
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,72 @@
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict
+from .run import compare, git_commit
+
+# modules a worker process imports, from the lightest to the heaviest
+MODULES = ["src.config", "src.utils.text_detect", "src.motion_cap", "src.main"]
+
+
+def time_import(statement: str, repeat: int) -> float:
+    """Median wall time (seconds) of a fresh interpreter running `statement`."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def bench_imports(repeat: int) -> Dict[str, dict]:
+    """Time importing each module in a new process, minus the time the interpreter takes to start."""
+    interpreter = time_import("pass", repeat)
+    metrics = {
+        "interpreter/startup_ms": {"value": interpreter * 1000, "unit": "ms", "better": "lower"}
+    }
+    for module in MODULES:
+        elapsed = time_import(f"import {module}", repeat) - interpreter
+        metrics[f"{module}/import_ms"] = {"value": elapsed * 1000, "unit": "ms", "better": "lower"}
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark how long the entry points take to import"
+    )
+    parser.add_argument("--output", "-o", help="Path to write the JSON results to")
+    parser.add_argument("--baseline", "-b", help="Path to JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Relative change counted as a regression"
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="Imports timed per module")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "repeat": args.repeat,
+        },
+        "metrics": bench_imports(args.repeat),
+    }
+
+    for name, metric in report["metrics"].items():
+        print(f"{name:<40} {metric['value']:>10.1f} {metric['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.baseline} ({baseline['meta'].get('commit')})")
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,175 @@
+import argparse
+import datetime
+import json
+import sys
+import time
+from typing import Callable, Dict, List
+import cv2
+import numpy as np
+from src.config import MotionCapConfig
+from src.utils import kernels
+from src.utils.motion_cap_helpers import (
+    RECT_NAMEDTUPLE,
+    find_closest_circle,
+    get_contour_center,
+    overlap,
+)
+from .run import compare, git_commit
+
+# contours per frame to time the kernels at
+SIZES = [10, 100, 1000]
+
+# number of older frames each contour is checked against, as in the default contours window
+WINDOW_FRAMES = 10
+
+
+def make_contours(n: int, seed: int = 0) -> List[np.ndarray]:
+    """`n` contours of random bee sized blobs, as returned by cv2.findContours."""
+    rng = np.random.default_rng(seed)
+    side = 40 * int(np.ceil(np.sqrt(n)))
+    mask = np.zeros((side, side), dtype=np.uint8)
+    # one blob per 40x40 cell, so they don't merge
+    for i in range(n):
+        x, y = 40 * (i % (side // 40)) + 20, 40 * (i // (side // 40)) + 20
+        axes = (int(rng.integers(5, 15)), int(rng.integers(5, 15)))
+        cv2.ellipse(mask, (x, y), axes, int(rng.integers(0, 180)), 0, 360, 255, -1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return list(contours)
+
+
+def filter_loop(contours, tube_hives, config) -> list:
+    """The per-contour filtering `filter_contours` did before the kernels."""
+    kept = []
+    for c in contours:
+        if not config.MIN_CONTOUR_AREA < cv2.contourArea(c) < config.MAX_CONTOUR_AREA:
+            continue
+        bee_id = find_closest_circle(tube_hives, get_contour_center(c), config)
+        kept.append((bee_id, cv2.boundingRect(c)))
+    return kept
+
+
+def filter_kernel(contours, tube_hives, config) -> tuple:
+    """The same work with the kernels."""
+    moments, boxes = kernels.contour_stats(contours)
+    areas = moments[:, 0]
+    kept = (config.MIN_CONTOUR_AREA < areas) & (areas < config.MAX_CONTOUR_AREA)
+    middles = (moments[kept, 1:] / areas[kept, None]).astype(int)
+    circles = np.asarray(tube_hives, dtype=float)
+    distances = np.hypot(
+        middles[:, None, 0] - circles[None, :, 0], middles[:, None, 1] - circles[None, :, 1]
+    )
+    return np.argmin(distances, axis=1), boxes[kept]
+
+
+def overlap_loop(boxes, older_boxes) -> list:
+    """The nested loops `process_contours_window` had before the kernels."""
+    found = []
+    for x1, x2, y1, y2 in boxes:
+        rect = RECT_NAMEDTUPLE(x1, x2, y1, y2)
+        found.append(any(overlap(rect, RECT_NAMEDTUPLE(*older)) for older in older_boxes))
+    return found
+
+
+def time_fn(fn: Callable, args: tuple, min_seconds: float = 0.2) -> float:
+    """Median seconds per call, repeating for at least `min_seconds` (after a warm-up call)."""
+    fn(*args)
+    durations = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_seconds or len(durations) < 3:
+        call_start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - call_start)
+    return float(np.median(durations))
+
+
+def backends() -> Dict[str, tuple]:
+    """The kernel implementations to time. numba is only timed if it is installed."""
+    available = {
+        "numpy": (kernels._contour_stats_numpy, kernels._any_overlap_numpy),
+    }
+    njit = kernels._numba_njit()
+    if njit is not None:
+        available["numba"] = (
+            njit(cache=True)(kernels._contour_stats_loops),
+            njit(cache=True)(kernels._any_overlap_loops),
+        )
+    return available
+
+
+def bench_kernels(sizes: List[int]) -> Dict[str, dict]:
+    config = MotionCapConfig(TIMESTAMP=False, MIN_CONTOUR_AREA=50, MAX_CONTOUR_AREA=1000)
+    metrics = {}
+
+    def add(name, seconds):
+        metrics[name] = {"value": seconds * 1000, "unit": "ms", "better": "lower"}
+
+    for n in sizes:
+        contours = make_contours(n)
+        side = 40 * int(np.ceil(np.sqrt(n)))
+        tube_hives = np.random.default_rng(1).integers(0, side, (20, 3))
+        moments, boxes = kernels.contour_stats(contours)
+        older_boxes = np.concatenate([boxes + shift for shift in range(1, WINDOW_FRAMES + 1)])
+
+        add(f"{n}/filter/loop_ms", time_fn(filter_loop, (contours, tube_hives, config)))
+        add(f"{n}/overlap/loop_ms", time_fn(overlap_loop, (boxes.tolist(), older_boxes.tolist())))
+
+        for backend, selected in backends().items():
+            kernels._kernels = selected
+            add(
+                f"{n}/filter/{backend}_ms",
+                time_fn(filter_kernel, (contours, tube_hives, config)),
+            )
+            add(f"{n}/overlap/{backend}_ms", time_fn(kernels.any_overlap, (boxes, older_boxes)))
+        kernels._kernels = None
+
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the contour kernels against the per-contour Python loops"
+    )
+    parser.add_argument("--output", "-o", help="Path to write the JSON results to")
+    parser.add_argument("--baseline", "-b", help="Path to JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Relative change counted as a regression"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Contours per frame")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "numba": kernels._numba_njit() is not None,
+            "window_frames": WINDOW_FRAMES,
+        },
+        "metrics": bench_kernels(args.sizes),
+    }
+
+    for name, metric in report["metrics"].items():
+        print(f"{name:<40} {metric['value']:>12.4f} {metric['unit']}")
+
+    for n in args.sizes:
+        for stage in ("filter", "overlap"):
+            loop = report["metrics"][f"{n}/{stage}/loop_ms"]["value"]
+            speedups = ", ".join(
+                f"{name.split('/')[-1][:-3]} x{loop / metric['value']:.1f}"
+                for name, metric in report["metrics"].items()
+                if name.startswith(f"{n}/{stage}/") and not name.endswith("loop_ms")
+            )
+            print(f"{n} contours, {stage}: {speedups}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.baseline} ({baseline['meta'].get('commit')})")
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,291 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+import cv2
+import numpy as np
+from src.config import MotionCapConfig
+from src.motion_cap import motion_detector
+from src.utils.motion_cap_helpers import (
+    MotionDetector,
+    build_contour_window_entry,
+    detect_contours_of_motion,
+    detect_tube_hives,
+    filter_contours,
+    preprocess_frame,
+    process_contours_window,
+)
+from src.utils.text_detect import set_tesseract_cmd, text_detect
+from .synthetic import TIMESTAMP_RECT, make_synthetic_video
+
+# name -> arguments of make_synthetic_video
+SCENARIOS = {
+    "calm": dict(n_bees=3, wind=False),
+    "windy": dict(n_bees=3, wind=True),
+    "busy": dict(n_bees=10, wind=False),
+}
+
+# number of frames OCR is timed on, since tesseract is much slower than the other stages
+OCR_CALLS = 20
+
+
+def make_config(video: str, ocr: bool, tesseract: str) -> MotionCapConfig:
+    config = MotionCapConfig(
+        VIDEO=video,
+        TESSERACT=tesseract,
+        TIMESTAMP=ocr,
+        TIMESTAMP_RECT=TIMESTAMP_RECT,
+        SHOW=False,
+        LOG=None,
+        BUFFER_FRAMES=30,
+    )
+
+    # OCR is timed directly, not through motion_detector which would set this
+    set_tesseract_cmd(config.TESSERACT)
+    return config
+
+
+def summarize(durations: List[float], peak_bytes: int | None) -> Dict[str, dict]:
+    durations_ms = sorted(d * 1000 for d in durations)
+    metrics = {
+        "calls": {"value": len(durations_ms), "unit": "calls", "better": None},
+    }
+    if durations_ms:
+        metrics["mean_ms"] = {
+            "value": statistics.fmean(durations_ms),
+            "unit": "ms",
+            "better": "lower",
+        }
+        metrics["median_ms"] = {
+            "value": statistics.median(durations_ms),
+            "unit": "ms",
+            "better": "lower",
+        }
+        metrics["p95_ms"] = {
+            "value": durations_ms[min(len(durations_ms) - 1, int(len(durations_ms) * 0.95))],
+            "unit": "ms",
+            "better": "lower",
+        }
+    if peak_bytes is not None:
+        metrics["peak_kib"] = {"value": peak_bytes / 1024, "unit": "KiB", "better": "lower"}
+    return metrics
+
+
+def time_calls(fn: Callable, calls: List[tuple]) -> List[float]:
+    durations = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def peak_memory(fn: Callable, calls: List[tuple]) -> int:
+    """Peak traced memory (bytes) while making `calls`. Run separately from timing, since tracing is slow."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for args in calls:
+        fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_stage(fn: Callable, calls: List[tuple]) -> Dict[str, dict]:
+    return summarize(time_calls(fn, calls), peak_memory(fn, calls))
+
+
+def bench_scenario(video: str, ocr: bool, tesseract: str) -> Dict[str, dict]:
+    """Time each stage of the pipeline, in the order `motion_detector` runs them, then the whole pipeline."""
+    config = make_config(video, ocr, tesseract)
+    results = {}
+
+    cap = cv2.VideoCapture(video)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    frames = []
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        frames.append(frame)
+    cap.release()
+
+    results["preprocess_frame"] = bench_stage(
+        lambda f: preprocess_frame(f, config), [(f,) for f in frames]
+    )
+    preprocessed = [preprocess_frame(f, config) for f in frames]
+    tube_hives = detect_tube_hives(preprocessed[0])
+
+    # motion is detected between every DETECTION_RATE-th frame
+    pairs = [
+        (preprocessed[i], preprocessed[i - config.DETECTION_RATE], preprocessed[0], config)
+        for i in range(config.DETECTION_RATE, len(preprocessed), config.DETECTION_RATE)
+    ]
+    results["detect_contours_of_motion"] = bench_stage(detect_contours_of_motion, pairs)
+    contours = [detect_contours_of_motion(*args)[0] for args in pairs]
+
+    # the same two stages with preallocated buffers. peak_kib shows what is allocated per frame
+    detector = MotionDetector(config)
+    results["MotionDetector.preprocess"] = bench_stage(detector.preprocess, [(f,) for f in frames])
+
+    def detect(preprocessed, previous, *_):
+        detector.set_previous(previous)
+        return detector.detect(preprocessed)
+
+    results["MotionDetector.detect"] = bench_stage(detect, pairs)
+
+    results["filter_contours"] = bench_stage(
+        filter_contours, [(c, tube_hives, config) for c in contours]
+    )
+    assigned = [filter_contours(c, tube_hives, config) for c in contours]
+
+    detection_frames = [
+        (frames[i], i) for i in range(config.DETECTION_RATE, len(frames), config.DETECTION_RATE)
+    ]
+    build_calls = [(a, f, i, config) for a, (f, i) in zip(assigned, detection_frames)]
+    results["build_contour_window_entry"] = bench_stage(build_contour_window_entry, build_calls)
+    entries = [build_contour_window_entry(*args) for args in build_calls]
+
+    # replay the window the way motion_detector maintains it
+    windows = []
+    window = []
+    for entry in entries:
+        if len(window) == config.CONTOUR_WINDOW_SIZE + 1:
+            window.pop(0)
+        window.append(entry)
+        windows.append((list(window), total_frames, config, None, None))
+    results["process_contours_window"] = bench_stage(process_contours_window, windows)
+
+    if ocr:
+        crops = [
+            (f[config.timestamp_slice],)
+            for f in frames[:: max(1, len(frames) // OCR_CALLS)][:OCR_CALLS]
+        ]
+        results["ocr"] = summarize(time_calls(text_detect, crops), None)
+
+    del frames, preprocessed, pairs, contours, assigned, entries, windows
+
+    start = time.perf_counter()
+    motion_detector(config)
+    elapsed = time.perf_counter() - start
+    end_to_end = summarize([elapsed], peak_memory(motion_detector, [(config,)]))
+    end_to_end["fps"] = {"value": total_frames / elapsed, "unit": "frames/s", "better": "higher"}
+    results["end_to_end"] = end_to_end
+
+    return results
+
+
+def flatten(results: Dict[str, Dict[str, Dict[str, dict]]]) -> Dict[str, dict]:
+    return {
+        f"{scenario}/{stage}/{metric}": value
+        for scenario, stages in results.items()
+        for stage, metrics in stages.items()
+        for metric, value in metrics.items()
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Print the change of every metric in both result files. Returns the metrics that regressed by more than `tolerance`."""
+    regressions = []
+    print(f"{'metric':<55} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, metric in current["metrics"].items():
+        if name not in baseline["metrics"] or metric["better"] is None:
+            continue
+        old, new = baseline["metrics"][name]["value"], metric["value"]
+        change = (new - old) / old if old else 0.0
+        regressed = change > tolerance if metric["better"] == "lower" else change < -tolerance
+        flag = " <-- REGRESSION" if regressed else ""
+        print(f"{name:<55} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the motion detection pipeline")
+    parser.add_argument("--output", "-o", help="Path to write the JSON results to")
+    parser.add_argument("--baseline", "-b", help="Path to JSON results to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Relative change counted as a regression"
+    )
+    parser.add_argument("--frames", type=int, default=300, help="Frames per synthetic video")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument(
+        "--tesseract", default="tesseract", help="Path to tesseract. OCR is skipped if not found"
+    )
+    parser.add_argument(
+        "--workdir", help="Directory for the synthetic videos. Default is a temp dir"
+    )
+    args = parser.parse_args()
+
+    ocr = shutil.which(args.tesseract) is not None
+    if not ocr:
+        print(f"{args.tesseract} not found, OCR will not be benchmarked.")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bee_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = {}
+    for scenario in args.scenarios:
+        video = os.path.join(workdir, f"{scenario}_{args.frames}.mp4")
+        if not os.path.exists(video):
+            make_synthetic_video(video, n_frames=args.frames, **SCENARIOS[scenario])
+
+        print(f"Benchmarking {scenario}...")
+        # the pipeline prints every detection, which would drown out the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results[scenario] = bench_scenario(video, ocr, args.tesseract)
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "frames": args.frames,
+            "ocr": ocr,
+        },
+        "metrics": flatten(results),
+    }
+
+    for name, metric in report["metrics"].items():
+        print(f"{name:<55} {metric['value']:>12.3f} {metric['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.baseline} ({baseline['meta'].get('commit')})")
+        for key in ("frames", "ocr", "opencv", "platform"):
+            if baseline["meta"].get(key) != report["meta"][key]:
+                print(f"WARNING: {key} differs from the baseline, results may not be comparable.")
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,116 @@
+from typing import Tuple
+import cv2
+import numpy as np
+
+# where the synthetic timestamp is drawn, matching the default TIMESTAMP_RECT
+TIMESTAMP_RECT = (210, 20, 510, 50)
+
+
+def make_synthetic_video(
+    fp: str,
+    n_frames: int = 600,
+    size: Tuple[int, int] = (640, 480),
+    n_tubes: int = 20,
+    n_bees: int = 3,
+    wind: bool = False,
+    timestamp: bool = True,
+    fps: int = 30,
+    seed: int = 0,
+) -> str:
+    """Render a deterministic synthetic bee hotel video for benchmarking.
+
+    The video has a textured background with `n_tubes` dark circular tubes, `n_bees` bright blobs
+    flying into (and out of) randomly chosen tubes, optional wind (the whole frame shakes and the
+    lighting flickers) and a rendered timestamp in `TIMESTAMP_RECT`. The same arguments always
+    produce the same video.
+
+    Args:
+        fp (str): Path to write the video to (.mp4)
+        n_frames (int): Number of frames to render
+        size (Tuple[int, int]): The (width, height) of the video
+        n_tubes (int): Number of tubes in the hotel
+        n_bees (int): Number of bees flying at the same time
+        wind (bool): Whether to add wind noise
+        timestamp (bool): Whether to render a timestamp
+        fps (int): Frame rate of the video, also used to advance the timestamp
+        seed (int): Seed of the random number generator
+
+    Returns:
+        str: `fp`
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+
+    # textured background
+    background = rng.integers(60, 140, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (9, 9), 0)
+
+    # tubes on a jittered grid below the timestamp
+    cols = int(np.ceil(np.sqrt(n_tubes * width / height)))
+    rows = int(np.ceil(n_tubes / cols))
+    x_step = width // (cols + 1)
+    y_step = (height - 80) // (rows + 1)
+    tubes = []
+    for i in range(n_tubes):
+        x = x_step * (i % cols + 1) + int(rng.integers(-5, 6))
+        y = 80 + y_step * (i // cols + 1) + int(rng.integers(-5, 6))
+        r = int(rng.integers(14, 22))
+        tubes.append((x, y, r))
+        cv2.circle(background, (x, y), r, (25, 25, 25), -1)
+        cv2.circle(background, (x, y), r + 3, (170, 160, 150), 2)
+
+    # each bee flies a straight line from a random edge point into a tube, then back out
+    flight_frames = 2 * fps
+
+    def new_flight(start_frame):
+        tube = tubes[int(rng.integers(len(tubes)))]
+        origin = (int(rng.integers(0, width)), int(rng.choice([height - 1, 60])))
+        return {"start": start_frame, "origin": origin, "tube": tube}
+
+    flights = [new_flight(int(rng.integers(0, flight_frames))) for _ in range(n_bees)]
+
+    writer = cv2.VideoWriter(fp, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+    for frame_count in range(n_frames):
+        frame = background.copy()
+
+        if wind:
+            dx, dy = rng.normal(0, 1.5, 2)
+            shake = np.float32([[1, 0, dx], [0, 1, dy]])
+            frame = cv2.warpAffine(frame, shake, (width, height), borderMode=cv2.BORDER_REFLECT)
+            frame = cv2.convertScaleAbs(frame, alpha=1.0, beta=float(rng.normal(0, 4)))
+
+        for i, flight in enumerate(flights):
+            t = frame_count - flight["start"]
+            if t >= flight_frames:
+                flights[i] = flight = new_flight(frame_count + int(rng.integers(0, fps)))
+                t = frame_count - flight["start"]
+            if t < 0:
+                continue
+
+            # fly in during the first half, out during the second half, pausing inside the tube
+            progress = 1 - abs(2 * t / flight_frames - 1)
+            if progress > 0.9:
+                continue
+            (ox, oy), (tx, ty, _) = flight["origin"], flight["tube"]
+            x = int(ox + (tx - ox) * progress / 0.9)
+            y = int(oy + (ty - oy) * progress / 0.9)
+            cv2.ellipse(frame, (x, y), (12, 8), 30, 0, 360, (60, 200, 230), -1)
+
+        if timestamp:
+            seconds = frame_count // fps
+            cv2.rectangle(frame, TIMESTAMP_RECT[:2], TIMESTAMP_RECT[2:], (0, 0, 0), -1)
+            cv2.putText(
+                frame,
+                f"2022-05-14_10:{seconds // 60 % 60:02d}:{seconds % 60:02d}",
+                (TIMESTAMP_RECT[0] + 5, TIMESTAMP_RECT[3] - 7),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.8,
+                (255, 255, 255),
+                2,
+            )
+
+        writer.write(frame)
+
+    writer.release()
+    return fp
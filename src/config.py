@@ -1,104 +1,261 @@
-from typing import Tuple, Union
-import pytesseract
+from dataclasses import dataclass, field, fields, replace
+from typing import Any, Mapping, Tuple, Union, get_args, get_origin
+import ast
 import os
+import numpy as np
 
 
+@dataclass(frozen=True, slots=True)
 class MotionCapConfig:
-    def __init__(self):
+    """Configuration of a motion detection run.
 
+    The config is immutable, so it is safe to read in the per-frame loop and cheap to pickle to
+    worker processes. Build it with `from_dotenv`, `from_env` or `from_dict`, and use `replace`
+    to derive a modified copy.
+    """
+
+    # Path to video file
+    VIDEO: str = ""
+
+    # Path to tesseract executable
+    TESSERACT: str = ""
+
+    # Whether a timestamp is present in the video
+    TIMESTAMP: bool = True
+
+    # Coordinates of the timestamp rectangle
+    TIMESTAMP_RECT: Union[Tuple[int, int, int, int], None] = (210, 20, 510, 50)
+
+    # Number of frames to detect motion between
+    DETECTION_RATE: int = 2
+
+    # Threshold for motion detection (higher threshold = more motion needed)
+    MOTION_THRESHOLD: float = 10
+
+    # Minimum area of a contour to be considered motion
+    MIN_CONTOUR_AREA: float = 200
+
+    # Maximum area of a contour to be considered motion
+    MAX_CONTOUR_AREA: float = 1000
+
+    # Minimum number of frames between logging motion. If None defaults to FPS.
+    # Detections of a bee less than this many frames apart are logged as a single event, with its first and last frame
+    MOTION_GRANULARITY: int | None = None
+
+    # Which decoder to read the video with: "opencv" (BGR frames), or "ffmpeg" (gray frames, decoded in a subprocess)
+    DECODER: str = "opencv"
+
+    # Path to ffmpeg executable, used if DECODER is "ffmpeg"
+    FFMPEG: str = "ffmpeg"
+
+    # Factor to downscale frames by while decoding (eg. 0.5 for half the width and height). The settings in
+    # pixels (TIMESTAMP_RECT, contour areas and distances) are given at full size, and scaled to match
+    DECODE_SCALE: float = 1.0
+
+    # Number of threads ffmpeg decodes with. 0 lets ffmpeg decide
+    DECODE_THREADS: int = 0
+
+    # Whether to show the video
+    SHOW: bool = True
+
+    # Path to log file
+    LOG: str | None = None
+
+    # the number of frames to check no overlapping contours for
+    CONTOUR_WINDOW_SIZE: int = 10
+
+    # The number of frames to wait before starting motion detection and finding the tube hives
+    BUFFER_FRAMES: int = 200
+
+    # The maximum distance from any tube a contour can be without being dropped
+    MAX_DISTANCE_FROM_TUBE: int = 20
+
+    # Whether to link contours into tracks across frames, and log one enter/exit event per track,
+    # instead of logging every contour with no overlapping contours in the last CONTOUR_WINDOW_SIZE frames.
+    TRACKING: bool = False
+
+    # The number of detection frames a bee can go undetected before its track ends. A track ending near a
+    # tube is logged as the bee entering it, so this should be shorter than a bee usually stays in a tube.
+    TRACK_MAX_AGE: int = 2
+
+    # The maximum distance (in pixels) a bee can move between detection frames and stay on the same track
+    TRACK_MAX_DISTANCE: float = 50
+
+    # Path to the tube layout file for this camera. If set, detected tubes are saved here and reused on
+    # later runs so Bee IDs are stable across videos. Use one file per camera.
+    TUBE_LAYOUT: str | None = None
+
+    # How far (in pixels) the hotel can move before the stored tube layout is re-detected and remapped
+    TUBE_LAYOUT_TOLERANCE: float = 5
+
+    # The maximum distance (in pixels) between a re-detected tube and a stored tube for them to share a Bee ID
+    TUBE_REMAP_DISTANCE: float = 25
+
+    # The number of frames, spread across the BUFFER_FRAMES warm-up, to detect the tube hives in.
+    # The circles found in each frame are voted on, so a bee or shadow in one frame doesn't add or hide a tube.
+    TUBE_DETECTION_FRAMES: int = 5
+
+    # The minimum fraction of TUBE_DETECTION_FRAMES a tube must be detected in to be kept
+    TUBE_MIN_CONFIDENCE: float = 0.5
+
+    # The maximum distance (in pixels) between circles in different frames for them to be the same tube
+    TUBE_VOTE_DISTANCE: float = 15
+
+    # Directory to cache the preprocessed frames of videos in. The first run on a video writes them, and later runs
+    # with the same DECODER, DECODE_SCALE and TIMESTAMP_RECT read them instead of decoding the video. If None, no cache
+    FRAME_CACHE: str | None = None
+
+    # Maximum size of the FRAME_CACHE in gigabytes. The least recently used videos are deleted to stay under it
+    FRAME_CACHE_SIZE: float = 50
+
+    # Path to write per-stage timings and counters to, in the Prometheus text format. If None, no file is written
+    METRICS: str | None = None
+
+    # Port to serve the metrics on at http://127.0.0.1:<port>/metrics. If None, they are not served
+    METRICS_PORT: int | None = None
+
+    # Number of seconds between writes of the METRICS file
+    METRICS_INTERVAL: float = 10
+
+    # derived values, precomputed once since they are used on every frame
+
+    # (rows, cols) slices of the timestamp rectangle, to crop it with frame[config.timestamp_slice]
+    timestamp_slice: Tuple[slice, slice] | None = field(init=False, repr=False, compare=False)
+
+    # structuring element used to dilate the difference between frames
+    dilation_kernel: np.ndarray = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.TIMESTAMP_RECT is not None and len(self.TIMESTAMP_RECT) != 4:
+            raise ValueError("TIMESTAMP_RECT must be a tuple of 4 integers")
+        if self.TIMESTAMP and self.TIMESTAMP_RECT is None:
+            raise ValueError("Timestamp rectangle coordinates not provided")
+        if self.DETECTION_RATE < 1:
+            raise ValueError("DETECTION_RATE must be greater than or equal to 1")
+        if self.CONTOUR_WINDOW_SIZE < 0:
+            raise ValueError("CONTOUR_WINDOW_SIZE must be greater than or equal to 0")
+        if self.CONTOUR_WINDOW_SIZE == 0:
+            print("CONTOUR_WINDOW_SIZE is 0, no overlapping contours will be checked.")
+        if self.DECODER not in ("opencv", "ffmpeg"):
+            raise ValueError('DECODER must be "opencv" or "ffmpeg"')
+        if not 0 < self.DECODE_SCALE <= 1:
+            raise ValueError("DECODE_SCALE must be greater than 0 and at most 1")
+        if self.TRACK_MAX_AGE < 1:
+            raise ValueError("TRACK_MAX_AGE must be greater than or equal to 1")
+        if self.FRAME_CACHE_SIZE <= 0:
+            raise ValueError("FRAME_CACHE_SIZE must be greater than 0")
+        if self.TUBE_DETECTION_FRAMES < 1:
+            raise ValueError("TUBE_DETECTION_FRAMES must be greater than or equal to 1")
+
+        timestamp_slice = None
+        if self.TIMESTAMP_RECT is not None:
+            x1, y1, x2, y2 = self.TIMESTAMP_RECT
+            timestamp_slice = (slice(y1, y2), slice(x1, x2))
+
+        # the dataclass is frozen, so derived values have to be set around __setattr__
+        object.__setattr__(self, "timestamp_slice", timestamp_slice)
+        object.__setattr__(self, "dilation_kernel", np.ones((5, 5), dtype=np.uint8))
+
+    @classmethod
+    def from_dict(cls, values: Mapping[str, Any]) -> "MotionCapConfig":
+        """Build a config from a mapping of setting name to value. String values (eg. from a .env file)
+        are parsed into the type of the setting. Keys that aren't settings are ignored.
+        """
+        settings = {f.name: f for f in fields(cls) if f.init}
+        parsed = {}
+        for key, value in values.items():
+            if key not in settings:
+                continue
+            parsed[key] = (
+                _parse_value(key, value, settings[key].type) if isinstance(value, str) else value
+            )
+        return cls(**parsed)
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] | None = None) -> "MotionCapConfig":
+        """Build a config from environment variables."""
         print("Loading config from environment variables...")
+        return cls.from_dict(os.environ if environ is None else environ)
+
+    @classmethod
+    def from_dotenv(cls, fp: str, overrides: Mapping[str, Any] | None = None) -> "MotionCapConfig":
+        """Build a config from a .env file. Environment variables take precedence over the file
+        (like `load_dotenv`), and `overrides` (eg. from the command line) take precedence over both.
+        """
+        from dotenv import dotenv_values
+
+        print(f"Loading config from {fp}...")
+        values = {k: v for k, v in dotenv_values(fp).items() if v is not None}
+        values.update({f.name: os.environ[f.name] for f in fields(cls) if f.name in os.environ})
+        values.update(overrides or {})
+        return cls.from_dict(values)
+
+    def replace(self, **changes) -> "MotionCapConfig":
+        """Return a copy of the config with some settings changed."""
+        return replace(self, **changes)
+
+    def scaled(self, scale: float) -> "MotionCapConfig":
+        """Return a copy of the config with the settings in pixels scaled to frames resized by `scale`."""
+        if scale == 1:
+            return self
+        timestamp_rect = self.TIMESTAMP_RECT
+        if timestamp_rect is not None:
+            timestamp_rect = tuple(round(v * scale) for v in timestamp_rect)
+        return self.replace(
+            TIMESTAMP_RECT=timestamp_rect,
+            MIN_CONTOUR_AREA=self.MIN_CONTOUR_AREA * scale**2,
+            MAX_CONTOUR_AREA=self.MAX_CONTOUR_AREA * scale**2,
+            MAX_DISTANCE_FROM_TUBE=round(self.MAX_DISTANCE_FROM_TUBE * scale),
+            TRACK_MAX_DISTANCE=self.TRACK_MAX_DISTANCE * scale,
+            TUBE_LAYOUT_TOLERANCE=self.TUBE_LAYOUT_TOLERANCE * scale,
+            TUBE_REMAP_DISTANCE=self.TUBE_REMAP_DISTANCE * scale,
+            TUBE_VOTE_DISTANCE=self.TUBE_VOTE_DISTANCE * scale,
+        )
+
+    def to_dict(self) -> dict:
+        """The settings of the config, without the derived values."""
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+
+
+def _to_int(value) -> int:
+    """Convert a setting to an int, raising a ValueError instead of dropping a fractional part."""
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            # eg. "2.0" or "1e3"
+            value = float(value)
+    if isinstance(value, bool) or not float(value).is_integer():
+        raise ValueError(f"{value!r} is not an integer")
+    return int(value)
+
+
+def _parse_value(key: str, value: str, type_) -> Any:
+    """Parse a setting from its string form, based on its type annotation (without eval)."""
+    stripped = value.strip()
+
+    # optional settings
+    args = get_args(type_)
+    if type(None) in args:
+        if stripped in ("", "None", "none", "null"):
+            return None
+        type_ = next(arg for arg in args if arg is not type(None))
 
-        # defaults
-
-        # Path to video file
-        self.VIDEO: str = ""
-
-        # Path to tesseract executable
-        self.TESSERACT: str = ""
-
-        # Whether a timestamp is present in the video
-        self.TIMESTAMP: bool = True
-
-        # Coordinates of the timestamp rectangle
-        self.TIMESTAMP_RECT: Union[Tuple[float, float, float, float], None] = (210, 20, 510, 50)
-
-        # Number of frames to detect motion between
-        self.DETECTION_RATE: int = 2
-
-        # Threshold for motion detection (higher threshold = more motion needed)
-        self.MOTION_THRESHOLD: float = 10
-
-        # Minimum area of a contour to be considered motion
-        self.MIN_CONTOUR_AREA: float = 200
-
-        # Maximum area of a contour to be considered motion
-        self.MAX_CONTOUR_AREA: float = 1000
-
-        # Minimum number of frames between logging motion. If None defaults to FPS
-        self.MOTION_GRANULARITY: int | None = None
-
-        # Whether to show the video
-        self.SHOW: bool = True
-
-        # Path to log file
-        self.LOG: str | None = None
-
-        # the number of frames to check no overlapping contours for
-        self.CONTOUR_WINDOW_SIZE: int = 10
-
-        # The number of frames to wait before starting motion detection and finding the tube hives
-        self.BUFFER_FRAMES: int = 200
-
-        # The maximum distance from any tube a contour can be without being dropped
-        self.MAX_DISTANCE_FROM_TUBE: int = 20
-
-        # iterate through environment variables and set them as class variables
-        for key, value in os.environ.items():
-            try:
-                value = eval(value)
-            except:
-                pass
-
-            match key:
-                case "VIDEO":
-                    self.VIDEO = value
-                case "TESSERACT":
-                    self.TESSERACT = value
-                case "TIMESTAMP":
-                    self.TIMESTAMP = value
-                case "TIMESTAMP_RECT":
-                    self.TIMESTAMP_RECT = value
-                case "DETECTION_RATE":
-                    self.DETECTION_RATE = value
-                case "MOTION_THRESHOLD":
-                    self.MOTION_THRESHOLD = value
-                case "MIN_CONTOUR_AREA":
-                    self.MIN_CONTOUR_AREA = value
-                case "MAX_CONTOUR_AREA":
-                    self.MAX_CONTOUR_AREA = value
-                case "MOTION_GRANULARITY":
-                    self.MOTION_GRANULARITY = value
-                case "SHOW":
-                    self.SHOW = value
-                case "LOG":
-                    self.LOG = value
-                case "CONTOUR_WINDOW_SIZE":
-                    self.CONTOUR_WINDOW_SIZE = int(value)
-                    if self.CONTOUR_WINDOW_SIZE < 0:
-                        raise ValueError("CONTOUR_WINDOW_SIZE must be greater than or equal to 0")
-                    if self.CONTOUR_WINDOW_SIZE == 0:
-                        print("CONTOUR_WINDOW_SIZE is 0, no overlapping contours will be checked.")
-                case "BUFFER_FRAMES":
-                    self.BUFFER_FRAMES = int(value)
-                case "MAX_DISTANCE_FROM_TUBE":
-                    self.MAX_DISTANCE_FROM_TUBE = int(value)
-                case _:
-                    pass
-
-        # any special intialization
-        pytesseract.pytesseract.tesseract_cmd = self.TESSERACT
-
-    def __repr__(self):
-        return f"MotionCapConfig({self.__dict__})"
-
-    __str__ = __repr__
+    try:
+        if type_ is bool:
+            if stripped.lower() in ("true", "1", "yes", "on"):
+                return True
+            if stripped.lower() in ("false", "0", "no", "off"):
+                return False
+            raise ValueError(stripped)
+        if type_ is int:
+            return _to_int(stripped)
+        if type_ is float:
+            return float(stripped)
+        if get_origin(type_) is tuple:
+            # literal_eval only accepts literals, so this is safe unlike eval
+            parsed = ast.literal_eval(stripped)
+            return tuple(_to_int(v) for v in parsed)
+        return value
+    except (ValueError, TypeError, SyntaxError) as e:
+        raise ValueError(f"Invalid value for {key}: {value!r}") from e
@@ -0,0 +1,373 @@
+import argparse
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from utils import load_ground_truth, load_log, timestamps_to_seconds
+
+# eg. "2022-05-14_10_00.mp4" or "Ground Truth Bee Events 2022-05-14 10am.csv"
+SESSION_PATTERN = re.compile(
+    r"(?P<date>\d{4}-\d{2}-\d{2})[ _T-]+(?P<hour>\d{1,2})(?:[_:.-]?\d{2})?\s*(?P<ampm>am|pm)?",
+    re.IGNORECASE,
+)
+
+# eg. "10am" in "10am_log.txt"
+HOUR_PATTERN = re.compile(r"(?<!\d)\d{1,2}\s*(?:am|pm)", re.IGNORECASE)
+
+# the breakdowns of the scores, and the column of the captured and ground truth events they group by
+BREAKDOWNS = {"bee": "bee_id", "event": "event", "hour": "hour"}
+
+COUNT_COLUMNS = ["captured", "true_positives", "ground_truth", "found"]
+
+
+def session_key(path: str, camera_pattern: re.Pattern | None = None) -> Tuple[str, str, int] | None:
+    """The (camera, date, hour) a log's video or a ground truth file was recorded at, from its path.
+
+    The camera is the first group of `camera_pattern` matched in the path, or "" without one.
+    """
+    match = SESSION_PATTERN.search(os.path.basename(path))
+    if match is None:
+        return None
+    hour = int(match["hour"])
+    if match["ampm"]:
+        hour = hour % 12 + (12 if match["ampm"].lower() == "pm" else 0)
+
+    camera = ""
+    if camera_pattern is not None:
+        camera_match = camera_pattern.search(path)
+        if camera_match is None:
+            return None
+        camera = camera_match.group(1)
+    return camera, match["date"], hour
+
+
+def log_video(log: str) -> str | None:
+    """The path of the video a log was written for, from its header."""
+    with open(log, "r") as f:
+        for line in f:
+            if line.startswith("--- Logging session started") and " for file " in line:
+                video = line.split(" for file ", 1)[1].rsplit(" ---", 1)[0].strip()
+                # logs written on Windows
+                return video.replace("\\", "/")
+    return None
+
+
+def pair_sessions(
+    logs: List[str], ground_truths: List[str], camera_pattern: re.Pattern | None = None
+) -> Tuple[List[Tuple[Tuple[str, str, int], str, str]], List[str]]:
+    """Pair each log with the ground truth of the same camera, date and hour.
+
+    The session of a log is read from the video named in its header, or from the log's own path.
+    Several logs can be paired with the same ground truth, eg. runs of the detector with different
+    settings on the same video.
+
+    Returns:
+        pairs: the (camera, date, hour), log and ground truth of each pair, by session
+        unpaired: the logs and ground truths without a match
+    """
+    truths = {}
+    unpaired = []
+    for fp in ground_truths:
+        key = session_key(fp, camera_pattern)
+        if key is None:
+            unpaired.append(fp)
+        else:
+            truths[key] = fp
+
+    pairs = []
+    for log in logs:
+        video = log_video(log)
+        key = (video and session_key(video, camera_pattern)) or session_key(log, camera_pattern)
+        if key in truths:
+            pairs.append((key, log, truths[key]))
+        else:
+            unpaired.append(log)
+    paired = {key for key, _, _ in pairs}
+    unpaired += [fp for key, fp in truths.items() if key not in paired]
+    return sorted(pairs), unpaired
+
+
+def log_run(log: str, run_pattern: re.Pattern | None = None) -> str:
+    """The run a log was written by, ie. the detector settings its sessions are totalled with.
+
+    The run is the first group of `run_pattern` matched in the path, or the log's path with its date
+    and hour removed, eg. "logs/10am_log_tight.txt" and "logs/12pm_log_tight.txt" are both of the run
+    "logs/_log_tight.txt".
+    """
+    if run_pattern is not None:
+        match = run_pattern.search(log)
+        if match is not None:
+            return match.group(1)
+    directory, name = os.path.split(log)
+    name = HOUR_PATTERN.sub("", SESSION_PATTERN.sub("", name))
+    return os.path.join(directory, name)
+
+
+def event_type(event_types: pd.Series) -> pd.Series:
+    """Normalize free text event types, eg. "enter head first" or "Exit", to their first word.
+
+    Missing event types stay missing (NA).
+    """
+    return event_types.astype("string").str.strip().str.lower().str.split().str[0]
+
+
+def match_events(
+    captured: pd.DataFrame,
+    ground_truth: pd.DataFrame,
+    buffer: float,
+    check_id: bool,
+    check_event: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Match every captured event against every ground truth event at once.
+
+    A captured event matches a ground truth event if it is within `buffer` seconds of it (or inside
+    it), and has the same Bee ID if `check_id`, as in `measure_IBI_accuracy`. If `check_event`, it
+    also has to be of the same event type, so captured events without one match nothing.
+
+    Returns:
+        true_positives: (n_captured,) bool array of the captured events matching a ground truth event
+        found: (n_ground_truth,) bool array of the ground truth events matched by a captured event
+    """
+    times = captured["seconds"].to_numpy(dtype=float)
+    starts = ground_truth["start_seconds"].to_numpy(dtype=float)
+    ends = ground_truth["end_seconds"].to_numpy(dtype=float)
+
+    matches = (times[:, None] >= starts[None, :] - buffer) & (
+        times[:, None] <= ends[None, :] + buffer
+    )
+    if check_id:
+        matches &= (
+            captured["bee_id"].to_numpy()[:, None] == ground_truth["bee_id"].to_numpy()[None, :]
+        )
+    if check_event:
+        captured_events = captured["event"].fillna("").to_numpy(dtype=object)
+        truth_events = ground_truth["event"].fillna("").to_numpy(dtype=object)
+        matches &= (captured_events[:, None] == truth_events[None, :]) & (
+            captured_events[:, None] != ""
+        )
+    return matches.any(axis=1), matches.any(axis=0)
+
+
+def score_session(
+    key: Tuple[str, str, int], log: str, ground_truth_fp: str, buffer: float, check_id: bool
+) -> pd.DataFrame:
+    """Count the captured, true positive, ground truth and found events of one session, by bee,
+    event type and hour."""
+    captured = load_log(log, verbose=False)
+    captured = captured.assign(
+        seconds=timestamps_to_seconds(captured["timestamp"]),
+        hour=captured["timestamp"].dt.hour,
+        event=event_type(captured["event"]),
+    )
+
+    ground_truth = load_ground_truth(ground_truth_fp)
+    start_seconds = timestamps_to_seconds(ground_truth["Start Timestamp"])
+    # events without an end are only one moment long
+    end_seconds = timestamps_to_seconds(ground_truth["End Timestamp"]).fillna(start_seconds)
+    ground_truth = pd.DataFrame(
+        {
+            "bee_id": ground_truth["Bee ID"],
+            "start_seconds": start_seconds,
+            "end_seconds": np.maximum(start_seconds, end_seconds),
+            "hour": ground_truth["Start Timestamp"].dt.hour,
+            "event": event_type(ground_truth["Event Type"]).fillna("other"),
+        }
+    )
+
+    true_positives, found = match_events(captured, ground_truth, buffer, check_id)
+    # by event type, events only match events of the same type. Captured events without a type (logged
+    # without tracking) are left out, rather than scored as matching any type
+    typed_true_positives, typed_found = match_events(
+        captured, ground_truth, buffer, check_id, check_event=True
+    )
+
+    # captured events are scored (for precision) by their own bee, event type and hour, and ground
+    # truth events (for recall) by theirs
+    counts = []
+    for breakdown, column in BREAKDOWNS.items():
+        if breakdown == "event":
+            by_captured = captured.assign(true_positives=typed_true_positives)
+            by_truth = ground_truth.assign(found=typed_found)
+        else:
+            by_captured = captured.assign(true_positives=true_positives)
+            by_truth = ground_truth.assign(found=found)
+        by_captured = by_captured.groupby(column).agg(
+            captured=("true_positives", "size"), true_positives=("true_positives", "sum")
+        )
+        by_truth = by_truth.groupby(column).agg(
+            ground_truth=("found", "size"), found=("found", "sum")
+        )
+        table = by_captured.join(by_truth, how="outer").fillna(0)
+        table.index = table.index.astype(str)
+        counts.append(table.rename_axis("value").reset_index().assign(breakdown=breakdown))
+    counts.append(
+        pd.DataFrame(
+            {
+                "breakdown": ["all"],
+                "value": ["all"],
+                "captured": [len(captured)],
+                "true_positives": [true_positives.sum()],
+                "ground_truth": [len(ground_truth)],
+                "found": [found.sum()],
+            }
+        )
+    )
+
+    camera, date, hour = key
+    table = pd.concat(counts, ignore_index=True)
+    return table.assign(camera=camera, date=date, session_hour=hour, log=log)
+
+
+def add_scores(counts: pd.DataFrame) -> pd.DataFrame:
+    """Add the precision, recall and F1 of summed counts.
+
+    The F1 is 0 if the precision and recall are both 0, and NaN if either of them is NaN.
+    """
+    counts = counts.copy()
+    counts[COUNT_COLUMNS] = counts[COUNT_COLUMNS].astype(int)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = counts["true_positives"] / counts["captured"]
+        recall = counts["found"] / counts["ground_truth"]
+    counts["precision"] = precision
+    counts["recall"] = recall
+    # 0 when nothing matched, and only NaN if the precision or recall is undefined (nothing to divide by)
+    f1 = 2 * precision * recall / (precision + recall)
+    counts["f1"] = f1.mask((precision == 0) & (recall == 0), 0.0)
+    return counts
+
+
+def batch_evaluate(
+    logs: List[str],
+    ground_truths: List[str],
+    buffer: float = 10,
+    check_id: bool = True,
+    camera_pattern: str | None = None,
+    workers: int | None = None,
+    run_pattern: str | None = None,
+) -> pd.DataFrame:
+    """Score many logs against the ground truths of the same camera, date and hour, in parallel.
+
+    Every captured event within `buffer` seconds of a ground truth event (with the same Bee ID if
+    `check_id`) is a true positive, and every ground truth event with such a captured event is found.
+    Precision is over the captured events, recall over the ground truth events. Logs of the same
+    session are scored side by side, each against the session's ground truth, and the sessions of
+    each run (see `log_run`) are totalled separately, so runs with different settings aren't pooled.
+
+    Args:
+        logs (List[str]): Paths to logs written by the motion detector
+        ground_truths (List[str]): Paths to ground truth CSVs, named with their date and hour, eg.
+            "Ground Truth Bee Events 2022-05-14 10am.csv"
+        buffer (float): Seconds around a ground truth event a captured event can match it in
+        check_id (bool): Whether the Bee IDs have to match
+        camera_pattern (str, optional): Regex whose first group is the camera of a path, eg.
+            "(cam\\d+)". Defaults to all the files being of the same camera
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs
+        run_pattern (str, optional): Regex whose first group is the run of a log path, eg.
+            "logs/(\w+)/". Defaults to the log's path without its date and hour
+
+    Returns:
+        pd.DataFrame: The counts, precision, recall and F1 by bee, event type and hour (and "all") of
+            each log, and of all the logs of each run together (with camera, date, session_hour and
+            log "all")
+
+    Raises:
+        ValueError: If no log could be paired, or a run has several logs of the same session
+    """
+    pattern = re.compile(camera_pattern) if camera_pattern else None
+    pairs, unpaired = pair_sessions(logs, ground_truths, pattern)
+    for fp in unpaired:
+        print(f"No matching log or ground truth for {fp}, skipping it")
+    if not pairs:
+        raise ValueError("No log could be paired with a ground truth")
+
+    run_regex = re.compile(run_pattern) if run_pattern else None
+    runs = {}
+    for key, log, _ in pairs:
+        run = log_run(log, run_regex)
+        if (run, key) in runs:
+            # its ground truth would be counted twice in the totals of the run
+            raise ValueError(
+                f"{runs[run, key]} and {log} are logs of the same session in run {run!r},"
+                " set the run pattern to tell their runs apart"
+            )
+        runs[run, key] = log
+
+    keys, paired_logs, paired_truths = zip(*pairs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        sessions = list(
+            executor.map(
+                score_session,
+                keys,
+                paired_logs,
+                paired_truths,
+                [buffer] * len(pairs),
+                [check_id] * len(pairs),
+            )
+        )
+
+    table = pd.concat(sessions, ignore_index=True)
+    table["run"] = [log_run(log, run_regex) for log in table["log"]]
+    total = table.groupby(["run", "breakdown", "value"], as_index=False, sort=False)[
+        COUNT_COLUMNS
+    ].sum()
+    total = total.assign(camera="all", date="all", session_hour="all", log="all")
+    table = pd.concat([table.astype({"session_hour": str}), total], ignore_index=True)
+
+    columns = ["camera", "date", "session_hour", "run", "log", "breakdown", "value"]
+    return add_scores(table)[columns + COUNT_COLUMNS + ["precision", "recall", "f1"]]
+
+
+def expand_paths(paths: List[str]) -> List[str]:
+    """Expand directories (to the files in them) and glob patterns."""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded += sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            expanded += sorted(glob.glob(path)) or [path]
+    return expanded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score many logs against the ground truths of the same camera, date and hour"
+    )
+    parser.add_argument("--logs", "-l", nargs="+", required=True, help="Logs, directories or globs")
+    parser.add_argument(
+        "--ground-truth",
+        "-g",
+        nargs="+",
+        required=True,
+        help="Ground truth CSVs, directories or globs",
+    )
+    parser.add_argument("--buffer", type=float, default=10, help="Seconds around each event")
+    parser.add_argument(
+        "--ignore-id", action="store_true", help="Don't require the Bee IDs to match"
+    )
+    parser.add_argument("--camera", help="Regex whose first group is the camera of a path")
+    parser.add_argument("--workers", "-w", type=int, help="Number of worker processes")
+    parser.add_argument(
+        "--run",
+        help="Regex whose first group is the run of a log path, to total the logs of each run",
+    )
+    parser.add_argument("--output", "-o", help="Path to write the table to, as CSV")
+    args = parser.parse_args()
+
+    results = batch_evaluate(
+        expand_paths(args.logs),
+        expand_paths(args.ground_truth),
+        args.buffer,
+        not args.ignore_id,
+        args.camera,
+        args.workers,
+        args.run,
+    )
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(results.to_string(index=False, float_format="{:.3f}".format))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,250 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+from utils import parse_detection
+
+# frames sampled from each event for a contact sheet, and the width each one is scaled to
+SHEET_FRAMES = 8
+SHEET_COLUMNS = 4
+SHEET_FRAME_WIDTH = 320
+
+
+def parse_log(log: str) -> Tuple[str | None, Dict[int, Tuple[int, int]], List[dict]]:
+    """Read the video path, the tube hive coordinates (by Bee ID) and the detections from a log.
+
+    Detections are kept even if their timestamp couldn't be read, since the clip will show it.
+    """
+    video = None
+    tube_hives = {}
+    detections = []
+    with open(log, "r") as f:
+        for line in f:
+            if line.startswith("--- Logging session started") and " for file " in line:
+                video = line.split(" for file ", 1)[1].rsplit(" ---", 1)[0].strip()
+            elif "Tube Hive Coords:" in line:
+                bee_id = int(line.split("=")[1].split(" ")[0])
+                coords = line.split("Tube Hive Coords: [")[1].split("]")[0].split()
+                tube_hives[bee_id] = (int(coords[0]), int(coords[1]))
+            else:
+                detection = parse_detection(line)
+                if detection is not None:
+                    detections.append(detection)
+    return video, tube_hives, detections
+
+
+def annotate(frame, detection: dict, frame_number: int, tube) -> None:
+    """Draw the Bee ID, frame number (as it is logged) and the tube of the detection on the frame."""
+    if tube is not None:
+        cv2.circle(frame, tube, 30, (0, 0, 255), 2)
+    label = f"Bee ID={detection['bee_id']} frame {frame_number}"
+    if detection["event"]:
+        label += f" ({detection['event']})"
+    # green while the bee is being detected, white before and after
+    detected = detection["frame"] <= frame_number <= (detection["end_frame"] or detection["frame"])
+    color = (0, 255, 0) if detected else (255, 255, 255)
+    cv2.putText(frame, label, (10, frame.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+
+def contact_sheet(frames: List[np.ndarray]) -> np.ndarray:
+    """Tile frames into a grid of `SHEET_COLUMNS` columns."""
+    h, w = frames[0].shape[:2]
+    size = (SHEET_FRAME_WIDTH, int(h * SHEET_FRAME_WIDTH / w))
+    tiles = [cv2.resize(f, size, interpolation=cv2.INTER_AREA) for f in frames]
+    tiles += [np.zeros_like(tiles[0])] * (-len(tiles) % SHEET_COLUMNS)
+    rows = [np.hstack(tiles[i : i + SHEET_COLUMNS]) for i in range(0, len(tiles), SHEET_COLUMNS)]
+    return np.vstack(rows)
+
+
+def export_events(
+    video: str,
+    jobs: List[Tuple[dict, str, int, int]],
+    tube_hives: Dict[int, Tuple[int, int]],
+    sheet: bool,
+    frame_offset: int = 0,
+) -> List[str]:
+    """Export the clips (or contact sheets) of some events, in one worker process.
+
+    Each job is (detection, output path, first frame, last frame), with 0-based frame indices.
+    Jobs are sorted by their first frame, and the frames between two events are skipped by grabbing
+    them (without decoding) if they are less than a second apart, and by seeking otherwise. Events
+    whose frames overlap the previous one's seek back to their first frame, so the overlapping
+    frames are decoded again.
+    """
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    position = 0
+    written = []
+
+    for detection, output, first, last in jobs:
+        # seek directly to the first frame of the event, unless it is just ahead of the current one
+        if first < position or first - position > fps:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+            position = first
+        while position < first:
+            cap.grab()
+            position += 1
+
+        # frames spread across the event for the contact sheet, replacing the closest with the detection itself
+        sampled = None
+        if sheet:
+            detection_index = detection["frame"] - 1 + frame_offset
+            sampled = np.linspace(first, last, SHEET_FRAMES).astype(int)
+            sampled[np.argmin(np.abs(sampled - detection_index))] = detection_index
+            sampled = set(sampled)
+        tube = tube_hives.get(detection["bee_id"])
+        frames = []
+        writer = None
+        while position <= last:
+            success, frame = cap.read()
+            if not success:
+                break
+            if sheet and position not in sampled:
+                position += 1
+                continue
+            # logged frame numbers count from 1
+            annotate(frame, detection, position + 1 - frame_offset, tube)
+            if sheet:
+                frames.append(frame)
+            else:
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+                writer.write(frame)
+            position += 1
+
+        if writer is not None:
+            writer.release()
+            written.append(output)
+        elif frames:
+            cv2.imwrite(output, contact_sheet(frames))
+            written.append(output)
+
+    cap.release()
+    return written
+
+
+def export_clips(
+    log: str,
+    out_dir: str,
+    video: str | None = None,
+    before: float = 2.0,
+    after: float = 2.0,
+    sheet: bool = False,
+    workers: int | None = None,
+    bee_ids: List[int] | None = None,
+    frame_offset: int = 0,
+) -> str:
+    """Export a short annotated clip (or contact sheet) around each detection in a log.
+
+    Events are split into contiguous runs of frames, one per worker process, so each worker
+    decodes only the frames around its events instead of the whole video. An index.csv of the
+    detections and their clips is written to `out_dir` for reviewing them.
+
+    Args:
+        log (str): Path to the log written by the motion detector
+        out_dir (str): Directory to write the clips to
+        video (str, optional): Path to the video. Defaults to the one named in the log
+        before (float): Seconds of video before each detection
+        after (float): Seconds of video after each detection (or after its last frame)
+        sheet (bool): Write a contact sheet image of each event instead of a clip
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs
+        bee_ids (List[int], optional): Only export the detections of these Bee IDs
+        frame_offset (int): Added to the logged frame numbers, eg. for logs written before the
+            warm-up frames were counted
+
+    Returns:
+        str: Path to the index.csv
+    """
+    logged_video, tube_hives, detections = parse_log(log)
+    video = video or logged_video
+    if video is None or not os.path.exists(video):
+        raise FileNotFoundError(f"Video {video!r} not found, pass it with --video")
+    if bee_ids is not None:
+        detections = [d for d in detections if d["bee_id"] in bee_ids]
+
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    os.makedirs(out_dir, exist_ok=True)
+    extension = "jpg" if sheet else "mp4"
+
+    jobs = []
+    for i, detection in enumerate(detections):
+        # logged frame numbers count from 1
+        frame_index = detection["frame"] - 1 + frame_offset
+        end_index = (detection["end_frame"] or detection["frame"]) - 1 + frame_offset
+        first = max(0, frame_index - int(before * fps))
+        last = min(total_frames - 1, end_index + int(after * fps))
+        name = f"{i:05d}_bee{detection['bee_id']}_frame{detection['frame']}.{extension}"
+        jobs.append((detection, os.path.join(out_dir, name), first, last))
+    jobs.sort(key=lambda job: job[2])
+
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, -(-len(jobs) // workers))
+    chunks = [jobs[i : i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+    written = set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_events, video, chunk, tube_hives, sheet, frame_offset)
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            written.update(future.result())
+            print(f"Exported {len(written)}/{len(jobs)} events")
+
+    index = os.path.join(out_dir, "index.csv")
+    with open(index, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["bee_id", "frame", "end_frame", "event", "timestamp", "clip"])
+        for detection, output, _, _ in sorted(jobs, key=lambda job: job[1]):
+            writer.writerow(
+                [
+                    detection["bee_id"],
+                    detection["frame"],
+                    detection["end_frame"],
+                    detection["event"],
+                    detection["timestamp"],
+                    os.path.basename(output) if output in written else "",
+                ]
+            )
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export annotated clips (or contact sheets) around each detection in a log"
+    )
+    parser.add_argument("log", help="Path to the log written by the motion detector")
+    parser.add_argument("--out", "-o", default="clips", help="Directory to write the clips to")
+    parser.add_argument("--video", "-v", help="Path to the video. Defaults to the one in the log")
+    parser.add_argument("--before", type=float, default=2.0, help="Seconds before each detection")
+    parser.add_argument("--after", type=float, default=2.0, help="Seconds after each detection")
+    parser.add_argument(
+        "--sheet", action="store_true", help="Write contact sheet images instead of clips"
+    )
+    parser.add_argument("--workers", "-w", type=int, help="Number of worker processes")
+    parser.add_argument("--bee-ids", type=int, nargs="+", help="Only export these Bee IDs")
+    parser.add_argument(
+        "--frame-offset", type=int, default=0, help="Added to the logged frame numbers"
+    )
+    args = parser.parse_args()
+
+    index = export_clips(
+        args.log,
+        args.out,
+        args.video,
+        args.before,
+        args.after,
+        args.sheet,
+        args.workers,
+        args.bee_ids,
+        args.frame_offset,
+    )
+    print(f"Index of the exported events written to {index}")
@@ -1,5 +1,5 @@
 import pandas as pd
-from utils import load_log, timestamp_to_seconds
+from utils import load_ground_truth, load_log, timestamp_to_seconds
 import sys
 
 
@@ -112,7 +112,7 @@ def measure_IBI_accuracy(
 
 if __name__ == "__main__":
     # parse the first argument as the path to the ground truth data, and the second as the path to the captured data
-    ground_truth = pd.read_csv(sys.argv[1])
+    ground_truth = load_ground_truth(sys.argv[1])
     captured = load_log(sys.argv[2], verbose=False)
 
     # measure the accuracy of the captured data
@@ -1,5 +1,8 @@
-import pandas as pd
 from datetime import datetime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 def timestamp_to_seconds(timestamp: str) -> float:
@@ -20,12 +23,45 @@ def timestamp_to_seconds(timestamp: str) -> float:
     return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
 
 
-def parse_log_entry(entry: str, verbose=True) -> dict | None:
+def parse_detection(entry: str) -> dict | None:
+    """Parse the fields of a detection line of the log, without cleaning the timestamp.
+
+    eg. "Bee ID=4 detected at frame 1200/18000 (enter, to frame 1260), Timestamp: 10:00:40"
+    """
     if "detected at" not in entry:
         return None
 
     bee_id = int(entry.split("=")[1].split(" ")[0])
-    timestamp_to_parse = entry.split(" ")[-1].strip()
+    frame = int(entry.split("detected at frame ")[1].split("/")[0])
+
+    # eg. "(enter, to frame 130)" when the detection was made by tracking, and repeated detections
+    # of the bee up to frame 130 were logged as this one
+    event = None
+    end_frame = None
+    details = entry.split(", Timestamp:")[0]
+    if details.endswith(")") and "(" in details:
+        for detail in details[details.rindex("(") + 1 : -1].split(", "):
+            if detail.startswith("to frame "):
+                end_frame = int(detail[len("to frame ") :])
+            else:
+                event = detail
+
+    return {
+        "bee_id": bee_id,
+        "frame": frame,
+        "end_frame": end_frame,
+        "event": event,
+        "timestamp": entry.split(" ")[-1].strip(),
+    }
+
+
+def parse_log_entry(entry: str, verbose=True) -> dict | None:
+    detection = parse_detection(entry)
+    if detection is None:
+        return None
+
+    bee_id = detection["bee_id"]
+    timestamp_to_parse = detection["timestamp"]
 
     ####################
     # clean timestamps #
@@ -72,10 +108,18 @@ def parse_log_entry(entry: str, verbose=True) -> dict | None:
             print("Unable to parse timestamp:", timestamp_to_parse)
         return None
 
-    return {"bee_id": bee_id, "timestamp": timestamp, "timestamp was edited": edited_timestamp}
+    return {
+        "bee_id": bee_id,
+        "timestamp": timestamp,
+        "timestamp was edited": edited_timestamp,
+        "event": detection["event"],
+        "frame": detection["frame"],
+        "end_frame": detection["end_frame"],
+    }
 
 
-def load_log(log, verbose=True) -> pd.DataFrame:
+def load_log(log, verbose=True) -> "pd.DataFrame":
+    import pandas as pd
 
     with open(log, "r") as f:
         lines = f.readlines()
@@ -92,3 +136,35 @@ def load_log(log, verbose=True) -> pd.DataFrame:
     df = pd.DataFrame(logs)
     df["timestamp"] = df["timestamp"]
     return df
+
+
+def normalize_timestamps(timestamps: "pd.Series") -> "pd.Series":
+    """Parse a column of "HH:MM:SS" timestamps, also written as "HH.MM.SS", to datetimes.
+
+    Missing or unreadable timestamps become NaT. The date is 1900-01-01, as for `parse_log_entry`.
+    """
+    import pandas as pd
+
+    cleaned = timestamps.astype("string").str.strip().str.replace(".", ":", regex=False)
+    return pd.to_datetime(cleaned, format="%H:%M:%S", errors="coerce")
+
+
+def timestamps_to_seconds(timestamps: "pd.Series") -> "pd.Series":
+    """The seconds since midnight of a column of datetimes, like `timestamp_to_seconds`."""
+    return timestamps.dt.hour * 3600 + timestamps.dt.minute * 60 + timestamps.dt.second
+
+
+def load_ground_truth(fp: str) -> "pd.DataFrame":
+    """Load a ground truth CSV of bee events, with its timestamps parsed to datetimes.
+
+    Columns are "Bee ID", "Start Timestamp", "End Timestamp" and "Event Type". Rows without a
+    readable start are dropped.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(fp, dtype={"Start Timestamp": str, "End Timestamp": str})
+    # rows written with a trailing comma add an empty, unnamed column
+    df = df.loc[:, ~df.columns.str.startswith("Unnamed")]
+    df["Start Timestamp"] = normalize_timestamps(df["Start Timestamp"])
+    df["End Timestamp"] = normalize_timestamps(df["End Timestamp"])
+    return df.dropna(subset=["Start Timestamp"]).reset_index(drop=True)
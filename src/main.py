@@ -1,13 +1,13 @@
 import argparse
 from src.motion_cap import motion_detector
-from colorama import init
-from termcolor import colored
-import pytesseract
-from dotenv import load_dotenv
+from src.utils.frame_bus import run_fanout
 from src.config import MotionCapConfig
 
 
 def startup_message():
+    # only needed for the banner, so not imported by workers that import this module
+    from colorama import init
+    from termcolor import colored
 
     init()
 
@@ -27,25 +27,41 @@ def startup_message():
     )
 
 
-def validate_args(args):
-    # TODO: Move this to config.py
-    if len(args["timestamp_rect"]) != 4:
-        raise ValueError("Timestamp rectangle must be a list of 4 integers")
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--config",
         "-c",
-        help="Path to .env file. Default is .env",
-        default=".env",
+        nargs="+",
+        help=(
+            "Path to .env file. Default is .env. With several, the video is decoded once and"
+            " detection runs with each of them in parallel"
+        ),
+        default=[".env"],
+    )
+    parser.add_argument(
+        "--set",
+        "-s",
+        nargs="*",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Override config values, eg. --set SHOW=False LOG=log.txt",
     )
     args = vars(parser.parse_args())
 
-    # Load the .env file
-    load_dotenv(args["config"])
+    overrides = {}
+    for override in args["set"]:
+        key, sep, value = override.partition("=")
+        if not sep:
+            parser.error(f"Invalid override {override!r}, expected KEY=VALUE")
+        overrides[key] = value
+
+    # Load the .env files
+    configs = [MotionCapConfig.from_dotenv(fp, overrides) for fp in args["config"]]
 
     startup_message()
 
-    motion_detector(config=MotionCapConfig())
+    if len(configs) == 1:
+        motion_detector(config=configs[0])
+    else:
+        run_fanout(configs)
@@ -1,8 +1,24 @@
 import datetime
 from typing import List, Callable
 import cv2
-from .utils.motion_cap_helpers import *
-from .utils.logging import *
+from .utils.motion_cap_helpers import (
+    MotionDetector,
+    build_contour_window_entry,
+    filter_contours,
+    log_bursts,
+    process_contours_window,
+    process_track_events,
+)
+from .utils.tracking import BeeTracker
+from .utils.debounce import EventDebouncer
+from .utils.logging import init_logging_session
+from .utils.text_detect import set_tesseract_cmd
+from .utils.tube_layout import load_or_detect_tube_hives
+from .utils.tube_detection import TubeHiveVoter, sample_frame_indices
+from .utils.metrics import make_metrics
+from .utils.video_source import open_frame_source
+from .utils.frame_cache import FrameCache, cache_key
+import os
 from src.config import MotionCapConfig
 
 
@@ -10,6 +26,9 @@ def motion_detector(
     config: MotionCapConfig,
     imshow_callback: Callable = None,
     logging_callback: Callable = None,
+    stop_event=None,
+    frame_source=None,
+    progress_callback: Callable = None,
 ):
     """Detect motion in a video
 
@@ -17,6 +36,9 @@ def motion_detector(
         config (MotionCapConfig): Configuration object
         imshow_callback (callable, optional): Callback function to display the image. Defaults to None. (this is used for the streamlit app)
         logging_callback (callable, optional): Callback function to display the log. Defaults to None. (this is used for the streamlit app)
+        stop_event (threading.Event, optional): Detection stops once this event is set. Defaults to None. (this is used for the streamlit app)
+        frame_source (optional): Source to read the frames of `config.VIDEO` from, eg. a `FrameBusReader`. Its frames must be scaled by `config.DECODE_SCALE`. Defaults to opening the video with `config.DECODER`.
+        progress_callback (callable, optional): Called with the number of frames read so far and the total number of frames, about once per second of video. Defaults to None. (this is used for the job service)
     """
 
     # region init
@@ -29,85 +51,257 @@ def motion_detector(
     if config.LOG:
         init_logging_session(config.LOG, config.VIDEO, logging_callback)
 
-    cap = cv2.VideoCapture(config.VIDEO)
+    # the resources opened by the setup (the video, the cache entry, background tube detection and
+    # metrics) are closed even if the setup or detection fails
+    source = frame_source
+    cache_writer = tube_voter = metrics = None
+    # whether every frame of the video was read, ie. detection wasn't stopped early
+    finished = False
+    try:
+        # with a frame cache, the frames are read already preprocessed if the video is in it,
+        # and written to it as they are preprocessed otherwise
+        frame_cache = video_key = cached = cache_writer = None
+        if config.FRAME_CACHE:
+            frame_cache = FrameCache(config.FRAME_CACHE, config.FRAME_CACHE_SIZE)
+            video_key = cache_key(config)
+            if frame_source is None:
+                cached = frame_cache.open(video_key)
 
-    if config.MOTION_GRANULARITY is None:
-        config.MOTION_GRANULARITY = int(cap.get(cv2.CAP_PROP_FPS))
+        source = frame_source or cached or open_frame_source(config)
 
-    TOTAL_FRAMES = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-    frame_count = 0
-    previous_frame = None
-    tube_hives = []
+        # the settings in pixels are given for full size frames
+        config = config.scaled(config.DECODE_SCALE)
 
-    # contours window is a list of contours information for the last config.CONTOUR_WINDOW_SIZE+1 frames
-    # each element is a list of the contour information that happened in the associated frame.
-    # Each contour information is a dictionary of {bee_id, frame, bb}. (bb = bounding box)
-    # The last element in the list is the most recent frame.
-    # The first element is the oldest frame, being CONTOUR_WINDOW_SIZE frames ago.
-    contours_window: List[List[dict]] = []
+        if frame_cache is not None and cached is None:
+            cache_writer = frame_cache.create(video_key, source, config)
 
-    # endregion
+        set_tesseract_cmd(config.TESSERACT)
 
-    while True:
+        motion_granularity = config.MOTION_GRANULARITY
+        if motion_granularity is None:
+            motion_granularity = int(source.fps)
 
-        # ignore the first `BUFFER_FRAMES` frames to allow the camera to adjust to the environment
-        if frame_count < config.BUFFER_FRAMES:
-            frame_count += 1
-            continue
-
-        # log detected bee based on the processed contours window
-        # This will happen CONTOUR_WINDOW_SIZE frames after the last time a bee was detected, since it needs to compare this many frames
-        # the logging itself, however, will have the correct frame number of when the bee was detected.
-        # NOTE: This is where the logging and displaying of the image happens
-        process_contours_window(
-            contours_window, TOTAL_FRAMES, config, imshow_callback, logging_callback
+        TOTAL_FRAMES = source.total_frames
+
+        # frames between calls to `progress_callback`
+        progress_interval = max(1, int(source.fps))
+
+        # repeated detections of a bee less than `motion_granularity` frames apart are logged as one event
+        debouncer = EventDebouncer(motion_granularity)
+
+        # per-stage timers and counters. These are no-ops unless METRICS or METRICS_PORT is set
+        metrics = make_metrics(config)
+
+        # preprocesses frames and detects motion between them, reusing the same buffers for every frame
+        detector = MotionDetector(config)
+
+        def preprocess(frame):
+            if cached is not None:
+                return cached.preprocessed
+            preprocessed = detector.preprocess(frame)
+            if cache_writer is not None:
+                cache_writer.write(preprocessed, frame)
+            return preprocessed
+
+        frame_count = 0
+        tube_hives = []
+
+        # tube hives are detected in several frames across the warm-up period, and voted on.
+        # Detection runs in the background while the rest of the warm-up is decoded, unless a stored
+        # tube layout for this camera will likely make it unnecessary.
+        tube_sample_frames = set(
+            sample_frame_indices(config.BUFFER_FRAMES, config.TUBE_DETECTION_FRAMES)
+        )
+        tube_voter = TubeHiveVoter(
+            len(tube_sample_frames),
+            config.TUBE_MIN_CONFIDENCE,
+            config.TUBE_VOTE_DISTANCE,
+            eager=not (config.TUBE_LAYOUT and os.path.exists(config.TUBE_LAYOUT)),
+            scale=config.DECODE_SCALE,
         )
 
-        # read and preprocess the frame
-        success, frame = cap.read()
-        if not success:
-            break
-        preprocessed = preprocess_frame(frame, config)
-
-        # Once we have reached the `BUFFER_FRAMES`th frame, we grab the tube hive coordinates and assign them to Bee IDs
-        if frame_count == config.BUFFER_FRAMES:
-            tube_hives = get_tube_hives_coords(preprocessed, config.LOG, logging_callback)
-            base_frame = preprocessed
-
-        # determine motion on every `DETECTION_RATE-th frame
-        frame_count += 1
-        if (frame_count % config.DETECTION_RATE) == 0:
-            # 3. Set previous frame and continue if there is None
-            if previous_frame is None:
-                # First frame; there is no previous one yet
-                previous_frame = preprocessed
-                continue
+        # contours window is a list of contours information for the last config.CONTOUR_WINDOW_SIZE+1 frames
+        # each element is a list of the contour information that happened in the associated frame.
+        # Each contour information is a dictionary of {bee_id, frame, bb}. (bb = bounding box)
+        # The last element in the list is the most recent frame.
+        # The first element is the oldest frame, being CONTOUR_WINDOW_SIZE frames ago.
+        contours_window: List[List[dict]] = []
 
-            # Detect motion and grab the contours that represent this motion
-            contours, previous_frame = detect_contours_of_motion(
-                preprocessed, previous_frame, base_frame, config
+        # with TRACKING, contours are linked into tracks instead, and one event is logged per track
+        tracker = None
+        if config.TRACKING:
+            tracker = BeeTracker(
+                config.TRACK_MAX_DISTANCE,
+                config.TRACK_MAX_AGE * config.DETECTION_RATE,
+                config.timestamp_slice if config.TIMESTAMP else None,
             )
 
-            # filter out contours on size and distance to tubes.
-            # This will also assign bee_ids to the contours
-            # NOTE: This is where the bee_ids are assigned
-            assigned_contours = filter_contours(contours, tube_hives, config)
+        # the last frame read, for showing the events of the tracks still active at the end of the video
+        last_frame = None
 
-            # build the contour window entry for this frame
-            contour_window_entry = build_contour_window_entry(
-                assigned_contours, frame, frame_count, config
-            )
+        # endregion
 
-            # add to contours window, maintaining window size
-            if len(contours_window) == config.CONTOUR_WINDOW_SIZE + 1:
-                contours_window.pop(0)
-            contours_window.append(contour_window_entry)
+        while True:
 
-        # check for quit operation
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            print("Exiting by user input.")
-            break
+            if stop_event is not None and stop_event.is_set():
+                print("Exiting by stop request.")
+                break
+
+            if progress_callback is not None and frame_count % progress_interval == 0:
+                progress_callback(frame_count, TOTAL_FRAMES)
+
+            # skip the first `BUFFER_FRAMES` frames to allow the camera to adjust to the environment,
+            # only decoding the ones sampled for tube detection
+            if frame_count < config.BUFFER_FRAMES:
+                # every frame is preprocessed while it is being cached
+                with metrics.stage("decode"):
+                    if frame_count in tube_sample_frames or cache_writer is not None:
+                        success, frame = source.read()
+                        if success:
+                            preprocessed = preprocess(frame)
+                            if frame_count in tube_sample_frames:
+                                tube_voter.add(preprocessed)
+                    else:
+                        success = source.grab()
+                if not success:
+                    finished = True
+                    break
+                metrics.incr("frames_skipped")
+                frame_count += 1
+                continue
 
-    cap.release()
-    cv2.destroyAllWindows()
+            # read and preprocess the frame
+            with metrics.stage("decode"):
+                success, frame = source.read()
+            if not success:
+                finished = True
+                break
+            # frames shared with other processes (see `frame_bus`) are read-only, copy them to draw on
+            if config.SHOW and not frame.flags.writeable:
+                frame = frame.copy()
+            # the read that ends the video returns no frame, so the last one is kept for the final events
+            last_frame = frame
+            metrics.incr("frames_decoded")
+            with metrics.stage("preprocess"):
+                preprocessed = preprocess(frame)
+
+            # Once we have reached the `BUFFER_FRAMES`th frame, we grab the tube hive coordinates and assign them to Bee IDs.
+            # If a tube layout is stored for this camera, it is reused so Bee IDs match across videos.
+            if frame_count == config.BUFFER_FRAMES:
+                tube_voter.add(preprocessed)
+                with metrics.stage("tube_detection"):
+                    tube_hives = load_or_detect_tube_hives(
+                        preprocessed, config, logging_callback, detect=tube_voter.result
+                    )
+
+            # determine motion on every `DETECTION_RATE-th frame
+            frame_count += 1
+            if (frame_count % config.DETECTION_RATE) == 0:
+                # 3. Set previous frame and continue if there is None
+                if detector.previous is None:
+                    # First frame; there is no previous one yet
+                    detector.set_previous(preprocessed)
+                    continue
+
+                # Detect motion and grab the contours that represent this motion
+                with metrics.stage("detect"):
+                    contours = detector.detect(preprocessed)
+                metrics.incr("contours_found", len(contours))
+
+                # filter out contours on size and distance to tubes.
+                # This will also assign bee_ids to the contours
+                # NOTE: This is where the bee_ids are assigned
+                with metrics.stage("filter"):
+                    assigned_contours = filter_contours(
+                        contours, tube_hives, config, keep_unassigned=tracker is not None
+                    )
+                metrics.incr("contours_after_filtering", len(assigned_contours))
+
+                if tracker is not None:
+                    # link the contours to the active tracks, and log the tracks that ended
+                    with metrics.stage("track"):
+                        events = tracker.update(assigned_contours, frame, frame_count)
+                    metrics.incr("track_events", len(events))
+                    with metrics.stage("window"):
+                        process_track_events(
+                            events,
+                            frame,
+                            TOTAL_FRAMES,
+                            config,
+                            imshow_callback,
+                            logging_callback,
+                            debouncer,
+                            metrics,
+                        )
+                else:
+                    # build the contour window entry for this frame
+                    with metrics.stage("build"):
+                        contour_window_entry = build_contour_window_entry(
+                            assigned_contours, frame, frame_count, config
+                        )
+                    metrics.incr("window_entries")
+
+                    # add to contours window, maintaining window size
+                    if len(contours_window) == config.CONTOUR_WINDOW_SIZE + 1:
+                        contours_window.pop(0)
+                    contours_window.append(contour_window_entry)
+
+                    # log detected bee based on the processed contours window.
+                    # This only needs to happen when the window changes, otherwise the same contours would be logged again.
+                    # NOTE: This is where the logging and displaying of the image happens
+                    with metrics.stage("window"):
+                        process_contours_window(
+                            contours_window,
+                            TOTAL_FRAMES,
+                            config,
+                            imshow_callback,
+                            logging_callback,
+                            debouncer,
+                            metrics,
+                        )
+
+                # log the bursts of detections of bees that haven't been seen for `motion_granularity` frames
+                with metrics.stage("log"):
+                    log_bursts(
+                        debouncer.expire(frame_count),
+                        TOTAL_FRAMES,
+                        config,
+                        logging_callback,
+                        metrics,
+                    )
+            else:
+                metrics.incr("frames_skipped")
+
+            metrics.maybe_emit()
+
+            # check for quit operation. Only possible when showing the OpenCV window,
+            # the callbacks may be called from a background thread (eg. the streamlit app)
+            if config.SHOW and imshow_callback is None and cv2.waitKey(1) & 0xFF == ord("q"):
+                print("Exiting by user input.")
+                break
+
+        # the tracks still active at the end of the video have ended too
+        if tracker is not None and frame_count > config.BUFFER_FRAMES:
+            process_track_events(
+                tracker.flush(),
+                last_frame,
+                TOTAL_FRAMES,
+                config,
+                imshow_callback,
+                logging_callback,
+                debouncer,
+                metrics,
+            )
+        log_bursts(debouncer.flush(), TOTAL_FRAMES, config, logging_callback, metrics)
+    finally:
+        if cache_writer is not None and cache_writer.close(finished):
+            print(f"Preprocessed frames of {config.VIDEO} cached in {config.FRAME_CACHE}")
+        if tube_voter is not None:
+            tube_voter.close()
+        if metrics is not None:
+            metrics.close()
+        if source is not None:
+            source.release()
+        if config.SHOW and imshow_callback is None:
+            cv2.destroyAllWindows()
     print(f"\nFinished processing {config.VIDEO}")
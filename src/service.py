@@ -0,0 +1,497 @@
+"""A job service for running the motion detector on many videos, shared by several users.
+
+The service listens on a local socket (TCP on 127.0.0.1, or a Unix socket) for newline-delimited
+JSON commands, and runs the submitted jobs with up to `--workers` at a time, each in its own process.
+Commands (one JSON object per line, each answered with one JSON object per line):
+
+    {"command": "submit", "video": "video.mp4", "camera": "cam1", "set": {"MOTION_THRESHOLD": 15}}
+    {"command": "watch", "job": "3"}    streams the job's log lines and progress until it has ended
+    {"command": "cancel", "job": "3"}
+    {"command": "status"}               or {"command": "status", "job": "3"}
+
+Usage:
+    python -m src.service serve --config .env --workers 2
+    python -m src.service submit path/to/video.mp4 --camera cam1 --set TRACKING=True --watch
+    python -m src.service status
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import re
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Set
+from src.config import MotionCapConfig
+from src.motion_cap import motion_detector
+
+DEFAULT_PORT = 8765
+
+# seconds between the progress updates sent to watchers of a job
+PROGRESS_INTERVAL = 1.0
+
+# seconds a cancelled job has to stop by itself before its process is terminated
+CANCEL_TIMEOUT = 10
+
+# seconds the event pump waits for an event before checking that the job's process is still running
+POLL_INTERVAL = 0.5
+
+ENDED = ("done", "failed", "cancelled")
+
+# the settings jobs can override. The others (executables, output paths, ports) are the service's own,
+# since any local user can submit jobs
+JOB_SETTINGS = {
+    "TIMESTAMP",
+    "TIMESTAMP_RECT",
+    "DETECTION_RATE",
+    "MOTION_THRESHOLD",
+    "MIN_CONTOUR_AREA",
+    "MAX_CONTOUR_AREA",
+    "MOTION_GRANULARITY",
+    "DECODER",
+    "DECODE_SCALE",
+    "DECODE_THREADS",
+    "CONTOUR_WINDOW_SIZE",
+    "BUFFER_FRAMES",
+    "MAX_DISTANCE_FROM_TUBE",
+    "TRACKING",
+    "TRACK_MAX_AGE",
+    "TRACK_MAX_DISTANCE",
+    "TUBE_LAYOUT_TOLERANCE",
+    "TUBE_REMAP_DISTANCE",
+    "TUBE_DETECTION_FRAMES",
+    "TUBE_MIN_CONFIDENCE",
+    "TUBE_VOTE_DISTANCE",
+}
+
+# events kept per job for watchers that start watching late. Older ones are dropped
+MAX_HISTORY = 1000
+
+# jobs that have ended kept for `status` and `watch`. The oldest are forgotten
+MAX_ENDED_JOBS = 100
+
+# the names of cameras, which name their tube layout files
+CAMERA_PATTERN = re.compile(r"[\w.-]+")
+
+
+def run_job(config: MotionCapConfig, events, stop_event) -> None:
+    """Run `motion_detector` in a worker process, sending its log lines and progress to `events`."""
+
+    def logging_callback(msg):
+        events.put({"type": "log", "message": msg})
+
+    def progress_callback(frame_count, total_frames):
+        events.put({"type": "progress", "frame": frame_count, "total_frames": total_frames})
+
+    try:
+        motion_detector(
+            config,
+            logging_callback=logging_callback,
+            stop_event=stop_event,
+            progress_callback=progress_callback,
+        )
+    except Exception as e:
+        events.put({"type": "error", "message": f"{type(e).__name__}: {e}"})
+        raise
+
+
+@dataclass
+class Job:
+    id: str
+    config: MotionCapConfig
+    status: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    started: float | None = None
+    ended: float | None = None
+    frame: int = 0
+    total_frames: float = 0
+    error: str | None = None
+    # the last events of the job, replayed to watchers that start watching late
+    history: Deque[dict] = field(default_factory=lambda: deque(maxlen=MAX_HISTORY))
+    watchers: Set[asyncio.Queue] = field(default_factory=set)
+    stop_event: Any = None
+
+    def summary(self) -> dict:
+        return {
+            "job": self.id,
+            "video": self.config.VIDEO,
+            "log": self.config.LOG,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "ended": self.ended,
+            "frame": self.frame,
+            "total_frames": self.total_frames,
+            "error": self.error,
+        }
+
+
+class JobService:
+    """Queues detection jobs, runs them on `workers` worker processes, and publishes their events.
+
+    Args:
+        base_config (MotionCapConfig): The config jobs start from, before their own settings
+        workers (int): Number of jobs run at once
+        log_dir (str): Directory the logs of jobs are written to
+        layout_dir (str): Directory the tube layout of each camera is kept in (see `TUBE_LAYOUT`)
+    """
+
+    def __init__(
+        self,
+        base_config: MotionCapConfig,
+        workers: int = 1,
+        log_dir: str = "logs",
+        layout_dir: str = "layouts",
+    ):
+        self.base_config = base_config
+        self.workers = workers
+        self.log_dir = log_dir
+        self.layout_dir = layout_dir
+        # held by the running job of each tube layout file, so jobs of a camera don't write it at once
+        self.layout_locks: Dict[str, asyncio.Lock] = {}
+        self.jobs: Dict[str, Job] = {}
+        self.pending: asyncio.Queue = asyncio.Queue()
+        self.ids = itertools.count(1)
+        # spawned, since forking a process with the event loop's threads running isn't safe
+        self.ctx = mp.get_context("spawn")
+
+    def queue_depth(self) -> int:
+        return sum(1 for job in self.jobs.values() if job.status == "queued")
+
+    def publish(self, job: Job, event: dict) -> None:
+        event = {"job": job.id, **event}
+        job.history.append(event)
+        for watcher in job.watchers:
+            watcher.put_nowait(event)
+
+    def set_status(self, job: Job, status: str) -> None:
+        job.status = status
+        if status == "running":
+            job.started = time.time()
+        elif status in ENDED:
+            job.ended = time.time()
+        self.publish(job, {"type": "status", **job.summary()})
+        if status in ENDED:
+            self.prune()
+
+    def prune(self) -> None:
+        """Forget the oldest jobs that have ended, beyond `MAX_ENDED_JOBS`."""
+        ended = [job_id for job_id, job in self.jobs.items() if job.status in ENDED]
+        for job_id in ended[: max(0, len(ended) - MAX_ENDED_JOBS)]:
+            del self.jobs[job_id]
+
+    def submit(
+        self, video: str, settings: Dict[str, Any] | None = None, camera: str | None = None
+    ) -> Job:
+        """Queue a job for `video`, with `settings` (only those in `JOB_SETTINGS`) overriding the base config.
+
+        The video's tube layout is kept per `camera`, so its Bee IDs are comparable to those of the
+        other videos of the camera. Without a camera the tubes are detected for the video alone.
+
+        Raises:
+            ValueError: If the video doesn't exist or the settings are invalid
+        """
+        if not os.path.exists(video):
+            raise ValueError(f"Video {video!r} not found")
+        settings = settings or {}
+        if not isinstance(settings, dict):
+            raise ValueError("Settings must be an object of setting names to values")
+        not_allowed = sorted(set(settings) - JOB_SETTINGS)
+        if not_allowed:
+            raise ValueError(f"Settings {not_allowed} can't be set by jobs")
+        if camera is not None and not CAMERA_PATTERN.fullmatch(str(camera)):
+            raise ValueError(f"Invalid camera {camera!r}, use letters, digits, '.', '-' and '_'")
+
+        job_id = str(next(self.ids))
+        values = self.base_config.to_dict()
+        # parsed from their string form like the settings of a .env file, so they get the setting's type
+        values.update({key: str(value) for key, value in settings.items()})
+        values["VIDEO"] = video
+        # there is no one to show the video to
+        values["SHOW"] = False
+        # each job gets its own log, in the service's log directory. Job IDs restart with the
+        # service, so the log is also named by when the job was submitted
+        name = os.path.splitext(os.path.basename(video))[0]
+        submitted = time.strftime("%Y-%m-%d_%H-%M-%S")
+        values["LOG"] = os.path.join(self.log_dir, f"{submitted}_job{job_id}_{name}_log.txt")
+        # jobs run side by side, so they can't share the metrics file and port of the service's config
+        values["METRICS"] = None
+        values["METRICS_PORT"] = None
+        # the layout of the service's config may be of any camera
+        values["TUBE_LAYOUT"] = None
+        if camera is not None:
+            values["TUBE_LAYOUT"] = os.path.join(self.layout_dir, f"{camera}.npz")
+        config = MotionCapConfig.from_dict(values)
+
+        job = Job(job_id, config)
+        self.jobs[job_id] = job
+        self.pending.put_nowait(job)
+        self.set_status(job, "queued")
+        return job
+
+    def get(self, job_id) -> Job:
+        job = self.jobs.get(str(job_id))
+        if job is None:
+            raise ValueError(f"No job {job_id!r}")
+        return job
+
+    def cancel(self, job_id) -> Job:
+        """Cancel a job. A queued job is dropped, and a running one is asked to stop."""
+        job = self.get(job_id)
+        if job.status == "queued":
+            self.set_status(job, "cancelled")
+        elif job.status == "running":
+            job.stop_event.set()
+        return job
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth(),
+            "running": sum(1 for job in self.jobs.values() if job.status == "running"),
+            "jobs": [job.summary() for job in self.jobs.values()],
+        }
+
+    async def watch(self, job: Job):
+        """Yield the events of a job, starting from its first one, until it has ended."""
+        watcher = asyncio.Queue()
+        history = list(job.history)
+        job.watchers.add(watcher)
+        try:
+            for event in history:
+                yield event
+            if job.status in ENDED:
+                return
+            while True:
+                event = await watcher.get()
+                yield event
+                if event["type"] == "status" and event["status"] in ENDED:
+                    return
+        finally:
+            job.watchers.discard(watcher)
+
+    async def worker(self) -> None:
+        while True:
+            job = await self.pending.get()
+            if job.status != "queued":
+                continue
+            if job.config.TUBE_LAYOUT is None:
+                await self.run(job)
+                continue
+            # waits (still queued) for a running job of the same camera to end
+            lock = self.layout_locks.setdefault(job.config.TUBE_LAYOUT, asyncio.Lock())
+            async with lock:
+                if job.status == "queued":
+                    await self.run(job)
+
+    async def run(self, job: Job) -> None:
+        """Run a job in a new process, publishing its events until it exits."""
+        if os.path.dirname(job.config.LOG):
+            os.makedirs(os.path.dirname(job.config.LOG), exist_ok=True)
+        # the log is appended to, so it starts empty in case a log of the same name was left behind
+        open(job.config.LOG, "w").close()
+
+        events = self.ctx.Queue()
+        job.stop_event = self.ctx.Event()
+        process = self.ctx.Process(target=run_job, args=(job.config, events, job.stop_event))
+        process.start()
+        self.set_status(job, "running")
+
+        loop = asyncio.get_running_loop()
+        last_progress = 0.0
+        cancelled_at = None
+        while True:
+            try:
+                event = await loop.run_in_executor(None, events.get, True, POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                if job.stop_event.is_set():
+                    cancelled_at = cancelled_at or time.monotonic()
+                    if time.monotonic() - cancelled_at > CANCEL_TIMEOUT:
+                        process.terminate()
+                continue
+
+            if event["type"] == "progress":
+                # progress is only sent to watchers every PROGRESS_INTERVAL seconds
+                now = time.monotonic()
+                if now - last_progress < PROGRESS_INTERVAL:
+                    job.frame, job.total_frames = event["frame"], event["total_frames"]
+                    continue
+                last_progress = now
+            self.handle_event(job, event)
+
+        await loop.run_in_executor(None, process.join)
+        # the process may have sent its last events (eg. its error) after the last get timed out
+        while True:
+            try:
+                self.handle_event(job, events.get_nowait())
+            except queue.Empty:
+                break
+        if job.stop_event.is_set():
+            self.set_status(job, "cancelled")
+        elif process.exitcode == 0:
+            self.set_status(job, "done")
+        else:
+            job.error = job.error or f"Worker exited with code {process.exitcode}"
+            self.set_status(job, "failed")
+
+    def handle_event(self, job: Job, event: dict) -> None:
+        """Record an event sent by the process of a job, and publish it to its watchers."""
+        if event["type"] == "progress":
+            job.frame, job.total_frames = event["frame"], event["total_frames"]
+            self.publish(job, event)
+        elif event["type"] == "error":
+            job.error = event["message"]
+        else:
+            self.publish(job, event)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the commands of one client connection."""
+
+        async def send(message: dict) -> None:
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    command = request.get("command")
+                    if command == "submit":
+                        job = self.submit(
+                            request["video"], request.get("set"), request.get("camera")
+                        )
+                        await send({"ok": True, **job.summary(), "queue_depth": self.queue_depth()})
+                    elif command == "watch":
+                        async for event in self.watch(self.get(request["job"])):
+                            await send(event)
+                    elif command == "cancel":
+                        await send({"ok": True, **self.cancel(request["job"]).summary()})
+                    elif command == "status":
+                        if "job" in request:
+                            await send({"ok": True, **self.get(request["job"]).summary()})
+                        else:
+                            await send({"ok": True, **self.status()})
+                    else:
+                        raise ValueError(f"Unknown command {command!r}")
+                except (ValueError, KeyError, TypeError) as e:
+                    await send({"ok": False, "error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, socket_path=None):
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        where = socket_path or f"{host}:{port}"
+        print(f"Serving detection jobs on {where} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # stop the running jobs with the service
+            for job in self.jobs.values():
+                if job.status == "running":
+                    job.stop_event.set()
+
+
+async def request(args, message: dict) -> None:
+    """Send one command to the service, and print the replies until it has answered."""
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+
+    commands = [message]
+    while commands:
+        message = commands.pop(0)
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+        while line := await reader.readline():
+            reply = json.loads(line)
+            print(json.dumps(reply))
+            if not reply.get("ok", True):
+                sys.exit(1)
+            # watching ends with the job, everything else with a single reply
+            if message["command"] != "watch" or reply.get("status") in ENDED:
+                break
+        if message["command"] == "submit" and args.watch:
+            commands.append({"command": "watch", "job": reply["job"]})
+
+    writer.close()
+    await writer.wait_closed()
+
+
+def parse_settings(parser: argparse.ArgumentParser, overrides: List[str]) -> Dict[str, str]:
+    settings = {}
+    for override in overrides:
+        key, sep, value = override.partition("=")
+        if not sep:
+            parser.error(f"Invalid override {override!r}, expected KEY=VALUE")
+        settings[key] = value
+    return settings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run detection jobs as a service, or talk to one")
+    parser.add_argument("--host", default="127.0.0.1", help="Host of the service")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port of the service")
+    parser.add_argument("--socket", help="Path to a Unix socket, instead of the host and port")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the service")
+    serve.add_argument("--config", "-c", default=".env", help="Path to the base .env file")
+    serve.add_argument("--workers", "-w", type=int, default=1, help="Number of jobs run at once")
+    serve.add_argument("--log-dir", default="logs", help="Directory for the logs of jobs")
+    serve.add_argument(
+        "--layout-dir", default="layouts", help="Directory for the tube layout of each camera"
+    )
+
+    submit = commands.add_parser("submit", help="Submit a video")
+    submit.add_argument("video", help="Path to the video, as seen by the service")
+    submit.add_argument(
+        "--set", "-s", nargs="*", default=[], metavar="KEY=VALUE", help="Override config values"
+    )
+    submit.add_argument(
+        "--camera", help="Camera of the video, whose tube layout (and Bee IDs) it shares"
+    )
+    submit.add_argument("--watch", action="store_true", help="Watch the job until it has ended")
+
+    for name, description in (("watch", "Stream the events of a job"), ("cancel", "Cancel a job")):
+        commands.add_parser(name, help=description).add_argument("job", help="Job ID")
+    commands.add_parser("status", help="Show the jobs and queue depth").add_argument(
+        "job", nargs="?", help="Job ID"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        service = JobService(
+            MotionCapConfig.from_dotenv(args.config), args.workers, args.log_dir, args.layout_dir
+        )
+        try:
+            asyncio.run(service.serve(args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            pass
+    else:
+        message = {"command": args.command}
+        if args.command == "submit":
+            message["video"] = os.path.abspath(args.video)
+            message["set"] = parse_settings(submit, args.set)
+            if args.camera is not None:
+                message["camera"] = args.camera
+        elif args.job is not None:
+            message["job"] = args.job
+        asyncio.run(request(args, message))
@@ -0,0 +1,101 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import numpy as np
+
+
+@dataclass(slots=True)
+class Burst:
+    """Detections of the same bee (and event type) with no more than `granularity` frames between them,
+    logged as a single event. `assigned_contour` and `timestamp_crop` are from the first detection.
+    """
+
+    bee_id: int
+    event: str | None
+    start_frame: int
+    end_frame: int
+    assigned_contour: dict
+    timestamp_crop: np.ndarray | None
+    detections: int = 1
+
+
+class EventDebouncer:
+    """Coalesces repeated detections of a bee into bursts, so each is logged once.
+
+    A detection less than `granularity` frames after the previous one of the same bee (and event
+    type) extends that bee's burst instead of starting a new one. A burst is finished once its bee
+    hasn't been detected for `granularity` frames, so logged events are at least `granularity`
+    frames apart.
+
+    Finished bursts are returned in the order of their first frames: a burst is held back while a
+    burst that started before it is still going, so the log stays in frame order.
+
+    Example:
+        debouncer = EventDebouncer(granularity=30)
+        for burst in debouncer.add(bee_id, frame_count, assigned_contour, timestamp_crop):
+            log(burst)
+        ...
+        for burst in debouncer.expire(frame_count):
+            log(burst)
+    """
+
+    def __init__(self, granularity: int):
+        self.granularity = granularity
+        self.bursts: Dict[Tuple[int, str | None], Burst] = {}
+        # finished bursts held back until the bursts that started before them are finished too
+        self.finished: List[Burst] = []
+
+    def _release(self, finished: List[Burst]) -> List[Burst]:
+        """Return the finished bursts that no burst still going started before, by first frame."""
+        self.finished.extend(finished)
+        self.finished.sort(key=lambda burst: burst.start_frame)
+        if self.bursts:
+            first_active = min(burst.start_frame for burst in self.bursts.values())
+        else:
+            first_active = float("inf")
+        n_released = 0
+        while (
+            n_released < len(self.finished)
+            and self.finished[n_released].start_frame <= first_active
+        ):
+            n_released += 1
+        released, self.finished = self.finished[:n_released], self.finished[n_released:]
+        return released
+
+    def add(
+        self,
+        bee_id: int,
+        frame_count: int,
+        assigned_contour: dict,
+        timestamp_crop: np.ndarray | None,
+        event: str | None = None,
+    ) -> List[Burst]:
+        """Add a detection, returning the finished bursts it released (eg. the bee's previous one)."""
+        key = (bee_id, event)
+        burst = self.bursts.get(key)
+        if burst is not None and frame_count - burst.end_frame <= self.granularity:
+            burst.end_frame = frame_count
+            burst.detections += 1
+            return []
+
+        # copy, since the frame may be reused before the burst is logged
+        if timestamp_crop is not None:
+            timestamp_crop = timestamp_crop.copy()
+        self.bursts[key] = Burst(
+            bee_id, event, frame_count, frame_count, assigned_contour, timestamp_crop
+        )
+        return self._release([burst] if burst is not None else [])
+
+    def expire(self, frame_count: int) -> List[Burst]:
+        """Finish the bursts of the bees that haven't been detected for `granularity` frames, returning
+        the finished bursts that can be logged."""
+        expired = [
+            key
+            for key, burst in self.bursts.items()
+            if frame_count - burst.end_frame > self.granularity
+        ]
+        return self._release([self.bursts.pop(key) for key in expired])
+
+    def flush(self) -> List[Burst]:
+        """Finish all the bursts (eg. at the end of the video)."""
+        bursts, self.bursts = self.bursts, {}
+        return self._release(list(bursts.values()))
@@ -0,0 +1,256 @@
+"""Decode a video once, for several consumer processes.
+
+One decoder writes frames into a ring of `multiprocessing.shared_memory` slots, and each consumer
+reads them from there without copying, through a `FrameBusReader` (which has the same interface as
+the frame sources in `video_source`, so it can be passed to `motion_detector`). Each slot is
+reference counted: a frame is overwritten only once every consumer has moved past it, so the decoder
+runs at most `slots` frames ahead of the slowest consumer.
+"""
+import multiprocessing as mp
+from functools import partial
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Callable, List, Sequence, Tuple
+import numpy as np
+from .video_source import open_frame_source
+
+if TYPE_CHECKING:
+    from src.config import MotionCapConfig
+
+# number of frames the bus holds, ie. how far ahead of the slowest consumer the decoder can get
+SLOTS = 8
+
+# seconds the decoder waits for a slot before checking whether the consumers are still running
+POLL_INTERVAL = 0.5
+
+
+class FrameBus:
+    """A ring of `slots` shared memory frames, written by one process and read by `n_consumers`.
+
+    Consumer `i` holds a reference to every frame from `positions[i]` to the last one written, and
+    `refcounts` counts the references to the frame in each slot. A consumer that is detached (has
+    stopped reading) has a position of -1.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        dtype,
+        n_consumers: int,
+        fps: float,
+        total_frames: float,
+        scale: float = 1.0,
+        slots: int = SLOTS,
+        ctx=None,
+    ):
+        ctx = ctx or mp.get_context()
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.fps = fps
+        self.total_frames = total_frames
+        self.scale = scale
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=frame_bytes * slots)
+        self.owner = True
+        self._frames = None
+
+        self.condition = ctx.Condition()
+        self.refcounts = ctx.Array("i", slots, lock=False)
+        self.positions = ctx.Array("q", n_consumers, lock=False)
+        self.written = ctx.Value("q", 0, lock=False)
+        self.closed = ctx.Value("b", False, lock=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the frames are a view of the shared memory, recreated in each process
+        state["_frames"] = None
+        state["owner"] = False
+        return state
+
+    @property
+    def frames(self) -> np.ndarray:
+        if self._frames is None:
+            self._frames = np.ndarray((self.slots,) + self.shape, self.dtype, buffer=self.shm.buf)
+        return self._frames
+
+    def active(self) -> int:
+        """Number of consumers still reading."""
+        return sum(1 for position in self.positions if position >= 0)
+
+    def publish(self, frame: np.ndarray, check: Callable | None = None) -> None:
+        """Write the next frame, waiting for every consumer to release the frame in its slot first.
+
+        `check` is called every `POLL_INTERVAL` seconds while waiting, eg. to detach consumers
+        that have exited without releasing their frames.
+        """
+        index = self.written.value
+        slot = index % self.slots
+        with self.condition:
+            while self.refcounts[slot] > 0:
+                if not self.condition.wait(POLL_INTERVAL) and check is not None:
+                    check()
+
+        # no consumer can read the slot until `written` is incremented, so it is copied unlocked
+        np.copyto(self.frames[slot], frame)
+
+        with self.condition:
+            self.refcounts[slot] = self.active()
+            self.written.value = index + 1
+            self.condition.notify_all()
+
+    def close(self) -> None:
+        """Signal the consumers that there are no more frames."""
+        with self.condition:
+            self.closed.value = True
+            self.condition.notify_all()
+
+    def acquire(self, consumer: int, index: int) -> int | None:
+        """Release the frames of `consumer` before `index`, and wait for frame `index` to be written.
+
+        Returns:
+            int | None: The slot of the frame, or None if the bus was closed before it was written
+        """
+        with self.condition:
+            for i in range(self.positions[consumer], index):
+                self.refcounts[i % self.slots] -= 1
+            self.positions[consumer] = index
+            self.condition.notify_all()
+
+            while self.written.value <= index:
+                if self.closed.value:
+                    return None
+                self.condition.wait()
+        return index % self.slots
+
+    def detach(self, consumer: int) -> None:
+        """Release all the frames of `consumer`, and stop counting it as a reader of new frames."""
+        with self.condition:
+            position = self.positions[consumer]
+            if position < 0:
+                return
+            for i in range(position, self.written.value):
+                self.refcounts[i % self.slots] -= 1
+            self.positions[consumer] = -1
+            self.condition.notify_all()
+
+    def unlink(self) -> None:
+        self._frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class FrameBusReader:
+    """Reads the frames of a `FrameBus` as consumer `consumer`, like the sources in `video_source`.
+
+    Frames returned by `read` are read-only views of the shared memory, valid until the next `read`
+    or `grab`. Copy a frame to draw on it or keep it for longer.
+    """
+
+    def __init__(self, bus: FrameBus, consumer: int):
+        self.bus = bus
+        self.consumer = consumer
+        self.index = 0
+        self.fps = bus.fps
+        self.total_frames = bus.total_frames
+        self.scale = bus.scale
+        self.size = (bus.shape[1], bus.shape[0])
+
+    def read(self) -> Tuple[bool, np.ndarray | None]:
+        slot = self.bus.acquire(self.consumer, self.index)
+        if slot is None:
+            return False, None
+        self.index += 1
+        frame = self.bus.frames[slot]
+        frame.flags.writeable = False
+        return True, frame
+
+    def grab(self) -> bool:
+        if self.bus.acquire(self.consumer, self.index) is None:
+            return False
+        self.index += 1
+        return True
+
+    def release(self) -> None:
+        self.bus.detach(self.consumer)
+
+
+def _consume(target: Callable, bus: FrameBus, consumer: int) -> None:
+    reader = FrameBusReader(bus, consumer)
+    try:
+        target(reader)
+    finally:
+        reader.release()
+
+
+def _detect(config: "MotionCapConfig", reader: FrameBusReader) -> None:
+    # imported here, since the motion detector is built on the utils
+    from src.motion_cap import motion_detector
+
+    motion_detector(config, frame_source=reader)
+
+
+def run_fanout(
+    configs: List["MotionCapConfig"], consumers: Sequence[Callable] = (), slots: int = SLOTS
+) -> None:
+    """Decode a video once, and run `motion_detector` with each config on it in its own process.
+
+    Each of `consumers` (eg. a clip recorder or a preview) also runs in its own process, and is called
+    with a `FrameBusReader`. It has to be picklable, eg. a module level function.
+
+    The configs have to be for the same video, decoded the same way (DECODER and DECODE_SCALE). They
+    can differ in everything else, eg. to compare detection settings.
+
+    Raises:
+        RuntimeError: If a consumer exited with an error
+    """
+    decoding = {(c.VIDEO, c.DECODER, c.DECODE_SCALE) for c in configs}
+    if len(decoding) > 1:
+        raise ValueError("All configs must have the same VIDEO, DECODER and DECODE_SCALE")
+
+    targets = [partial(_detect, config) for config in configs] + list(consumers)
+    source = open_frame_source(configs[0])
+    success, frame = source.read()
+    if not success:
+        source.release()
+        raise ValueError(f"Could not read a frame from {configs[0].VIDEO}")
+
+    ctx = mp.get_context()
+    bus = FrameBus(
+        frame.shape,
+        frame.dtype,
+        len(targets),
+        source.fps,
+        source.total_frames,
+        source.scale,
+        slots,
+        ctx,
+    )
+    processes = [
+        ctx.Process(target=_consume, args=(target, bus, i)) for i, target in enumerate(targets)
+    ]
+    for process in processes:
+        process.start()
+
+    def detach_exited():
+        for i, process in enumerate(processes):
+            if process.exitcode is not None:
+                bus.detach(i)
+
+    try:
+        while success:
+            bus.publish(frame, detach_exited)
+            if bus.active() == 0:
+                break
+            success, frame = source.read()
+    finally:
+        bus.close()
+        source.release()
+        for process in processes:
+            process.join()
+        bus.unlink()
+
+    failed = [i for i, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Frame bus consumers {failed} exited with an error")
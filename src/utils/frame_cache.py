@@ -0,0 +1,261 @@
+"""On-disk cache of preprocessed frames, for running the detector on the same video many times.
+
+The first run with `FRAME_CACHE` set writes every preprocessed frame (see `MotionDetector.preprocess`)
+of the video to a memory-mapped .npy file, along with the grayscale crop of the timestamp of each
+frame for OCR. Later runs read them from there instead of decoding and preprocessing the video.
+
+Entries are keyed by a hash of the video and the settings the preprocessing depends on, so changing
+any of them makes a new entry. The least recently used entries are deleted to keep the cache under
+`FRAME_CACHE_SIZE` gigabytes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import List, Tuple
+import cv2
+import numpy as np
+
+# bump when the preprocessing or the layout of the entries changes, so old entries aren't read
+CACHE_VERSION = 1
+
+# bytes hashed at the start and end of the video. Hashing all of it would take as long as decoding it
+HASH_BYTES = 1 << 20
+
+META_FILE = "meta.json"
+FRAMES_FILE = "frames.npy"
+CROPS_FILE = "crops.npy"
+
+
+def video_hash(fp: str) -> str:
+    """Hash of the size, start and end of a video, which tells recordings apart without reading them."""
+    size = os.path.getsize(fp)
+    digest = hashlib.sha1(str(size).encode())
+    with open(fp, "rb") as f:
+        digest.update(f.read(HASH_BYTES))
+        f.seek(max(0, size - HASH_BYTES))
+        digest.update(f.read(HASH_BYTES))
+    return digest.hexdigest()
+
+
+def crop_shape(shape: Tuple[int, int], timestamp_slice) -> Tuple[int, int]:
+    """Shape of the crop of a frame of `shape` by `timestamp_slice`, which may go past its edges."""
+    return tuple(len(range(*s.indices(n))) for s, n in zip(timestamp_slice, shape))
+
+
+def cache_key(config) -> str:
+    """Key of the cache entry of `config.VIDEO`, as preprocessed with the settings of `config`."""
+    settings = {
+        "version": CACHE_VERSION,
+        "video": video_hash(config.VIDEO),
+        "decoder": config.DECODER,
+        "scale": config.DECODE_SCALE,
+        "timestamp_rect": config.TIMESTAMP_RECT if config.TIMESTAMP else None,
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:20]
+
+
+class CachedFrameSource:
+    """Reads the frames of a cache entry, like the sources in `video_source`.
+
+    `read` returns a grayscale frame for showing, and for cropping the timestamp from with
+    `config.timestamp_slice`: the preprocessed frame, with the unblurred timestamp crop pasted back
+    in. The preprocessed frame itself is then `preprocessed`, a read-only view of the memory map.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.fps = meta["fps"]
+        self.total_frames = meta["total_frames"]
+        self.scale = meta["scale"]
+        self.n_frames = meta["n_frames"]
+        self.frames = np.load(os.path.join(path, FRAMES_FILE), mmap_mode="r")
+        self.size = (self.frames.shape[2], self.frames.shape[1])
+
+        self.crops = None
+        self.timestamp_slice = None
+        if meta["timestamp_rect"] is not None:
+            self.crops = np.load(os.path.join(path, CROPS_FILE), mmap_mode="r")
+            x1, y1, x2, y2 = meta["timestamp_rect"]
+            self.timestamp_slice = (slice(y1, y2), slice(x1, x2))
+
+        self.frame = np.empty(self.frames.shape[1:], dtype=np.uint8)
+        self.index = 0
+        self.preprocessed = None
+
+    def read(self) -> Tuple[bool, np.ndarray | None]:
+        if self.index >= self.n_frames:
+            return False, None
+        self.preprocessed = self.frames[self.index]
+        np.copyto(self.frame, self.preprocessed)
+        if self.crops is not None:
+            self.frame[self.timestamp_slice] = self.crops[self.index]
+        self.index += 1
+        return True, self.frame
+
+    def grab(self) -> bool:
+        if self.index >= self.n_frames:
+            return False
+        self.index += 1
+        return True
+
+    def release(self) -> None:
+        self.frames = self.crops = self.preprocessed = None
+
+
+class CacheWriter:
+    """Writes the preprocessed frames of a video to a new cache entry, as they are preprocessed.
+
+    The entry is written to a temporary directory, and only added to the cache by `close` if every
+    frame of the video was written.
+    """
+
+    def __init__(self, path: str, meta: dict, shape: Tuple[int, int], timestamp_slice):
+        self.path = path
+        self.meta = meta
+        self.timestamp_slice = timestamp_slice
+        self.tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(self.tmp_path, exist_ok=True)
+
+        capacity = int(meta["total_frames"])
+        self.frames = np.lib.format.open_memmap(
+            os.path.join(self.tmp_path, FRAMES_FILE), "w+", np.uint8, (capacity,) + shape
+        )
+        self.crops = None
+        if timestamp_slice is not None:
+            self.crops = np.lib.format.open_memmap(
+                os.path.join(self.tmp_path, CROPS_FILE),
+                "w+",
+                np.uint8,
+                (capacity,) + crop_shape(shape, timestamp_slice),
+            )
+        self.index = 0
+        self.overflowed = False
+
+    def write(self, preprocessed: np.ndarray, frame: np.ndarray) -> None:
+        """Add the next frame: its preprocessed version, and the timestamp cropped from the frame."""
+        if self.index >= len(self.frames):
+            # the video has more frames than its header says, so the entry can't be completed
+            self.overflowed = True
+            return
+        self.frames[self.index] = preprocessed
+        if self.crops is not None:
+            # converted the way `text_detect` does, so the timestamps read the same from the cache
+            crop = frame[self.timestamp_slice]
+            if crop.ndim == 3:
+                cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY, dst=self.crops[self.index])
+            else:
+                self.crops[self.index] = crop
+        self.index += 1
+
+    def close(self, complete: bool) -> bool:
+        """Add the entry to the cache if `complete` (every frame of the video was written), or delete it.
+
+        Returns:
+            bool: Whether the entry was added
+        """
+        for array in (self.frames, self.crops):
+            if array is not None:
+                array.flush()
+        # every reference to the memory maps is dropped so the files are closed, as Windows can't
+        # rename or delete files that are still mapped
+        del array
+        self.frames = self.crops = None
+
+        if self.overflowed:
+            print(f"{self.meta['video']} has more frames than its header says, it wasn't cached")
+        if not complete or self.overflowed or self.index == 0:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return False
+
+        self.meta["n_frames"] = self.index
+        with open(os.path.join(self.tmp_path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=2)
+        try:
+            os.rename(self.tmp_path, self.path)
+        except OSError:
+            # another run added the entry first
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return False
+        return True
+
+
+class FrameCache:
+    """A directory of cache entries, one per video and preprocessing settings, of at most `max_gb` gigabytes."""
+
+    def __init__(self, directory: str, max_gb: float):
+        self.directory = directory
+        self.max_bytes = int(max_gb * 1e9)
+        os.makedirs(directory, exist_ok=True)
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """The (path, size in bytes, last used time) of each entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta = os.path.join(path, META_FILE)
+            if not os.path.exists(meta):
+                # being written, or left by a run that crashed
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            entries.append((path, size, os.path.getmtime(meta)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def open(self, key: str) -> CachedFrameSource | None:
+        """Open the entry of `key`, marking it as used, or return None if it isn't cached."""
+        path = os.path.join(self.directory, key)
+        meta_fp = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_fp):
+            return None
+        with open(meta_fp, "r") as f:
+            meta = json.load(f)
+        os.utime(meta_fp)
+        return CachedFrameSource(path, meta)
+
+    def evict(self, needed: int) -> bool:
+        """Delete the least recently used entries until `needed` more bytes fit.
+
+        Returns:
+            bool: Whether they fit
+        """
+        if needed > self.max_bytes:
+            return False
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total + needed <= self.max_bytes:
+                break
+            print(f"Evicting {path} from the frame cache")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        return total + needed <= self.max_bytes
+
+    def create(self, key: str, source, config) -> CacheWriter | None:
+        """Start writing the entry of `key`, for the frames of `source` preprocessed with `config`
+        (as scaled to the frames). Returns None if the video is too large for the cache."""
+        width, height = source.size
+        n_frames = int(source.total_frames)
+        timestamp_slice = config.timestamp_slice if config.TIMESTAMP else None
+        crop_pixels = 0
+        if timestamp_slice is not None:
+            crop_pixels = int(np.prod(crop_shape((height, width), timestamp_slice)))
+        if n_frames <= 0 or not self.evict(n_frames * (width * height + crop_pixels)):
+            print(f"{config.VIDEO} is too large for the frame cache, it won't be cached")
+            return None
+
+        meta = {
+            "version": CACHE_VERSION,
+            "video": config.VIDEO,
+            "created": time.time(),
+            "fps": source.fps,
+            "total_frames": source.total_frames,
+            "scale": config.DECODE_SCALE,
+            "timestamp_rect": config.TIMESTAMP_RECT if config.TIMESTAMP else None,
+        }
+        # the timestamp is cropped at the size it was cached at
+        if timestamp_slice is not None:
+            rows, cols = timestamp_slice
+            meta["timestamp_rect"] = [cols.start, rows.start, cols.stop, rows.stop]
+        return CacheWriter(
+            os.path.join(self.directory, key), meta, (height, width), timestamp_slice
+        )
@@ -0,0 +1,170 @@
+"""Batched kernels for the per-contour work of the pipeline.
+
+Contours are packed into one int32 array of points, and boxes into (n, 4) int32 arrays of
+[x1, x2, y1, y2] (the fields of `RECT_NAMEDTUPLE`), so each kernel is one call per frame instead of
+one Python call per contour (or pair of contours). The kernels are compiled with numba if it is
+installed, and run as vectorized NumPy otherwise. Both give the same results as the per-contour
+functions in `motion_cap_helpers` they replace.
+"""
+from typing import List, Tuple
+import numpy as np
+
+
+def _numba_njit():
+    """numba's `njit`, or None if numba isn't installed."""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit
+
+
+def pack_contours(contours: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack contours (as returned by `cv2.findContours`) into one (n_points, 2) int32 array of their
+    points, and the index of the first point of each contour."""
+    if len(contours) == 0:
+        return np.empty((0, 2), dtype=np.int32), np.empty(0, dtype=np.int64)
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+    starts = np.zeros(len(contours), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int32, copy=False)
+    return points, starts
+
+
+def _contour_stats_numpy(points: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    n_points = len(points)
+    ends = np.empty_like(starts)
+    ends[:-1] = starts[1:]
+    ends[-1:] = n_points
+
+    # the next point of each point, wrapping around to the first point of its contour
+    next_index = np.arange(1, n_points + 1)
+    next_index[ends - 1] = starts
+
+    x = points[:, 0].astype(np.int64)
+    y = points[:, 1].astype(np.int64)
+    x_next, y_next = x[next_index], y[next_index]
+
+    # the shoelace formula, as cv2.moments does for contours
+    cross = x * y_next - x_next * y
+    moments = np.empty((len(starts), 3), dtype=np.float64)
+    moments[:, 0] = np.add.reduceat(cross, starts)
+    moments[:, 1] = np.add.reduceat(cross * (x + x_next), starts)
+    moments[:, 2] = np.add.reduceat(cross * (y + y_next), starts)
+    moments[:, 0] /= 2
+    moments[:, 1:] /= 6
+
+    # cv2.moments gives the moments of clockwise and counter-clockwise contours the same sign
+    moments[moments[:, 0] < 0] *= -1
+
+    boxes = np.empty((len(starts), 4), dtype=np.int32)
+    boxes[:, 0] = np.minimum.reduceat(x, starts)
+    boxes[:, 1] = np.maximum.reduceat(x, starts) + 1
+    boxes[:, 2] = np.minimum.reduceat(y, starts)
+    boxes[:, 3] = np.maximum.reduceat(y, starts) + 1
+    return moments, boxes
+
+
+def _contour_stats_loops(points: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    n_contours = len(starts)
+    moments = np.zeros((n_contours, 3), dtype=np.float64)
+    boxes = np.empty((n_contours, 4), dtype=np.int32)
+    for i in range(n_contours):
+        start = starts[i]
+        end = starts[i + 1] if i + 1 < n_contours else len(points)
+        a = 0
+        ax = 0
+        ay = 0
+        x1 = x2 = points[start, 0]
+        y1 = y2 = points[start, 1]
+        for j in range(start, end):
+            k = j + 1 if j + 1 < end else start
+            x, y = np.int64(points[j, 0]), np.int64(points[j, 1])
+            x_next, y_next = np.int64(points[k, 0]), np.int64(points[k, 1])
+            cross = x * y_next - x_next * y
+            a += cross
+            ax += cross * (x + x_next)
+            ay += cross * (y + y_next)
+            x1, x2 = min(x1, x), max(x2, x)
+            y1, y2 = min(y1, y), max(y2, y)
+        sign = -1 if a < 0 else 1
+        moments[i, 0] = sign * a / 2
+        moments[i, 1] = sign * ax / 6
+        moments[i, 2] = sign * ay / 6
+        boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3] = x1, x2 + 1, y1, y2 + 1
+    return moments, boxes
+
+
+def _any_overlap_numpy(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    # the same (strict) comparisons as `overlap(box, other)`, for every pair at once
+    a = boxes[:, None, :]
+    b = others[None, :, :]
+    x_match = ((b[..., 1] > a[..., 0]) & (b[..., 1] < a[..., 1])) | (
+        (b[..., 0] > a[..., 0]) & (b[..., 0] < a[..., 1])
+    )
+    y_match = ((b[..., 3] > a[..., 2]) & (b[..., 3] < a[..., 3])) | (
+        (b[..., 2] > a[..., 2]) & (b[..., 2] < a[..., 3])
+    )
+    return (x_match & y_match).any(axis=1)
+
+
+def _any_overlap_loops(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    result = np.zeros(len(boxes), dtype=np.bool_)
+    for i in range(len(boxes)):
+        ax1, ax2, ay1, ay2 = boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3]
+        for j in range(len(others)):
+            bx1, bx2, by1, by2 = others[j, 0], others[j, 1], others[j, 2], others[j, 3]
+            x_match = (ax1 < bx2 < ax2) or (ax1 < bx1 < ax2)
+            if x_match and ((ay1 < by2 < ay2) or (ay1 < by1 < ay2)):
+                result[i] = True
+                # no need to check this box against the others
+                break
+    return result
+
+
+_kernels = None
+
+
+def get_kernels():
+    """The (contour_stats, any_overlap) kernels: the loops compiled with numba if it is installed,
+    vectorized NumPy otherwise. Chosen on the first call, since importing numba is slow."""
+    global _kernels
+    if _kernels is None:
+        njit = _numba_njit()
+        if njit is not None:
+            _kernels = (
+                njit(cache=True)(_contour_stats_loops),
+                njit(cache=True)(_any_overlap_loops),
+            )
+        else:
+            _kernels = (_contour_stats_numpy, _any_overlap_numpy)
+    return _kernels
+
+
+def contour_stats(contours: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """The moments and bounding boxes of contours, in one pass over their points.
+
+    Returns:
+        moments (np.ndarray): (n, 3) float64 array of each contour's m00, m10 and m01, as `cv2.moments`
+            computes them. abs(m00) is the area (`cv2.contourArea`), and (m10 / m00, m01 / m00) the center.
+        boxes (np.ndarray): (n, 4) int32 array of each contour's bounding box as [x1, x2, y1, y2],
+            the same as `cv2.boundingRect` gives as x, x + w, y, y + h.
+    """
+    if len(contours) == 0:
+        return np.empty((0, 3), dtype=np.float64), np.empty((0, 4), dtype=np.int32)
+    return get_kernels()[0](*pack_contours(contours))
+
+
+def any_overlap(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """For each box, whether it overlaps any of the `others` (as `overlap(box, other)` decides it).
+
+    Args:
+        boxes (np.ndarray): (n, 4) int32 array of [x1, x2, y1, y2] boxes
+        others (np.ndarray): (m, 4) int32 array of [x1, x2, y1, y2] boxes
+
+    Returns:
+        np.ndarray: (n,) bool array
+    """
+    if len(boxes) == 0 or len(others) == 0:
+        return np.zeros(len(boxes), dtype=bool)
+    return get_kernels()[1](boxes, others)
@@ -2,9 +2,24 @@ import datetime
 from typing import Callable
 
 
-def generate_log_message(frame_count: int, total_frames: int, timestamp: str, bee_id: int) -> str:
+def generate_log_message(
+    frame_count: int,
+    total_frames: int,
+    timestamp: str,
+    bee_id: int,
+    event: str | None = None,
+    end_frame: int | None = None,
+) -> str:
+    # eg. "(enter, to frame 130)"
+    details = []
+    if event:
+        details.append(event)
+    if end_frame is not None and end_frame != frame_count:
+        details.append(f"to frame {end_frame}")
+    details_text = f" ({', '.join(details)})" if details else ""
     return (
-        f"Bee ID={bee_id} detected at frame {frame_count}/{total_frames}, Timestamp: {timestamp}"
+        f"Bee ID={bee_id} detected at frame {frame_count}/{total_frames}{details_text},"
+        f" Timestamp: {timestamp}"
     )
 
 
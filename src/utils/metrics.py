@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from typing import Dict
+
+# quantiles reported for each stage
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class _StageTimer:
+    """Times the `with` block it guards and records the duration on its stage."""
+
+    __slots__ = ("durations", "totals", "name", "start")
+
+    def __init__(self, name, durations, totals):
+        self.name = name
+        self.durations = durations
+        self.totals = totals
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.durations.append(duration)
+        total = self.totals[self.name]
+        total[0] += 1
+        total[1] += duration
+        return False
+
+
+class Metrics:
+    """Per-stage timers and counters for `motion_detector`.
+
+    Stage durations are kept over a rolling window of the last `window` calls, and reported as
+    quantiles in the Prometheus text format. They are written to `fp` every `interval` seconds,
+    and/or served at http://127.0.0.1:`port`/metrics.
+
+    Example:
+        with metrics.stage("preprocess"):
+            preprocessed = preprocess_frame(frame, config)
+        metrics.incr("contours_found", len(contours))
+    """
+
+    enabled = True
+
+    def __init__(self, fp: str | None = None, port: int | None = None, interval=10.0, window=1000):
+        self.fp = fp
+        self.interval = interval
+        self.window = window
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.durations: Dict[str, deque] = {}
+        # stage -> [count, total seconds] since the start
+        self.totals: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+        self.timers: Dict[str, _StageTimer] = {}
+        self.last_emit = time.monotonic()
+
+        self.server = None
+        if port is not None:
+            from http.server import ThreadingHTTPServer
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+
+    def stage(self, name: str) -> _StageTimer:
+        timer = self.timers.get(name)
+        if timer is None:
+            self.durations[name] = deque(maxlen=self.window)
+            timer = self.timers[name] = _StageTimer(name, self.durations[name], self.totals)
+        return timer
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP bee_stage_seconds Duration of each pipeline stage, over the last calls",
+            "# TYPE bee_stage_seconds summary",
+        ]
+        for name, durations in list(self.durations.items()):
+            recent = sorted(durations)
+            for q in QUANTILES:
+                if recent:
+                    value = recent[min(len(recent) - 1, int(q * len(recent)))]
+                    lines.append(f'bee_stage_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+            count, total = self.totals[name]
+            lines.append(f'bee_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'bee_stage_seconds_count{{stage="{name}"}} {count}')
+
+        for name, value in list(self.counters.items()):
+            lines.append(f"# TYPE bee_{name}_total counter")
+            lines.append(f"bee_{name}_total {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def maybe_emit(self) -> None:
+        """Write the metrics file if `interval` seconds have passed since it was last written."""
+        if self.fp is None:
+            return
+        now = time.monotonic()
+        if now - self.last_emit >= self.interval:
+            self.last_emit = now
+            self.emit()
+
+    def emit(self) -> None:
+        if self.fp is None:
+            return
+        # write then rename, so readers never see a partial file
+        tmp = f"{self.fp}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, self.fp)
+
+    def close(self) -> None:
+        self.emit()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _make_handler(self):
+        from http.server import BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class NullMetrics:
+    """Stand-in for `Metrics` when instrumentation is disabled. Every call is a no-op."""
+
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def incr(self, name: str, n: int = 1) -> None:
+        pass
+
+    def maybe_emit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def make_metrics(config) -> Metrics | NullMetrics:
+    """Build the metrics for a run from the config. Returns `NULL_METRICS` if instrumentation is disabled."""
+    if not config.METRICS and config.METRICS_PORT is None:
+        return NULL_METRICS
+    return Metrics(config.METRICS, config.METRICS_PORT, config.METRICS_INTERVAL)
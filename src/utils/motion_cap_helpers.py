@@ -5,6 +5,9 @@ import numpy as np
 from .logging import log_it, generate_log_message
 from collections import namedtuple
 from .text_detect import text_detect
+from .metrics import NULL_METRICS
+from .debounce import Burst
+from .kernels import any_overlap, contour_stats
 
 RECT_NAMEDTUPLE = namedtuple("RECT_NAMEDTUPLE", "x1 x2 y1 y2")
 
@@ -33,33 +36,56 @@ def overlap(rec1, rec2) -> bool:
         return False
 
 
-def get_tube_hives_coords(frame, log=None, logging_callback=None) -> np.ndarray:
+def detect_tube_hives(frame, scale: float = 1.0) -> np.ndarray:
     """
-    Get the coordinates of the tube hives in the frame. Returns a numpy array of the coordinates.
+    Detect the tube hives in the frame with a Hough transform. Returns a numpy array of the (x, y, r) coordinates.
+    `scale` is how much the frame was downscaled while decoding (see `DECODE_SCALE`), to scale the tube sizes by.
     """
     tube_hives = cv2.HoughCircles(
         image=frame,
         method=cv2.HOUGH_GRADIENT,
         dp=1,
-        minDist=50,
+        minDist=50 * scale,
         param1=50,
         param2=30,
-        minRadius=5,
-        maxRadius=60,
+        minRadius=max(1, round(5 * scale)),
+        maxRadius=round(60 * scale),
     )
 
-    tube_hives: np.ndarray = np.around(tube_hives).astype(int)[0]
+    if tube_hives is None:
+        return np.empty((0, 3), dtype=int)
+
+    return np.around(tube_hives).astype(int)[0]
 
-    # deal with logging
-    tube_hives_msg = "Coordinates of Tube Hives detected, along with associated Bee ID:\n"
+
+def log_tube_hives(
+    tube_hives, log=None, logging_callback=None, source: str | None = None, confidences=None
+) -> None:
+    """Print and log the tube hive coordinates along with their associated Bee IDs (and detection confidence, if known)."""
+    tube_hives_msg = "Coordinates of Tube Hives detected, along with associated Bee ID"
+    if source:
+        tube_hives_msg += f" ({source})"
+    tube_hives_msg += ":\n"
     tube_hives_msg += "\n".join(
-        [f"Bee ID={i} Tube Hive Coords: {circle[:2]}" for i, circle in enumerate(tube_hives)]
+        [
+            f"Bee ID={i} Tube Hive Coords: {circle[:2]}"
+            + (f" Confidence: {confidences[i]:.2f}" if confidences is not None else "")
+            for i, circle in enumerate(tube_hives)
+        ]
     )
     tube_hives_msg += "\n\n"
     print(tube_hives_msg)
     if log:
         log_it(log, tube_hives_msg, logging_callback)
 
+
+def get_tube_hives_coords(frame, log=None, logging_callback=None) -> np.ndarray:
+    """
+    Get the coordinates of the tube hives in the frame. Returns a numpy array of the coordinates.
+    """
+    tube_hives = detect_tube_hives(frame)
+    log_tube_hives(tube_hives, log, logging_callback)
+
     return tube_hives
 
 
@@ -119,8 +145,56 @@ def draw_assigned_contour_on_frame(assigned_contour, frame) -> None:
         )
 
 
+def log_bursts(bursts, TOTAL_FRAMES, config, logging_callback, metrics=NULL_METRICS) -> None:
+    """Log finished bursts of detections (see `EventDebouncer`), one line each.
+
+    The timestamp is only read here, from the first detection of the burst, instead of for every contour.
+    """
+    for burst in bursts:
+        timestamp_text = None
+        if burst.timestamp_crop is not None:
+            timestamp_text = text_detect(burst.timestamp_crop, metrics)
+
+        log_msg = generate_log_message(
+            burst.start_frame,
+            TOTAL_FRAMES,
+            timestamp_text,
+            burst.bee_id,
+            burst.event,
+            burst.end_frame,
+        )
+        print(log_msg)
+        if config.LOG:
+            log_it(config.LOG, log_msg, logging_callback)
+        metrics.incr("events_logged")
+
+
+def debounce(
+    debouncer, bee_id, frame_count, assigned_contour, timestamp_crop, event=None
+) -> List[Burst]:
+    """Add a detection to the debouncer, returning the bursts that are ready to be logged.
+    Without a debouncer, every detection is logged on its own."""
+    if debouncer is None:
+        return [Burst(bee_id, event, frame_count, frame_count, assigned_contour, timestamp_crop)]
+    return debouncer.add(bee_id, frame_count, assigned_contour, timestamp_crop, event)
+
+
+def get_boxes(contour_infos: List[dict]) -> np.ndarray:
+    """The bounding boxes (from `filter_contours`) of the assigned contours, as an (n, 4) array of [x1, x2, y1, y2]."""
+    return np.array(
+        [contour_info["assigned_contour"]["bbox"] for contour_info in contour_infos],
+        dtype=np.int32,
+    ).reshape(-1, 4)
+
+
 def process_contours_window(
-    contours_window: List[List[dict]], TOTAL_FRAMES, config, imshow_callback, logging_callback
+    contours_window: List[List[dict]],
+    TOTAL_FRAMES,
+    config,
+    imshow_callback,
+    logging_callback,
+    debouncer=None,
+    metrics=NULL_METRICS,
 ) -> None:
     """Process the contour window to determine when a bee leaves the frame.
         The idea here is that when a bee finally disappears, it is at the end of its
@@ -133,6 +207,8 @@ def process_contours_window(
         config (Config): The config object.
         imshow_callback (function): The callback function to call to show the frame.
         logging_callback (function): The callback function to call to log the message.
+        debouncer (EventDebouncer): Coalesces repeated detections of a bee. If None, every detection is logged.
+        metrics (Metrics): Per-stage timers and counters.
 
     Returns:
         None
@@ -142,7 +218,6 @@ def process_contours_window(
         return None
 
     # process the contours window to determine when a bee leaves the frame
-    contours_to_log = []
     last_frame = contours_window[-1]
     if last_frame is None or len(last_frame) == 0:
         return None
@@ -155,67 +230,90 @@ def process_contours_window(
         contour_info for contour_info in last_frame if contour_info["assigned_contour"] is not None
     ]
 
-    for contour_info in contours_to_check:
-        (x, y, w, h) = cv2.boundingRect(contour_info["assigned_contour"]["contour"])
-        overlap_found = False
-        for older_frame in contours_window[: len(contours_window) - 1]:
-
-            # if we found an overlap, we don''t need to keep checking this contour against old frames
-            if overlap_found:
-                break
-
-            for older_contour_info in older_frame:
-
-                # ignore frames with no contours
-                if older_contour_info["assigned_contour"] is None:
-                    continue
-
-                (o_x, o_y, o_w, o_h) = cv2.boundingRect(
-                    older_contour_info["assigned_contour"]["contour"]
-                )
-                if overlap(
-                    RECT_NAMEDTUPLE(
-                        x,
-                        x + w,
-                        y,
-                        y + h,
-                    ),
-                    RECT_NAMEDTUPLE(
-                        o_x,
-                        o_x + o_w,
-                        o_y,
-                        o_y + o_h,
-                    ),
-                ):
-                    overlap_found = True
-                    break
-
-        if not overlap_found:
-            contours_to_log.append(contour_info)
-
-    # log the contours that made it through the window, and draw them on the frame_to_show
+    # check every contour against the contours of all the older frames at once
+    older_contours = [
+        older_contour_info
+        for older_frame in contours_window[: len(contours_window) - 1]
+        for older_contour_info in older_frame
+        if older_contour_info["assigned_contour"] is not None
+    ]
+    overlap_found = any_overlap(get_boxes(contours_to_check), get_boxes(older_contours))
+    contours_to_log = [
+        contour_info for contour_info, found in zip(contours_to_check, overlap_found) if not found
+    ]
+
+    # log the contours that made it through the window
     for contour_info in contours_to_log:
 
         # extract elements from contour info
         frame_count = contour_info["frame_count"]
-        bee_id = contour_info["assigned_contour"]["bee_id"]
-        timestamp_text = contour_info["timestamp"]
-
-        # show image
-        draw_assigned_contour_on_frame(contour_info["assigned_contour"], frame_to_show)
-
-        log_msg = generate_log_message(frame_count, TOTAL_FRAMES, timestamp_text, bee_id)
-        print(log_msg)
-        if config.LOG:
-            log_it(config.LOG, log_msg, logging_callback)
+        assigned_contour = contour_info["assigned_contour"]
+
+        bursts = debounce(
+            debouncer,
+            assigned_contour["bee_id"],
+            frame_count,
+            assigned_contour,
+            contour_info["timestamp_crop"],
+        )
+        log_bursts(bursts, TOTAL_FRAMES, config, logging_callback, metrics)
 
+    # drawn once the timestamps are read or copied, since the timestamp crops are views of the frame
     if config.SHOW:
+        for contour_info in contours_to_log:
+            draw_assigned_contour_on_frame(contour_info["assigned_contour"], frame_to_show)
         if imshow_callback is not None:
             imshow_callback(frame_to_show)
         else:
             cv2.imshow("🐝🏨 motion detector", frame_to_show)
 
 
+def process_track_events(
+    events,
+    frame,
+    TOTAL_FRAMES,
+    config,
+    imshow_callback,
+    logging_callback,
+    debouncer=None,
+    metrics=NULL_METRICS,
+) -> None:
+    """Log the enter/exit events of finished tracks (see `BeeTracker`), and show the frame.
+
+    Args:
+        events (List[TrackEvent]): The events of the tracks that ended on this frame.
+        frame (np.ndarray): The current frame, to draw the events on.
+        TOTAL_FRAMES (int): The total number of frames in the video.
+        config (Config): The config object.
+        imshow_callback (function): The callback function to call to show the frame.
+        logging_callback (function): The callback function to call to log the message.
+        debouncer (EventDebouncer): Coalesces repeated events of a bee. If None, every event is logged.
+        metrics (Metrics): Per-stage timers and counters.
+
+    Returns:
+        None
+    """
+    for event in events:
+        bursts = debounce(
+            debouncer,
+            event.bee_id,
+            event.frame_count,
+            event.assigned_contour,
+            event.timestamp_crop,
+            event.event,
+        )
+        log_bursts(bursts, TOTAL_FRAMES, config, logging_callback, metrics)
+
+    # drawn once the events are logged, like in `process_contours_window`
+    if config.SHOW:
+        for event in events:
+            draw_assigned_contour_on_frame(event.assigned_contour, frame)
+        if imshow_callback is not None:
+            imshow_callback(frame)
+        else:
+            cv2.imshow("🐝🏨 motion detector", frame)
+
+
 def preprocess_frame(frame, config):
     """Preprocess a frame for motion detection
 
@@ -231,8 +329,6 @@ def preprocess_frame(frame, config):
 
     # put black rectangle over timestamp if present
     if config.TIMESTAMP:
-        if config.TIMESTAMP_RECT is None:
-            raise ValueError("Timestamp rectangle coordinates not provided")
         rgb = cv2.rectangle(
             img=rgb,
             pt1=config.TIMESTAMP_RECT[:2],
@@ -267,8 +363,7 @@ def detect_contours_of_motion(preprocessed, previous_frame, base_frame, config):
     previous_frame = preprocessed
 
     # 4. Dilute the image a bit to make differences more seeable; more suitable for contour detection
-    kernel = np.ones((5, 5))
-    diff_frame = cv2.dilate(diff_frame, kernel, 1)
+    diff_frame = cv2.dilate(diff_frame, config.dilation_kernel, 1)
 
     # 5. Only take different areas that are different enough (>motion_threshold / 255)
     thresh_frame = cv2.threshold(
@@ -283,52 +378,155 @@ def detect_contours_of_motion(preprocessed, previous_frame, base_frame, config):
     return contours, previous_frame
 
 
-def filter_contours(contours, tube_hives, config) -> List[dict]:
+class MotionDetector:
+    """Stateful version of `preprocess_frame` and `detect_contours_of_motion` that doesn't allocate per frame.
+
+    The detector owns uint8 work buffers for the grayscale frame, the difference between frames,
+    its dilation and threshold, and two preprocessed frame buffers used in turn (one holds the
+    previous frame while the other is written). All OpenCV calls write into these with `dst=`.
+    Buffers are allocated on the first frame, and again only if the frame size changes.
+
+    Frames returned by `preprocess` are only valid until the next-but-one call to `preprocess`;
+    copy them to keep them longer.
+
+    Example:
+        detector = MotionDetector(config)
+        preprocessed = detector.preprocess(frame)
+        contours = detector.detect(preprocessed)
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.shape = None
+        self.previous = None
+
+        # cv2.rectangle fills pt1 to pt2 inclusive, which preprocess_frame relies on
+        self.timestamp_mask = None
+        if config.TIMESTAMP:
+            x1, y1, x2, y2 = config.TIMESTAMP_RECT
+            self.timestamp_mask = (slice(y1, y2 + 1), slice(x1, x2 + 1))
+
+    def _allocate(self, shape) -> None:
+        self.shape = shape
+        self.gray = np.empty(shape, dtype=np.uint8)
+        self.buffers = [np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.uint8)]
+        self.diff = np.empty(shape, dtype=np.uint8)
+        self.dilated = np.empty(shape, dtype=np.uint8)
+        self.thresh = np.empty(shape, dtype=np.uint8)
+        self.previous = None
+
+    def preprocess(self, frame) -> np.ndarray:
+        """Same as `preprocess_frame`, written into one of the detector's buffers."""
+        if frame.shape[:2] != self.shape:
+            self._allocate(frame.shape[:2])
+
+        # preprocess_frame converts BGR to RGB and then converts that with BGR2GRAY,
+        # which is a single RGB2GRAY conversion of the original frame.
+        # Frames decoded with ffmpeg are already gray (their luma, which isn't weighted the same), and
+        # are copied so masking doesn't change them
+        if frame.ndim == 2:
+            np.copyto(self.gray, frame)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        if self.timestamp_mask is not None:
+            self.gray[self.timestamp_mask] = 0
+
+        # write into whichever buffer isn't holding the previous frame
+        out = self.buffers[0] if self.buffers[0] is not self.previous else self.buffers[1]
+        cv2.GaussianBlur(self.gray, (5, 5), 0, dst=out)
+        return out
+
+    def set_previous(self, preprocessed) -> None:
+        """Set the frame the next call to `detect` will compare against."""
+        self.previous = preprocessed
+
+    def detect(self, preprocessed) -> List[np.ndarray]:
+        """Same as `detect_contours_of_motion`, against the previous frame passed to `detect` or `set_previous`."""
+        if preprocessed.shape != self.shape:
+            # frames preprocessed elsewhere, eg. read from the frame cache
+            previous = self.previous
+            self._allocate(preprocessed.shape)
+            self.previous = previous
+        cv2.absdiff(self.previous, preprocessed, dst=self.diff)
+        self.previous = preprocessed
+
+        cv2.dilate(self.diff, self.config.dilation_kernel, dst=self.dilated, iterations=1)
+        cv2.threshold(
+            self.dilated, self.config.MOTION_THRESHOLD, 255, cv2.THRESH_BINARY, dst=self.thresh
+        )
+
+        contours, _ = cv2.findContours(
+            image=self.thresh, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE
+        )
+        return contours
+
+
+def filter_contours(contours, tube_hives, config, keep_unassigned=False) -> List[dict]:
     """Filter out contours using a variety of techniques to reduce False Positives
 
     Args:
         contours (List[np.ndarray]): The contours to filter
         tube_hives (List[Tuple[int, int]]): The coordinates of the tube hives
         config (MotionCapConfig): The configuration object
+        keep_unassigned (bool): Keep contours too far from any tube, with a bee_id and closest_tube of None (used for tracking)
 
     Returns:
-        filtered_contours (List[dict]): The filtered contours, with bee_id and closest_tube
+        filtered_contours (List[dict]): The filtered contours, with bee_id, closest_tube, bbox and centroid
 
     Example output:
         [
             {
                 "contour": np.ndarray,
                 "bee_id": 1,
-                "closest_tube": (x, y)
+                "closest_tube": (x, y),
+                "bbox": [x1, x2, y1, y2],
+                "centroid": (x, y)
             },
     """
 
     filtered_contours = []
 
+    # the areas, centers and bounding boxes of all the contours, computed in one batch
+    moments, boxes = contour_stats(contours)
+
     # filter out contours that are too small or too large
-    filtered_on_size = [
-        c
-        for c in contours
-        if config.MIN_CONTOUR_AREA < cv2.contourArea(c) < config.MAX_CONTOUR_AREA
-    ]
+    areas = moments[:, 0]
+    filtered_on_size = np.flatnonzero(
+        (config.MIN_CONTOUR_AREA < areas) & (areas < config.MAX_CONTOUR_AREA)
+    )
+    if len(filtered_on_size) == 0:
+        return filtered_contours
+
+    # the centroids from the moments, and as get_contour_center for each contour
+    centroids = moments[filtered_on_size, 1:] / areas[filtered_on_size, None]
+    middles = centroids.astype(int)
 
-    # find the closest circle to the detected motion.
+    # find the closest circle to the detected motion (same as find_closest_circle, for all of them at once).
     # we associate a bee with its closest circle once disappearing, hence bee_id
-    for c in filtered_on_size:
-        middle = get_contour_center(c)
-        bee_id = find_closest_circle(tube_hives, middle, config)
+    circles = np.asarray(tube_hives, dtype=float).reshape(-1, 3)
+    distances = np.hypot(
+        middles[:, None, 0] - circles[None, :, 0], middles[:, None, 1] - circles[None, :, 1]
+    )
+    distances[distances > config.MAX_DISTANCE_FROM_TUBE] = np.inf
+
+    for i, contour_index in enumerate(filtered_on_size):
+        bee_id = None
+        if len(circles) and np.isfinite(distances[i]).any():
+            bee_id = int(np.argmin(distances[i]))
 
         # If the bee_id is None, that means that it was not assigned to any tube (too far away)
-        if bee_id is None:
+        if bee_id is None and not keep_unassigned:
             continue
 
-        closest_tube = tube_hives[bee_id]
+        closest_tube = tube_hives[bee_id] if bee_id is not None else None
 
         filtered_contours.append(
             {
-                "contour": c,
+                "contour": contours[contour_index],
                 "bee_id": bee_id,
                 "closest_tube": closest_tube,
+                "bbox": boxes[contour_index],
+                "centroid": centroids[i],
             }
         )
 
@@ -339,22 +537,20 @@ def build_contour_window_entry(assigned_contours, frame, frame_count, config) ->
     # initialize the contour window entry
     contour_window_entry: List[dict] = []
 
-    # for each contour assigned to a Bee ID, extract the timestamp and add it to the contour window entry
-    for assigned_contour in assigned_contours:
-
-        timestamp_text = text_detect(
-            frame[
-                config.TIMESTAMP_RECT[1] : config.TIMESTAMP_RECT[3],
-                config.TIMESTAMP_RECT[0] : config.TIMESTAMP_RECT[2],
-            ]
-        )
+    # there is no timestamp to read if the video doesn't have one.
+    # The timestamp is only read (with OCR) if the contour gets logged, see `log_bursts`
+    timestamp_crop = None
+    if config.TIMESTAMP:
+        timestamp_crop = frame[config.timestamp_slice]
 
+    # for each contour assigned to a Bee ID, add it to the contour window entry with the timestamp
+    for assigned_contour in assigned_contours:
         contour_window_entry.append(
             {
                 "frame_count": frame_count,
                 "frame": frame,
                 "assigned_contour": assigned_contour,
-                "timestamp": timestamp_text,
+                "timestamp_crop": timestamp_crop,
             }
         )
 
@@ -366,7 +562,7 @@ def build_contour_window_entry(assigned_contours, frame, frame_count, config) ->
                 "frame_count": frame_count,
                 "frame": frame,
                 "assigned_contour": None,
-                "timestamp": None,
+                "timestamp_crop": None,
             }
         )
 
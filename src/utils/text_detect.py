@@ -1,9 +1,32 @@
 import cv2
-from pytesseract import pytesseract
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
+from .metrics import NULL_METRICS
 
 INVALID_TIMESTAMP = "INVALID_TIMESTAMP"
 
+# Number of recent OCR results kept. The timestamp only changes once per second, so consecutive
+# detections usually binarize to the exact same image and don't need tesseract again.
+OCR_CACHE_SIZE = 32
+
+# sha1 of the binarized timestamp image -> cleaned text
+_ocr_cache: OrderedDict = OrderedDict()
+
+
+def _pytesseract():
+    # pytesseract (and pandas, which it imports if installed) is slow to import,
+    # and only needed once a timestamp is actually read
+    from pytesseract import pytesseract
+
+    return pytesseract
+
+
+def set_tesseract_cmd(tesseract: str) -> None:
+    """Point pytesseract at the tesseract executable. If empty, tesseract is looked up on the PATH."""
+    if tesseract:
+        _pytesseract().tesseract_cmd = tesseract
+
 
 def clean_timestamp(timestamp_to_parse: str) -> str:
     if len(timestamp_to_parse) < 5:
@@ -44,11 +67,13 @@ def clean_timestamp(timestamp_to_parse: str) -> str:
     return timestamp
 
 
-def text_detect(img) -> str:
-    """Detect text in an image using pytesseract. Returns the text as a string."""
+def text_detect(img, metrics=NULL_METRICS) -> str:
+    """Detect text in an image using pytesseract. Returns the text as a string.
+    Results are cached on the binarized image, so a repeated timestamp is only read once.
+    """
 
-    # convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # convert to grayscale (frames decoded with ffmpeg already are)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
 
     # apply thresholding
     thresh = cv2.threshold(gray, 100, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
@@ -59,10 +84,22 @@ def text_detect(img) -> str:
     # add padding
     with_border = cv2.copyMakeBorder(thresh, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=[0, 0, 0])
 
-    text = pytesseract.image_to_string(with_border, config=r"--oem 3 --psm 6")
+    key = hashlib.sha1(with_border.tobytes()).digest() + bytes(str(with_border.shape), "ascii")
+    if key in _ocr_cache:
+        _ocr_cache.move_to_end(key)
+        metrics.incr("ocr_cache_hits")
+        return _ocr_cache[key]
+
+    metrics.incr("ocr_calls")
+    with metrics.stage("ocr"):
+        text = _pytesseract().image_to_string(with_border, config=r"--oem 3 --psm 6")
 
     clean_text = text.split("_")[-1].strip()
     clean_text = "".join(c for c in clean_text if (c.isdigit() or c == ":"))
     cleaned = clean_timestamp(clean_text)
 
+    _ocr_cache[key] = cleaned
+    if len(_ocr_cache) > OCR_CACHE_SIZE:
+        _ocr_cache.popitem(last=False)
+
     return cleaned
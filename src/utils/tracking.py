@@ -0,0 +1,213 @@
+from dataclasses import dataclass
+from math import dist
+from typing import List, Tuple
+import numpy as np
+
+# cost of an assignment that is not allowed (further apart than max_distance)
+INFEASIBLE = 1e9
+
+# the difference between two frames shows a moving bee both where it is and where it was. The contour
+# where it was is the same as the one found on the previous detection frame, so contours closer than
+# this (in pixels) to one of those are dropped
+GHOST_DISTANCE = 3
+
+
+@dataclass(slots=True)
+class Track:
+    """A bee followed across frames. `first`/`last` are the assigned contours (see `filter_contours`) it started and ended with."""
+
+    track_id: int
+    first: dict
+    last: dict
+    first_frame: int
+    last_frame: int
+    first_centroid: Tuple[float, float]
+    last_centroid: Tuple[float, float]
+    # crops of the timestamp when the track started and when it was last seen, read only if an event is logged
+    first_timestamp_crop: np.ndarray | None
+    last_timestamp_crop: np.ndarray | None
+    hits: int = 1
+
+
+@dataclass(slots=True)
+class TrackEvent:
+    """A bee entering or exiting a tube, emitted once per finished track."""
+
+    event: str
+    bee_id: int
+    frame_count: int
+    assigned_contour: dict
+    timestamp_crop: np.ndarray | None
+
+
+def _linear_sum_assignment():
+    """scipy's Hungarian algorithm, or None if scipy isn't installed."""
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return None
+    return linear_sum_assignment
+
+
+def assign(cost: np.ndarray, max_cost: float) -> List[Tuple[int, int]]:
+    """Match rows to columns of a cost matrix minimizing the total cost, ignoring pairs costing more than `max_cost`.
+
+    Uses the Hungarian algorithm from scipy if it is installed, and otherwise matches the
+    cheapest pairs first (which gives the same result unless bees are very close together).
+    """
+    if cost.size == 0:
+        return []
+
+    gated = np.where(cost <= max_cost, cost, INFEASIBLE)
+    linear_sum_assignment = _linear_sum_assignment()
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(gated)
+        return [(r, c) for r, c in zip(rows, cols) if gated[r, c] < INFEASIBLE]
+
+    pairs = []
+    used_rows, used_cols = set(), set()
+    for flat_index in np.argsort(gated, axis=None):
+        r, c = np.unravel_index(flat_index, gated.shape)
+        if gated[r, c] >= INFEASIBLE:
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        pairs.append((r, c))
+        used_rows.add(r)
+        used_cols.add(c)
+    return pairs
+
+
+class BeeTracker:
+    """Links the contours of consecutive detection frames into tracks, and emits one event per finished track.
+
+    Each detection frame, contours are matched to the active tracks by the distance between their
+    centroids (at most `max_distance` pixels apart). A track that goes `max_age` frames without a
+    match has ended: if it ended near a tube the bee entered that tube, otherwise if it started near
+    a tube the bee exited that tube. Tracks that never came near a tube produce no event.
+
+    The work per frame is proportional to the active tracks times the contours in the frame,
+    instead of comparing against every contour in a window of frames.
+    """
+
+    def __init__(self, max_distance: float, max_age: int, timestamp_slice=None):
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.timestamp_slice = timestamp_slice
+        self.tracks: List[Track] = []
+        self.next_track_id = 0
+        self.previous_centroids = np.empty((0, 2))
+
+    def _timestamp_crop(self, frame) -> np.ndarray | None:
+        if self.timestamp_slice is None:
+            return None
+        # copy, since the frame buffer may be reused
+        return frame[self.timestamp_slice].copy()
+
+    def update(self, assigned_contours: List[dict], frame, frame_count: int) -> List[TrackEvent]:
+        """Add the contours of a detection frame, returning the events of the tracks that ended.
+
+        Args:
+            assigned_contours (List[dict]): The contours of the frame, from `filter_contours`. `bee_id`
+                is None for contours that are not near a tube.
+            frame (np.ndarray): The frame the contours were found in
+            frame_count (int): The number of the frame
+
+        Returns:
+            List[TrackEvent]: The enter/exit events of the tracks that ended on this frame
+        """
+        centroids = get_centroids(assigned_contours)
+
+        # drop the contours of where bees were on the previous detection frame
+        previous_centroids, self.previous_centroids = self.previous_centroids, centroids
+        ghosts = (distances(centroids, previous_centroids) <= GHOST_DISTANCE).any(axis=1)
+        assigned_contours = [c for c, ghost in zip(assigned_contours, ghosts) if not ghost]
+        centroids = centroids[~ghosts]
+
+        last_centroids = np.array([t.last_centroid for t in self.tracks], dtype=float)
+        matches = assign(distances(last_centroids, centroids), self.max_distance)
+
+        timestamp_crop = None
+        if assigned_contours:
+            timestamp_crop = self._timestamp_crop(frame)
+
+        matched_detections = set()
+        for track_index, detection_index in matches:
+            track = self.tracks[track_index]
+            track.last = assigned_contours[detection_index]
+            track.last_centroid = tuple(centroids[detection_index])
+            track.last_frame = frame_count
+            track.last_timestamp_crop = timestamp_crop
+            track.hits += 1
+            matched_detections.add(detection_index)
+
+        for i, assigned_contour in enumerate(assigned_contours):
+            if i in matched_detections:
+                continue
+            self.tracks.append(
+                Track(
+                    track_id=self.next_track_id,
+                    first=assigned_contour,
+                    last=assigned_contour,
+                    first_frame=frame_count,
+                    last_frame=frame_count,
+                    first_centroid=tuple(centroids[i]),
+                    last_centroid=tuple(centroids[i]),
+                    first_timestamp_crop=timestamp_crop,
+                    last_timestamp_crop=timestamp_crop,
+                )
+            )
+            self.next_track_id += 1
+
+        ended = [t for t in self.tracks if frame_count - t.last_frame > self.max_age]
+        self.tracks = [t for t in self.tracks if frame_count - t.last_frame <= self.max_age]
+        return [e for e in (track_event(t) for t in ended) if e is not None]
+
+    def flush(self) -> List[TrackEvent]:
+        """End all the active tracks (eg. at the end of the video), returning their events."""
+        ended, self.tracks = self.tracks, []
+        self.previous_centroids = np.empty((0, 2))
+        return [e for e in (track_event(t) for t in ended) if e is not None]
+
+
+def get_centroids(assigned_contours: List[dict]) -> np.ndarray:
+    """The centroids of assigned contours (see `filter_contours`), as an (n, 2) array."""
+    return np.array([c["centroid"] for c in assigned_contours], dtype=float).reshape(-1, 2)
+
+
+def distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """The (len(a), len(b)) matrix of distances between the points of a and b."""
+    a = np.asarray(a, dtype=float).reshape(-1, 2)
+    b = np.asarray(b, dtype=float).reshape(-1, 2)
+    return np.hypot(a[:, None, 0] - b[None, :, 0], a[:, None, 1] - b[None, :, 1])
+
+
+def track_event(track: Track) -> TrackEvent | None:
+    """Decide whether a finished track was a bee entering or exiting a tube (or neither)."""
+    ends_near_tube = track.last["bee_id"] is not None
+    starts_near_tube = track.first["bee_id"] is not None
+
+    if ends_near_tube and starts_near_tube and track.hits > 1:
+        # near tubes at both ends: entered if it got closer to its tube, otherwise exited
+        start_distance = dist(track.first_centroid, track.first["closest_tube"][:2])
+        end_distance = dist(track.last_centroid, track.last["closest_tube"][:2])
+        ends_near_tube = end_distance <= start_distance
+
+    if ends_near_tube:
+        return TrackEvent(
+            "enter",
+            track.last["bee_id"],
+            track.last_frame,
+            track.last,
+            track.last_timestamp_crop,
+        )
+    if starts_near_tube:
+        return TrackEvent(
+            "exit",
+            track.first["bee_id"],
+            track.first_frame,
+            track.first,
+            track.first_timestamp_crop,
+        )
+    return None
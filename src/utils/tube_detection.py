@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
+from .motion_cap_helpers import detect_tube_hives
+
+
+def sample_frame_indices(buffer_frames: int, n_samples: int) -> List[int]:
+    """Pick `n_samples` frame indices spread evenly across the warm-up period.
+    The last index is always `buffer_frames`, the frame tube detection used to run on by itself.
+    """
+    n_samples = max(1, min(n_samples, buffer_frames + 1))
+    return sorted(set(np.linspace(0, buffer_frames, n_samples).round().astype(int).tolist()))
+
+
+def vote_tube_hives(
+    circle_sets: List[np.ndarray], min_confidence: float, cluster_distance: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster the circles found in several frames into a consensus tube layout.
+
+    Each frame votes at most once for each cluster. A circle joins the closest cluster within
+    `cluster_distance` pixels, or starts a new one. Clusters voted for by less than `min_confidence`
+    of the frames are dropped, which removes circles that came from a bee or a shadow in one frame.
+
+    Args:
+        circle_sets (List[np.ndarray]): The (x, y, r) circles detected in each frame
+        min_confidence (float): Minimum fraction of frames a tube must be detected in
+        cluster_distance (float): Maximum distance between circles of the same tube
+
+    Returns:
+        tube_hives (np.ndarray): The consensus (x, y, r) coordinates (median of each cluster)
+        confidences (np.ndarray): The fraction of frames each tube was detected in
+    """
+    clusters: List[List[np.ndarray]] = []
+    centers: List[np.ndarray] = []
+
+    for circles in circle_sets:
+        voted = set()
+        for circle in circles:
+            closest, closest_dist = None, None
+            for i, center in enumerate(centers):
+                if i in voted:
+                    continue
+                d = np.hypot(*(center - circle[:2]))
+                if d <= cluster_distance and (closest_dist is None or d < closest_dist):
+                    closest, closest_dist = i, d
+
+            if closest is None:
+                clusters.append([circle])
+                centers.append(circle[:2].astype(float))
+                closest = len(clusters) - 1
+            else:
+                clusters[closest].append(circle)
+                centers[closest] = np.mean(clusters[closest], axis=0)[:2]
+            voted.add(closest)
+
+    n_frames = max(len(circle_sets), 1)
+    tube_hives, confidences = [], []
+    for cluster in clusters:
+        confidence = len(cluster) / n_frames
+        if confidence < min_confidence:
+            continue
+        tube_hives.append(np.around(np.median(cluster, axis=0)).astype(int))
+        confidences.append(confidence)
+
+    if len(tube_hives) == 0:
+        return np.empty((0, 3), dtype=int), np.empty(0)
+
+    return np.array(tube_hives), np.array(confidences)
+
+
+class TubeHiveVoter:
+    """Collects warm-up frames and runs tube detection on them in a thread pool.
+
+    cv2.HoughCircles releases the GIL, so with `eager=True` detection runs while the main loop keeps
+    decoding. With `eager=False` the frames are only held, and detection is run when `result()` is
+    called (used when a stored tube layout will most likely make detection unnecessary).
+    """
+
+    def __init__(
+        self,
+        n_frames: int,
+        min_confidence: float,
+        cluster_distance: float,
+        eager=True,
+        scale: float = 1.0,
+    ):
+        self.min_confidence = min_confidence
+        self.scale = scale
+        self.cluster_distance = cluster_distance
+        self.eager = eager
+        self.frames: List[np.ndarray] = []
+        self.futures: List[Future] = []
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(n_frames, os.cpu_count() or 1)))
+
+    def add(self, preprocessed: np.ndarray) -> None:
+        # copy, since the caller may reuse the buffer for the next frame
+        frame = preprocessed.copy()
+        if self.eager:
+            self.futures.append(self.executor.submit(detect_tube_hives, frame, self.scale))
+        else:
+            self.frames.append(frame)
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Wait for detection on all the added frames and return the voted (tube_hives, confidences)."""
+        self.futures += [
+            self.executor.submit(detect_tube_hives, f, self.scale) for f in self.frames
+        ]
+        self.frames = []
+
+        circle_sets = [future.result() for future in self.futures]
+        self.futures = []
+        self.executor.shutdown()
+
+        return vote_tube_hives(circle_sets, self.min_confidence, self.cluster_distance)
+
+    def close(self) -> None:
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=False)
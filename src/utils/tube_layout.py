@@ -0,0 +1,202 @@
+import os
+from math import hypot
+from typing import Callable, Tuple
+import cv2
+import numpy as np
+from .motion_cap_helpers import detect_tube_hives, log_tube_hives
+
+# downscale factor used for the reference thumbnail stored with a layout
+REFERENCE_SCALE = 4
+
+
+def make_reference(frame: np.ndarray) -> np.ndarray:
+    """Build the small float32 thumbnail used to check if the hotel has moved between runs."""
+    h, w = frame.shape[:2]
+    small = cv2.resize(
+        frame, (w // REFERENCE_SCALE, h // REFERENCE_SCALE), interpolation=cv2.INTER_AREA
+    )
+    return small.astype(np.float32)
+
+
+def save_tube_layout(fp: str, tube_hives: np.ndarray, frame: np.ndarray) -> None:
+    """Save a tube layout to disk. The index of a tube in `tube_hives` is its Bee ID.
+
+    Args:
+        fp (str): Path to the layout file (.npz)
+        tube_hives (np.ndarray): The (x, y, r) coordinates of the tube hives
+        frame (np.ndarray): The preprocessed frame the layout was detected on
+    """
+    directory = os.path.dirname(fp)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # np.savez appends .npz to paths without it, so write through a file handle instead
+    with open(fp, "wb") as f:
+        np.savez(
+            f,
+            tube_hives=np.asarray(tube_hives, dtype=int),
+            reference=make_reference(frame),
+            frame_shape=np.array(frame.shape[:2]),
+        )
+
+
+def load_tube_layout(fp: str) -> Tuple[np.ndarray, np.ndarray, Tuple[int, int]] | None:
+    """Load a tube layout saved with `save_tube_layout`. Returns None if there is no layout at `fp`.
+
+    Returns:
+        (tube_hives, reference, frame_shape)
+    """
+    if not os.path.exists(fp):
+        return None
+
+    with np.load(fp) as layout:
+        return (
+            layout["tube_hives"],
+            layout["reference"],
+            tuple(int(v) for v in layout["frame_shape"]),
+        )
+
+
+def estimate_shift(reference: np.ndarray, frame: np.ndarray) -> Tuple[float, float]:
+    """Estimate how far (in full-resolution pixels) the scene has shifted since `reference` was taken."""
+    current = make_reference(frame)
+    if reference.shape != current.shape:
+        # taken at another resolution
+        reference = cv2.resize(reference, current.shape[1::-1], interpolation=cv2.INTER_AREA)
+    (dx, dy), _ = cv2.phaseCorrelate(reference, current)
+    return dx * REFERENCE_SCALE, dy * REFERENCE_SCALE
+
+
+def scale_tube_hives(
+    tube_hives: np.ndarray, from_shape: Tuple[int, int], to_shape: Tuple[int, int]
+) -> np.ndarray:
+    """Scale (x, y, r) tube coordinates from frames of `from_shape` (height, width) to `to_shape`."""
+    scale_y = to_shape[0] / from_shape[0]
+    scale_x = to_shape[1] / from_shape[1]
+    scaled = tube_hives.astype(float)
+    scaled[:, 0] *= scale_x
+    scaled[:, 1] *= scale_y
+    scaled[:, 2] *= (scale_x + scale_y) / 2
+    return np.around(scaled).astype(int)
+
+
+def remap_tube_ids(
+    old_tube_hives: np.ndarray,
+    new_tube_hives: np.ndarray,
+    shift: Tuple[float, float] = (0, 0),
+    max_distance: float = 25,
+) -> np.ndarray:
+    """Give re-detected tubes the Bee IDs of the stored tubes they correspond to.
+
+    Tubes are matched one-to-one by nearest neighbor, after moving the stored tubes by `shift`.
+    Stored tubes that were not re-detected (eg. covered by a bee) keep their shifted position,
+    and newly found tubes are appended with new Bee IDs.
+
+    Args:
+        old_tube_hives (np.ndarray): The stored (x, y, r) coordinates, indexed by Bee ID
+        new_tube_hives (np.ndarray): The re-detected (x, y, r) coordinates, in Hough order
+        shift (Tuple[float, float]): The estimated (dx, dy) movement of the hotel
+        max_distance (float): The maximum distance between a stored and a re-detected tube for them
+            to be matched
+
+    Returns:
+        np.ndarray: The new coordinates, indexed by the stored Bee IDs
+    """
+    predicted = old_tube_hives.astype(float)
+    predicted[:, 0] += shift[0]
+    predicted[:, 1] += shift[1]
+
+    remapped = np.around(predicted).astype(int)
+    if len(new_tube_hives) == 0:
+        return remapped
+
+    # pairwise distances between predicted and re-detected tube centers
+    distances = np.linalg.norm(
+        predicted[:, None, :2] - new_tube_hives[None, :, :2].astype(float), axis=2
+    )
+
+    # greedily match the closest pairs first, so each tube is used at most once
+    matched_old = set()
+    matched_new = set()
+    for flat_index in np.argsort(distances, axis=None):
+        old_i, new_i = np.unravel_index(flat_index, distances.shape)
+        if distances[old_i, new_i] > max_distance:
+            break
+        if old_i in matched_old or new_i in matched_new:
+            continue
+        remapped[old_i] = new_tube_hives[new_i]
+        matched_old.add(old_i)
+        matched_new.add(new_i)
+
+    unmatched = [circle for i, circle in enumerate(new_tube_hives) if i not in matched_new]
+    if unmatched:
+        remapped = np.vstack([remapped, np.array(unmatched, dtype=int)])
+
+    return remapped
+
+
+def load_or_detect_tube_hives(
+    frame, config, logging_callback: Callable = None, detect: Callable = None
+) -> np.ndarray:
+    """Get the tube hive coordinates, reusing the stored layout for this camera if there is one.
+
+    If `config.TUBE_LAYOUT` is not set this is the same as `get_tube_hives_coords`. Otherwise the
+    stored layout is reused as long as the hotel has not moved more than `config.TUBE_LAYOUT_TOLERANCE`
+    pixels. If it has, or the video has another resolution (the stored layout is then scaled to it),
+    the tubes are re-detected and remapped onto the stored Bee IDs, so the IDs stay comparable
+    across all the videos of a camera.
+
+    Args:
+        frame (np.ndarray): The preprocessed frame to check the stored layout against
+        config (MotionCapConfig): The configuration object
+        logging_callback (callable, optional): Callback function to display the log
+        detect (callable, optional): Returns the detected (tube_hives, confidences) when called. Defaults
+            to a single Hough transform on `frame`. Only called if detection is needed.
+    """
+    if detect is None:
+        detect = lambda: (detect_tube_hives(frame, config.DECODE_SCALE), None)
+
+    if not config.TUBE_LAYOUT:
+        tube_hives, confidences = detect()
+        log_tube_hives(tube_hives, config.LOG, logging_callback, confidences=confidences)
+        return tube_hives
+
+    layout = load_tube_layout(config.TUBE_LAYOUT)
+    changed = True
+    confidences = None
+
+    if layout is None:
+        tube_hives, confidences = detect()
+        source = f"detected, saved to {config.TUBE_LAYOUT}"
+    else:
+        old_tube_hives, reference, frame_shape = layout
+        shift = estimate_shift(reference, frame)
+
+        if frame_shape != frame.shape[:2]:
+            # different resolution, the stored tubes are scaled to it and matched to the re-detected ones
+            old_tube_hives = scale_tube_hives(old_tube_hives, frame_shape, frame.shape[:2])
+            tube_hives = remap_tube_ids(
+                old_tube_hives, detect()[0], shift, config.TUBE_REMAP_DISTANCE
+            )
+            source = (
+                f"re-detected after the resolution changed from {frame_shape[1]}x{frame_shape[0]},"
+                f" saved to {config.TUBE_LAYOUT}"
+            )
+        elif hypot(*shift) <= config.TUBE_LAYOUT_TOLERANCE:
+            tube_hives = old_tube_hives
+            source = f"loaded from {config.TUBE_LAYOUT}"
+            changed = False
+        else:
+            tube_hives = remap_tube_ids(
+                old_tube_hives, detect()[0], shift, config.TUBE_REMAP_DISTANCE
+            )
+            source = (
+                f"re-detected after the hotel shifted by ({shift[0]:.1f}, {shift[1]:.1f}),"
+                f" saved to {config.TUBE_LAYOUT}"
+            )
+
+    if changed:
+        save_tube_layout(config.TUBE_LAYOUT, tube_hives, frame)
+
+    log_tube_hives(tube_hives, config.LOG, logging_callback, source=source, confidences=confidences)
+    return tube_hives
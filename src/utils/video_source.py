@@ -0,0 +1,130 @@
+import subprocess
+from typing import Tuple
+import cv2
+import numpy as np
+
+# number of buffers FFmpegFrameSource decodes into, in turn. A frame stays valid until this many more are read
+RING_SIZE = 4
+
+
+def probe_video(fp: str) -> Tuple[int, int, float, float]:
+    """Get the (width, height, fps, frame count) of a video."""
+    cap = cv2.VideoCapture(fp)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video {fp}")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    return width, height, fps, total_frames
+
+
+def scaled_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class OpenCVFrameSource:
+    """Reads BGR frames with `cv2.VideoCapture`, optionally downscaled by `scale`."""
+
+    def __init__(self, fp: str, scale: float = 1.0):
+        self.cap = cv2.VideoCapture(fp)
+        self.scale = scale
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.size = scaled_size(
+            int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            scale,
+        )
+
+    def read(self) -> Tuple[bool, np.ndarray | None]:
+        success, frame = self.cap.read()
+        if success and self.scale != 1:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return success, frame
+
+    def grab(self) -> bool:
+        """Skip a frame, without decoding it if possible."""
+        return self.cap.grab()
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+class FFmpegFrameSource:
+    """Reads grayscale frames decoded by an ffmpeg subprocess.
+
+    ffmpeg converts (and optionally downscales) the frames to raw 8-bit gray, with `threads` decoding
+    threads (0 lets ffmpeg decide), and writes them to a pipe. They are read straight into a ring of
+    `RING_SIZE` preallocated buffers, so no memory is allocated per frame. The pipeline converts to
+    gray anyway, so this skips decoding and converting to BGR first.
+
+    The gray frames are ffmpeg's luma, which weighs the colors differently than the conversion of
+    OpenCV frames in `MotionDetector.preprocess`, so switching decoders slightly changes the detections.
+
+    Frames returned by `read` are reused: copy a frame to keep it for longer than `RING_SIZE` reads.
+    """
+
+    def __init__(self, fp: str, scale: float = 1.0, threads: int = 0, ffmpeg: str = "ffmpeg"):
+        width, height, self.fps, self.total_frames = probe_video(fp)
+        self.fp = fp
+        self.scale = scale
+        self.size = scaled_size(width, height, scale)
+
+        command = [ffmpeg, "-nostdin", "-v", "error", "-threads", str(threads), "-i", fp]
+        command += ["-an", "-sn", "-vsync", "0"]
+        if scale != 1:
+            command += ["-vf", f"scale={self.size[0]}:{self.size[1]}:flags=area"]
+        command += ["-f", "rawvideo", "-pix_fmt", "gray", "pipe:1"]
+
+        try:
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        except FileNotFoundError as e:
+            raise FileNotFoundError(
+                f"ffmpeg not found at {ffmpeg!r}, set FFMPEG to its path"
+            ) from e
+
+        self.buffers = [np.empty(self.size[::-1], dtype=np.uint8) for _ in range(RING_SIZE)]
+        self.index = 0
+
+    def _read_into(self, buffer: np.ndarray) -> bool:
+        view = memoryview(buffer).cast("B")
+        n_read = 0
+        while n_read < len(view):
+            n = self.process.stdout.readinto(view[n_read:])
+            if not n:
+                # the end of the video, unless ffmpeg failed
+                returncode = self.process.wait()
+                if returncode != 0:
+                    raise RuntimeError(
+                        f"ffmpeg exited with code {returncode} while decoding {self.fp}"
+                    )
+                return False
+            n_read += n
+        return True
+
+    def read(self) -> Tuple[bool, np.ndarray | None]:
+        buffer = self.buffers[self.index]
+        if not self._read_into(buffer):
+            return False, None
+        self.index = (self.index + 1) % RING_SIZE
+        return True, buffer
+
+    def grab(self) -> bool:
+        """Skip a frame. It still has to be read from the pipe, but into the next buffer in the ring."""
+        return self._read_into(self.buffers[self.index])
+
+    def release(self) -> None:
+        self.process.stdout.close()
+        self.process.terminate()
+        self.process.wait()
+
+
+def open_frame_source(config) -> OpenCVFrameSource | FFmpegFrameSource:
+    """Open `config.VIDEO` with the decoder selected by `config.DECODER`."""
+    if config.DECODER == "ffmpeg":
+        return FFmpegFrameSource(
+            config.VIDEO, config.DECODE_SCALE, config.DECODE_THREADS, config.FFMPEG or "ffmpeg"
+        )
+    return OpenCVFrameSource(config.VIDEO, config.DECODE_SCALE)
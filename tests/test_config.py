@@ -0,0 +1,91 @@
+import pytest
+from src.config import MotionCapConfig
+
+
+def test_strings_are_parsed_to_the_type_of_the_setting():
+    config = MotionCapConfig.from_dict(
+        {
+            "VIDEO": "video.mp4",
+            "TIMESTAMP": "True",
+            "TIMESTAMP_RECT": "(210, 20, 510, 50)",
+            "DETECTION_RATE": "3",
+            "MOTION_THRESHOLD": "12.5",
+            "SHOW": "off",
+            "LOG": "none",
+            "MOTION_GRANULARITY": "",
+            "NOT_A_SETTING": "ignored",
+        }
+    )
+    assert config.TIMESTAMP is True
+    assert config.TIMESTAMP_RECT == (210, 20, 510, 50)
+    assert config.DETECTION_RATE == 3
+    assert config.MOTION_THRESHOLD == 12.5
+    assert config.SHOW is False
+    assert config.LOG is None
+    assert config.MOTION_GRANULARITY is None
+    assert config.timestamp_slice == (slice(20, 50), slice(210, 510))
+
+
+def test_whole_numbers_are_accepted_for_ints():
+    assert MotionCapConfig.from_dict({"VIDEO": "v", "DETECTION_RATE": "2.0"}).DETECTION_RATE == 2
+    assert MotionCapConfig.from_dict({"VIDEO": "v", "BUFFER_FRAMES": "1e2"}).BUFFER_FRAMES == 100
+
+
+@pytest.mark.parametrize(
+    "key, value",
+    [
+        ("DETECTION_RATE", "2.7"),
+        ("DETECTION_RATE", "two"),
+        ("SHOW", "maybe"),
+        ("TIMESTAMP_RECT", "(1.5, 2, 3, 4)"),
+        ("TIMESTAMP_RECT", "__import__('os')"),
+    ],
+)
+def test_invalid_values_are_rejected(key, value):
+    with pytest.raises(ValueError, match=f"Invalid value for {key}"):
+        MotionCapConfig.from_dict({"VIDEO": "video.mp4", key: value})
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"DETECTION_RATE": 0},
+        {"CONTOUR_WINDOW_SIZE": -1},
+        {"DECODER": "gstreamer"},
+        {"DECODE_SCALE": 1.5},
+        {"TRACK_MAX_AGE": 0},
+        {"TIMESTAMP": True, "TIMESTAMP_RECT": None},
+        {"TIMESTAMP_RECT": (1, 2, 3)},
+    ],
+)
+def test_invalid_settings_are_rejected(settings):
+    with pytest.raises(ValueError):
+        MotionCapConfig(VIDEO="video.mp4", **settings)
+
+
+def test_scaled_settings():
+    config = MotionCapConfig(
+        VIDEO="video.mp4",
+        TIMESTAMP_RECT=(210, 20, 510, 50),
+        MIN_CONTOUR_AREA=200,
+        MAX_DISTANCE_FROM_TUBE=20,
+        TUBE_REMAP_DISTANCE=25,
+    )
+    scaled = config.scaled(0.5)
+    assert scaled.TIMESTAMP_RECT == (105, 10, 255, 25)
+    assert scaled.MIN_CONTOUR_AREA == 50
+    assert scaled.MAX_DISTANCE_FROM_TUBE == 10
+    assert scaled.TUBE_REMAP_DISTANCE == 12.5
+    assert config.scaled(1) is config
+
+
+def test_dotenv_with_overrides(tmp_path, monkeypatch):
+    env = tmp_path / ".env"
+    env.write_text("VIDEO=video.mp4\nDETECTION_RATE=2\nSHOW=True\n")
+    monkeypatch.delenv("DETECTION_RATE", raising=False)
+    monkeypatch.setenv("SHOW", "False")
+    config = MotionCapConfig.from_dotenv(str(env), {"DETECTION_RATE": "4"})
+    assert config.VIDEO == "video.mp4"
+    assert config.DETECTION_RATE == 4
+    # environment variables take precedence over the file
+    assert config.SHOW is False
@@ -0,0 +1,55 @@
+import numpy as np
+from src.utils.debounce import EventDebouncer
+
+
+def spans(bursts):
+    return [(b.bee_id, b.start_frame, b.end_frame, b.detections) for b in bursts]
+
+
+def test_detections_within_the_granularity_are_one_burst():
+    debouncer = EventDebouncer(granularity=10)
+    for frame in (0, 5, 12, 20):
+        assert debouncer.add(1, frame, {}, None) == []
+    assert debouncer.expire(30) == []
+    assert spans(debouncer.expire(31)) == [(1, 0, 20, 4)]
+    assert debouncer.flush() == []
+
+
+def test_a_later_detection_starts_a_new_burst():
+    debouncer = EventDebouncer(granularity=10)
+    debouncer.add(1, 0, {}, None)
+    assert spans(debouncer.add(1, 11, {}, None)) == [(1, 0, 0, 1)]
+    assert spans(debouncer.flush()) == [(1, 11, 11, 1)]
+
+
+def test_bees_and_event_types_are_debounced_separately():
+    debouncer = EventDebouncer(granularity=10)
+    debouncer.add(1, 0, {}, None, "enter")
+    debouncer.add(1, 2, {}, None, "exit")
+    debouncer.add(2, 4, {}, None, "enter")
+    bursts = debouncer.flush()
+    assert [(b.bee_id, b.event) for b in bursts] == [(1, "enter"), (1, "exit"), (2, "enter")]
+
+
+def test_bursts_are_returned_in_order_of_their_first_frame():
+    debouncer = EventDebouncer(granularity=10)
+    # bee 1 keeps being detected from frame 0, while bee 2's short burst finishes first
+    for frame in range(0, 40, 5):
+        debouncer.add(1, frame, {}, None)
+        if frame == 5:
+            debouncer.add(2, frame, {}, None)
+        # bee 2's burst is finished, but held back behind bee 1's
+        assert debouncer.expire(frame) == []
+    assert spans(debouncer.expire(46)) == [(1, 0, 35, 8), (2, 5, 5, 1)]
+
+
+def test_the_timestamp_crop_of_the_first_detection_is_kept():
+    debouncer = EventDebouncer(granularity=10)
+    crop = np.zeros((2, 2), dtype=np.uint8)
+    debouncer.add(1, 0, {"first": True}, crop)
+    # the frame buffer is reused
+    crop[:] = 255
+    debouncer.add(1, 5, {"first": False}, crop)
+    (burst,) = debouncer.flush()
+    assert burst.assigned_contour == {"first": True}
+    assert not burst.timestamp_crop.any()
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+import pytest
+from src.utils.frame_bus import FrameBus, FrameBusReader
+
+SHAPE = (4, 6)
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(SHAPE, np.uint8, n_consumers=2, fps=30, total_frames=10, slots=2)
+    yield bus
+    bus.unlink()
+
+
+def frame(value: int) -> np.ndarray:
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def test_frames_are_read_in_order_by_every_consumer(bus):
+    readers = [FrameBusReader(bus, 0), FrameBusReader(bus, 1)]
+    bus.publish(frame(1))
+    bus.publish(frame(2))
+    bus.close()
+    for reader in readers:
+        values = []
+        while True:
+            success, read = reader.read()
+            if not success:
+                break
+            assert not read.flags.writeable
+            values.append(int(read[0, 0]))
+        assert values == [1, 2]
+
+
+def test_a_frame_is_released_once_every_consumer_moved_past_it(bus):
+    readers = [FrameBusReader(bus, 0), FrameBusReader(bus, 1)]
+    bus.publish(frame(1))
+    assert list(bus.refcounts) == [2, 0]
+
+    bus.publish(frame(2))
+    readers[0].read()
+    readers[0].read()
+    # the first consumer moved on to frame 2, the second hasn't read frame 1 yet
+    assert list(bus.refcounts) == [1, 2]
+
+    readers[1].read()
+    readers[1].grab()
+    assert list(bus.refcounts) == [0, 2]
+
+
+def test_publish_waits_for_the_slowest_consumer(bus):
+    readers = [FrameBusReader(bus, 0), FrameBusReader(bus, 1)]
+    bus.publish(frame(1))
+    bus.publish(frame(2))
+
+    # the ring is full, so frame 3 waits for frame 1 to be released by both consumers
+    publisher = threading.Thread(target=bus.publish, args=(frame(3),))
+    publisher.start()
+    readers[0].read()
+    readers[0].read()
+    publisher.join(0.2)
+    assert publisher.is_alive()
+
+    readers[1].read()
+    readers[1].read()
+    publisher.join(5)
+    assert not publisher.is_alive()
+    assert int(readers[0].read()[1][0, 0]) == 3
+
+
+def test_a_detached_consumer_releases_its_frames(bus):
+    readers = [FrameBusReader(bus, 0), FrameBusReader(bus, 1)]
+    bus.publish(frame(1))
+    bus.publish(frame(2))
+    readers[1].release()
+    assert list(bus.refcounts) == [1, 1]
+    assert bus.active() == 1
+
+    # new frames are only counted for the consumers still reading
+    readers[0].read()
+    readers[0].read()
+    bus.publish(frame(3))
+    assert list(bus.refcounts) == [1, 1]
+    # detaching twice is harmless
+    readers[1].release()
+    assert list(bus.refcounts) == [1, 1]
+
+
+def test_publish_checks_on_consumers_while_waiting(bus, monkeypatch):
+    monkeypatch.setattr("src.utils.frame_bus.POLL_INTERVAL", 0.01)
+    bus.publish(frame(1))
+    bus.publish(frame(2))
+    # eg. consumer processes that exited without releasing their frames
+    bus.publish(frame(3), check=lambda: (bus.detach(0), bus.detach(1)))
+    assert bus.active() == 0
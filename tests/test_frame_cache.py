@@ -0,0 +1,75 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from src.utils import frame_cache
+from src.utils.frame_cache import CacheWriter, FrameCache
+
+SHAPE = (48, 64)
+TIMESTAMP_SLICE = (slice(0, 8), slice(0, 16))
+
+
+def write_entry(cache: FrameCache, key: str, n_frames: int, complete: bool = True) -> CacheWriter:
+    meta = {
+        "version": 1,
+        "video": "video.mp4",
+        "fps": 30.0,
+        "total_frames": float(n_frames),
+        "scale": 1.0,
+        "timestamp_rect": [0, 0, 16, 8],
+    }
+    writer = CacheWriter(os.path.join(cache.directory, key), meta, SHAPE, TIMESTAMP_SLICE)
+    for i in range(n_frames):
+        frame = np.full(SHAPE + (3,), i, dtype=np.uint8)
+        writer.write(np.full(SHAPE, i, dtype=np.uint8), frame)
+    writer.close(complete)
+    return writer
+
+
+def test_closed_entry_can_be_read_and_deleted(tmp_path):
+    cache = FrameCache(str(tmp_path), max_gb=1)
+    writer = write_entry(cache, "entry", n_frames=3)
+    assert writer.frames is None and writer.crops is None
+
+    source = cache.open("entry")
+    frames = []
+    while True:
+        success, frame = source.read()
+        if not success:
+            break
+        frames.append(int(source.preprocessed[0, 0]))
+    source.release()
+    assert frames == [0, 1, 2]
+
+    assert cache.evict(cache.max_bytes)
+    assert not os.path.exists(os.path.join(cache.directory, "entry"))
+
+
+def mapped_files():
+    with open("/proc/self/maps", "r") as f:
+        return f.read()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc/self/maps")
+def test_memory_maps_are_closed_before_the_entry_is_moved(tmp_path, monkeypatch):
+    # Windows can't rename or delete mapped files, so nothing under the entry may be mapped by then
+    def check_unmapped(function):
+        def wrapper(path, *args, **kwargs):
+            assert str(path) not in mapped_files()
+            return function(path, *args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(frame_cache.os, "rename", check_unmapped(os.rename))
+    monkeypatch.setattr(frame_cache.shutil, "rmtree", check_unmapped(shutil.rmtree))
+    cache = FrameCache(str(tmp_path), max_gb=1)
+    write_entry(cache, "complete", n_frames=3)
+    write_entry(cache, "incomplete", n_frames=3, complete=False)
+    assert os.listdir(cache.directory) == ["complete"]
+
+
+def test_incomplete_entry_is_deleted(tmp_path):
+    cache = FrameCache(str(tmp_path), max_gb=1)
+    write_entry(cache, "entry", n_frames=3, complete=False)
+    assert os.listdir(cache.directory) == []
+    assert cache.open("entry") is None
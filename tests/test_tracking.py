@@ -0,0 +1,85 @@
+import numpy as np
+from src.utils.tracking import BeeTracker, assign
+
+TUBE = (100, 100, 10)
+FRAME = np.zeros((200, 200), dtype=np.uint8)
+
+
+def contour(x, y, near_tube=True) -> dict:
+    """An assigned contour (see `filter_contours`) centered at (x, y)."""
+    return {
+        "contour": None,
+        "bee_id": 0 if near_tube else None,
+        "closest_tube": TUBE if near_tube else None,
+        "bbox": [x - 5, x + 5, y - 5, y + 5],
+        "centroid": (x, y),
+    }
+
+
+def run(tracker: BeeTracker, frames):
+    """Feed the tracker a list of contour lists, one per detection frame, returning all the events."""
+    events = []
+    for frame_count, contours in enumerate(frames):
+        events += tracker.update(contours, FRAME, frame_count)
+    return events + tracker.flush()
+
+
+def test_bee_flying_into_a_tube_enters_it():
+    tracker = BeeTracker(max_distance=30, max_age=2)
+    path = [(160, 100, False), (140, 100, True), (120, 100, True), (105, 100, True)]
+    events = run(tracker, [[contour(x, y, near)] for x, y, near in path] + [[], [], []])
+    assert [(e.event, e.bee_id, e.frame_count) for e in events] == [("enter", 0, 3)]
+
+
+def test_bee_flying_out_of_a_tube_exits_it():
+    tracker = BeeTracker(max_distance=30, max_age=2)
+    path = [(105, 100, True), (120, 100, True), (140, 100, True), (160, 100, False)]
+    events = run(tracker, [[contour(x, y, near)] for x, y, near in path] + [[], [], []])
+    assert [(e.event, e.bee_id, e.frame_count) for e in events] == [("exit", 0, 0)]
+
+
+def test_bee_away_from_the_tubes_logs_nothing():
+    tracker = BeeTracker(max_distance=30, max_age=2)
+    path = [(20, 20), (30, 20), (40, 20)]
+    assert run(tracker, [[contour(x, y, near_tube=False)] for x, y in path]) == []
+
+
+def test_track_ends_after_max_age():
+    tracker = BeeTracker(max_distance=30, max_age=2)
+    assert tracker.update([contour(105, 100)], FRAME, 0) == []
+    assert tracker.update([], FRAME, 1) == []
+    assert tracker.update([], FRAME, 2) == []
+    events = tracker.update([], FRAME, 3)
+    assert [e.event for e in events] == ["enter"]
+    assert tracker.tracks == []
+
+
+def test_jumps_further_than_max_distance_start_a_new_track():
+    tracker = BeeTracker(max_distance=30, max_age=5)
+    tracker.update([contour(100, 100)], FRAME, 0)
+    tracker.update([contour(180, 100, near_tube=False)], FRAME, 1)
+    assert len(tracker.tracks) == 2
+
+
+def test_ghosts_of_the_previous_frame_are_dropped():
+    tracker = BeeTracker(max_distance=30, max_age=5)
+    tracker.update([contour(140, 100)], FRAME, 0)
+    # the difference shows the bee where it was (140, 100) and where it is (120, 100)
+    tracker.update([contour(140, 100), contour(120, 100)], FRAME, 1)
+    assert len(tracker.tracks) == 1
+    assert tracker.tracks[0].last_centroid == (120, 100)
+
+
+def test_timestamp_crops_are_copied():
+    tracker = BeeTracker(max_distance=30, max_age=1, timestamp_slice=(slice(0, 10), slice(0, 10)))
+    frame = np.zeros((200, 200), dtype=np.uint8)
+    tracker.update([contour(105, 100)], frame, 0)
+    frame[:] = 255
+    (event,) = tracker.flush()
+    assert not event.timestamp_crop.any()
+
+
+def test_assign_ignores_pairs_above_the_max_cost():
+    cost = np.array([[1.0, 50.0], [40.0, 2.0], [3.0, 60.0]])
+    assert sorted(assign(cost, max_cost=10)) == [(0, 0), (1, 1)]
+    assert assign(np.empty((0, 2)), max_cost=10) == []
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from src.utils.tube_detection import vote_tube_hives
+
+
+def test_tubes_are_the_median_of_their_circles():
+    circle_sets = [
+        np.array([[100, 100, 20], [200, 100, 20]]),
+        np.array([[102, 99, 21], [201, 100, 20]]),
+        np.array([[101, 101, 19], [199, 102, 22]]),
+    ]
+    tube_hives, confidences = vote_tube_hives(circle_sets, 0.5, 15)
+    assert tube_hives.tolist() == [[101, 100, 20], [200, 100, 20]]
+    assert confidences.tolist() == [1.0, 1.0]
+
+
+def test_circles_found_in_too_few_frames_are_dropped():
+    tube = np.array([[100, 100, 20]])
+    # a bee detected as a circle in one frame out of four
+    bee = np.array([[100, 100, 20], [300, 200, 15]])
+    tube_hives, confidences = vote_tube_hives([tube, tube, bee, tube], 0.5, 15)
+    assert tube_hives.tolist() == [[100, 100, 20]]
+    assert confidences.tolist() == [1.0]
+
+    tube_hives, confidences = vote_tube_hives([tube, tube, bee, tube], 0.25, 15)
+    assert tube_hives.tolist() == [[100, 100, 20], [300, 200, 15]]
+    assert confidences.tolist() == [1.0, 0.25]
+
+
+def test_a_frame_votes_once_per_tube():
+    # two circles of the same tube in one frame start a second cluster instead of voting twice
+    circle_sets = [np.array([[100, 100, 20], [104, 100, 20]]), np.array([[100, 100, 20]])]
+    tube_hives, confidences = vote_tube_hives(circle_sets, 0.5, 15)
+    assert tube_hives.tolist() == [[100, 100, 20], [104, 100, 20]]
+    assert confidences.tolist() == pytest.approx([1.0, 0.5])
+
+
+def test_no_circles():
+    tube_hives, confidences = vote_tube_hives([np.empty((0, 3), dtype=int)] * 3, 0.5, 15)
+    assert tube_hives.shape == (0, 3)
+    assert len(confidences) == 0
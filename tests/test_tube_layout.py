@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from src.config import MotionCapConfig
+from src.utils.tube_layout import (
+    estimate_shift,
+    load_or_detect_tube_hives,
+    make_reference,
+    remap_tube_ids,
+    save_tube_layout,
+    scale_tube_hives,
+)
+
+OLD_TUBES = np.array([[100, 100, 20], [200, 100, 20], [300, 100, 20]])
+
+
+def hotel(shift=(0, 0), shape=(240, 400)) -> np.ndarray:
+    """A frame of bright blobs at the tubes, moved by `shift` (dx, dy)."""
+    frame = np.random.default_rng(0).integers(0, 40, shape, dtype=np.uint8)
+    for x, y, r in OLD_TUBES:
+        x, y = x + shift[0], y + shift[1]
+        frame[y - r : y + r, x - r : x + r] = 255
+    return frame
+
+
+def test_remap_keeps_the_ids_of_moved_tubes():
+    # re-detected in another order, and 5 pixels to the right
+    new_tubes = np.array([[305, 100, 20], [105, 100, 20], [205, 100, 20]])
+    remapped = remap_tube_ids(OLD_TUBES, new_tubes, shift=(5, 0))
+    assert remapped.tolist() == [[105, 100, 20], [205, 100, 20], [305, 100, 20]]
+
+
+def test_remap_keeps_missing_tubes_and_appends_new_ones():
+    new_tubes = np.array([[100, 101, 20], [500, 100, 20]])
+    remapped = remap_tube_ids(OLD_TUBES, new_tubes, max_distance=25)
+    # tubes 1 and 2 weren't re-detected, and keep their stored positions
+    assert remapped.tolist() == [[100, 101, 20], [200, 100, 20], [300, 100, 20], [500, 100, 20]]
+
+
+def test_remap_ignores_tubes_further_than_max_distance():
+    new_tubes = np.array([[130, 100, 20]])
+    assert len(remap_tube_ids(OLD_TUBES, new_tubes, max_distance=25)) == 4
+    assert len(remap_tube_ids(OLD_TUBES, new_tubes, max_distance=35)) == 3
+
+
+def test_estimate_shift():
+    dx, dy = estimate_shift(make_reference(hotel()), hotel(shift=(12, -8)))
+    assert dx == pytest.approx(12, abs=2)
+    assert dy == pytest.approx(-8, abs=2)
+
+
+def test_estimate_shift_of_a_reference_at_another_resolution():
+    full = hotel(shape=(480, 800))
+    half = full[::2, ::2]
+    dx, dy = estimate_shift(make_reference(full), half)
+    assert abs(dx) < 2 and abs(dy) < 2
+
+
+def test_scale_tube_hives():
+    scaled = scale_tube_hives(OLD_TUBES, (240, 400), (120, 200))
+    assert scaled.tolist() == [[50, 50, 10], [100, 50, 10], [150, 50, 10]]
+
+
+def test_layout_survives_a_resolution_change(tmp_path):
+    layout = str(tmp_path / "cam1.npz")
+    save_tube_layout(layout, OLD_TUBES, hotel())
+    config = MotionCapConfig(VIDEO="video.mp4", LOG=None, TUBE_LAYOUT=layout)
+
+    # at half the size the tubes are re-detected in another order, and keep their Bee IDs
+    half = hotel()[::2, ::2]
+    detected = np.array([[150, 50, 10], [50, 50, 10], [100, 50, 10]])
+    tube_hives = load_or_detect_tube_hives(half, config, detect=lambda: (detected, None))
+    assert tube_hives.tolist() == [[50, 50, 10], [100, 50, 10], [150, 50, 10]]